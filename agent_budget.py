@@ -0,0 +1,267 @@
+"""
+规划 Agent 的执行预算。
+
+工具调用次数原先只写在提示词和工具说明里（“搜索次数不要超过15次”），
+AgentExecutor 本身没有任何上限，失控的循环可以跑上好几分钟。这里在代码中强制：
+
+- 每次规划有墙钟截止时间，剩余时间不足以生成最终答案时不再调用工具，
+  进行中的工具调用在截止时间到达时被取消；
+- 工具调用总数和每个工具的调用次数有上限，超出时直接返回提示而不执行；
+- 参数完全相同的重复调用直接返回上一次的结果；
+- 预算用完后下一轮 LLM 调用不再绑定工具，强制基于已有信息输出最终行程。
+
+预算按一次规划（一次 AgentExecutor 调用）隔离，保存在 ContextVar 中，
+执行器可以在多个会话之间共享。
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction, AgentStep
+
+from tool_cache import make_key
+
+logger = logging.getLogger(__name__)
+
+# 一次规划的总时间预算（秒），以及为最终输出预留的时间
+PLAN_DEADLINE = float(os.environ.get("PLAN_DEADLINE", "300"))
+SYNTHESIS_RESERVE = float(os.environ.get("PLAN_SYNTHESIS_RESERVE", "90"))
+# 一次规划中 Agent 最多执行的工具调用总数
+MAX_TOOL_CALLS = int(os.environ.get("AGENT_MAX_TOOL_CALLS", "20"))
+
+# 每个工具的调用次数上限，未列出的工具使用 DEFAULT_TOOL_QUOTA
+TOOL_QUOTAS = {
+    "search_web": 5,
+    "search_google_maps": 15,
+    "search_google_maps_batch": 3,
+    "search_weather": 2,
+    "search_flights": 2,
+    "get-station-code-of-citys": 2,
+    "get-tickets": 4,
+}
+DEFAULT_TOOL_QUOTA = 4
+
+FORCE_SYNTHESIS_MESSAGE = (
+    "【系统通知】{reason}。不要再调用任何工具，请立即基于以上已经获得的信息输出完整的最终行程；"
+    "缺少的信息请如实说明并给出建议。"
+)
+
+
+class PlanBudgetExhausted(RuntimeError):
+    """时间预算内没能得到最终行程（强制输出超时，或 AgentExecutor 因迭代/时间上限停止）"""
+
+
+class PlanBudget:
+    """
+    一次规划的预算和调用记录。
+
+    Args:
+        deadline: 总时间预算（秒），从创建时开始计时
+        reserve: 为最终输出预留的时间（秒）
+        max_tool_calls: 工具调用总数上限
+        quotas: 每个工具的调用次数上限
+        default_quota: 未在 quotas 中列出的工具的上限
+    """
+
+    def __init__(
+        self,
+        deadline: float = PLAN_DEADLINE,
+        reserve: float = SYNTHESIS_RESERVE,
+        max_tool_calls: int = MAX_TOOL_CALLS,
+        quotas: Optional[Dict[str, int]] = None,
+        default_quota: int = DEFAULT_TOOL_QUOTA,
+    ):
+        self.deadline = deadline
+        self.reserve = reserve
+        self.max_tool_calls = max_tool_calls
+        self.quotas = TOOL_QUOTAS if quotas is None else quotas
+        self.default_quota = default_quota
+
+        self.started_at = time.monotonic()
+        self.calls: Counter = Counter()
+        self.attempts = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.forced_reason: Optional[str] = None
+        # AgentExecutor 因 max_iterations / max_execution_time 停止，输出不是行程
+        self.stopped = False
+        self._results: Dict[str, str] = {}
+
+    # ---------- 时间 ----------
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def tool_time_left(self) -> float:
+        """还可以用于工具调用的时间（秒），扣除了最终输出的预留时间"""
+        return self.deadline - self.reserve - self.elapsed()
+
+    def synthesis_time_left(self) -> float:
+        """最终输出还可以使用的时间（秒），到总截止时间为止"""
+        return self.deadline - self.elapsed()
+
+    # ---------- 强制输出 ----------
+    def stop_reason(self) -> Optional[str]:
+        """需要停止调用工具时返回原因"""
+        if self.tool_time_left() <= 0:
+            return f"本次规划的时间预算（{self.deadline:.0f} 秒）即将用完"
+        if self.attempts >= self.max_tool_calls:
+            return f"工具调用已达 {self.max_tool_calls} 次上限"
+        return None
+
+    def should_synthesize(self, _inputs: Any = None) -> bool:
+        """供 Agent 每轮调用前判断；第一次触发时记录原因"""
+        reason = self.stop_reason()
+        if reason and self.forced_reason is None:
+            self.forced_reason = reason
+            logger.info("预算用完，强制生成最终行程: %s", reason)
+        return reason is not None
+
+    # ---------- 工具调用 ----------
+    def quota(self, tool: str) -> int:
+        return self.quotas.get(tool, self.default_quota)
+
+    @staticmethod
+    def call_key(tool: str, tool_input: Any) -> str:
+        params = tool_input if isinstance(tool_input, dict) else {"input": tool_input}
+        return make_key(tool, params)
+
+    def before_call(self, action: AgentAction) -> Optional[str]:
+        """
+        工具执行前检查。返回字符串时以它作为工具结果、不再实际执行；
+        返回 None 时正常执行并计入配额。重复和被拒绝的调用同样计入调用总数。
+        """
+        reason = self.stop_reason()
+        self.attempts += 1
+        previous = self._results.get(self.call_key(action.tool, action.tool_input))
+        if previous is not None:
+            self.duplicates += 1
+            return f"（与之前的调用参数完全相同，以下为上次的结果）\n{previous}"
+
+        if reason:
+            self.rejected += 1
+            return f"{reason}，未执行 {action.tool}，请直接使用已有信息。"
+        if self.calls[action.tool] >= self.quota(action.tool):
+            self.rejected += 1
+            return f"{action.tool} 已达到本次规划的调用上限（{self.quota(action.tool)} 次），请直接使用已有信息。"
+
+        self.calls[action.tool] += 1
+        return None
+
+    def after_call(self, action: AgentAction, observation: Any):
+        self._results[self.call_key(action.tool, action.tool_input)] = str(observation)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "elapsed_s": round(self.elapsed(), 1),
+            "attempts": self.attempts,
+            "tool_calls": dict(self.calls),
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "forced_reason": self.forced_reason,
+            "stopped": self.stopped,
+        }
+
+
+current_budget: ContextVar[Optional[PlanBudget]] = ContextVar("plan_budget", default=None)
+
+
+@contextmanager
+def budget_scope(budget: Optional[PlanBudget] = None) -> Iterator[PlanBudget]:
+    """在当前上下文中启用预算；已有预算时沿用外层的预算"""
+    existing = current_budget.get()
+    if existing is not None:
+        yield existing
+        return
+    budget = budget or PlanBudget()
+    token = current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        current_budget.reset(token)
+
+
+def should_synthesize(inputs: Any = None) -> bool:
+    """当前预算要求停止调用工具时返回 True，没有预算时返回 False"""
+    budget = current_budget.get()
+    return budget is not None and budget.should_synthesize(inputs)
+
+
+def force_synthesis_message() -> str:
+    budget = current_budget.get()
+    reason = (budget and budget.forced_reason) or "工具调用预算已用完"
+    return FORCE_SYNTHESIS_MESSAGE.format(reason=reason)
+
+
+async def within_deadline(coro):
+    """在当前预算的截止时间之前等待最终输出，超时抛出 PlanBudgetExhausted"""
+    budget = current_budget.get()
+    if budget is None:
+        return await coro
+    try:
+        return await asyncio.wait_for(coro, timeout=max(budget.synthesis_time_left(), 0.1))
+    except asyncio.TimeoutError:
+        raise PlanBudgetExhausted(f"未能在 {budget.deadline:.0f} 秒的规划时间预算内生成最终行程") from None
+
+
+class BudgetedAgentExecutor(AgentExecutor):
+    """
+    在代码中强制执行预算的 AgentExecutor。
+
+    每次调用都在独立的预算中运行（外层已通过 `budget_scope` 设置时沿用外层预算，
+    例如把预查询的耗时也计入同一次规划）。
+    """
+
+    budget_factory: Callable[[], PlanBudget] = PlanBudget
+
+    def _call(self, inputs, run_manager=None):
+        with budget_scope(self.budget_factory()):
+            return super()._call(inputs, run_manager)
+
+    async def _acall(self, inputs, run_manager=None):
+        with budget_scope(self.budget_factory()):
+            return await super()._acall(inputs, run_manager)
+
+    def _should_continue(self, iterations: int, time_elapsed: float) -> bool:
+        # 超出上限后 AgentExecutor 返回固定的停止说明而不是行程，记录下来由调用方判为失败
+        if super()._should_continue(iterations, time_elapsed):
+            return True
+        budget = current_budget.get()
+        if budget is not None:
+            budget.stopped = True
+        return False
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None) -> AgentStep:
+        budget = current_budget.get()
+        skipped = budget.before_call(agent_action) if budget else None
+        if skipped is not None:
+            return AgentStep(action=agent_action, observation=skipped)
+        step = super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        if budget:
+            budget.after_call(agent_action, step.observation)
+        return step
+
+    async def _aperform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None) -> AgentStep:
+        budget = current_budget.get()
+        skipped = budget.before_call(agent_action) if budget else None
+        if skipped is not None:
+            return AgentStep(action=agent_action, observation=skipped)
+        coro = super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        if budget is None:
+            return await coro
+        # 进行中的工具调用不能越过截止时间
+        try:
+            step = await asyncio.wait_for(coro, timeout=max(budget.tool_time_left(), 0.1))
+        except asyncio.TimeoutError:
+            budget.rejected += 1
+            return AgentStep(
+                action=agent_action,
+                observation=f"{agent_action.tool} 超出本次规划的时间预算，已取消，请直接使用已有信息。",
+            )
+        budget.after_call(agent_action, step.observation)
+        return step
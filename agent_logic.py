@@ -1,45 +1,66 @@
-import os
 import asyncio
+from datetime import datetime
 from langchain_openai import ChatOpenAI
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain_core.prompts import ChatPromptTemplate
-from tools_update1 import search_web, search_google_maps, search_weather, search_flights, echo_tool
-from langchain_mcp_adapters.client import MultiServerMCPClient
+from tools_update1 import web_search_tool, search_google_maps, search_google_maps_batch, search_weather, search_flights, echo_tool
+from itinerary_calendar import generate_ics_content
+from itinerary_parser import ItineraryParser, remember_parsed
+from mcp_pool import get_mcp_pool
+from prefetch import PREFETCH_TIMEOUT, prefetch_travel_facts, format_prefetched_facts
+from station_index import local_station_code_tool
+from scratchpad import BoundedScratchpad, create_bounded_tool_calling_agent
+from html_validator import validate_html, extract_html, build_fragment_prompt, apply_fragment_fixes
+from streaming import stream_itinerary
+from html_renderer import render_itinerary_html
+from tracing import TraceRecorder, waterfall_rows
+from plan_cache import plan_cache
+from agent_budget import (
+    BudgetedAgentExecutor,
+    MAX_TOOL_CALLS,
+    PLAN_DEADLINE,
+    SYNTHESIS_RESERVE,
+    PlanBudget,
+    PlanBudgetExhausted,
+    budget_scope,
+)
+
+# MCP 服务配置，由 mcp_pool 在进程内只启动一次
+MCP_SERVERS_CONFIG = {
+    "train": {
+        "command": "npx",
+        "args": ["-y", "12306-mcp"],
+        "transport": "stdio",
+    },
+    "flight-ticket-server": {
+        "command": "uv",
+        "args": [
+            "--directory",
+            "/Users/31313/Desktop/bilibili-mcp-server",
+            "run",
+            "bilibili.py"
+        ],
+        "transport": "stdio"
+    },
+}
 
 async def create_travel_agent(llm, serp_api_key: str):
     """创建并返回一个 LangChain Agent Executor"""
     
-    # 1. 将 SerpAPI Key 设置为环境变量，以便工具函数可以访问
-    os.environ["SERP_API_KEY"] = serp_api_key
-
-    # 2. 定义 Agent 可以使用的工具列表
-    tools = [search_web, search_google_maps, search_weather, search_flights]
+    # 1. 定义 Agent 可以使用的工具列表；SerpAPI Key 绑定在本 Agent 的搜索工具上，
+    #    执行器池中不同用户的 Agent 各用各的 Key
+    tools = [web_search_tool(serp_api_key), search_google_maps, search_google_maps_batch, search_weather, search_flights]
 
     
-    # 启动 MCP client
-    servers_config = {
-        "train": {
-            "command": "npx",
-            "args": ["-y", "12306-mcp"],
-            "transport": "stdio",
-        }
-    }
-
-    servers_config["flight-ticket-server"] = {
-       "command": "uv",
-      "args": [
-        "--directory",
-        "/Users/31313/Desktop/bilibili-mcp-server",
-        "run",
-        "bilibili.py"
-      ],
-        "transport": "stdio"
-    }
-
-    client = MultiServerMCPClient(servers_config)
-    mcp_tools = await client.get_tools()
+    # 从进程级连接池获取 MCP 工具，服务进程在所有会话间共享
+    mcp_tools = await get_mcp_pool(MCP_SERVERS_CONFIG).get_tools()
+    # 车站编码优先用本地索引解析，查票只需一次 get-tickets 调用
+    mcp_tools = [
+        local_station_code_tool(t) if t.name == "get-station-code-of-citys" else t
+        for t in mcp_tools
+    ]
     tools += mcp_tools
-    # 3. 创建一个提示模板，指导 Agent 的行为
+    # 2. 创建一个提示模板，指导 Agent 的行为
     prompt = ChatPromptTemplate.from_messages([
     ("system", """# Role: 资深旅行策划AI助手
 
@@ -53,11 +74,13 @@ async def create_travel_agent(llm, serp_api_key: str):
    - 明确用户指定的 `[目的地具体名称]`、`[期望出行时间]` 与 `[兴趣偏好]`。
 2. **信息搜集与分析**  
    - 使用 MCP 工具 (12306) 查询车票，不仅要根据出行时间查询出发的车票，也要根据旅行时间推算返程时间，查询返程的车票。  
-   - 使用 `search_flights` 查询机票，不仅要根据出行时间查询出发的机票，也要根据旅行时间推算返程时间，查询返程的机票,不要跳过。  
-   - 使用 `search_weather` 查询 `[目的地具体名称]` 在 `[期望出行时间]` 的天气情况（优先查询time_frame = ten_day，再根据行程天数截取），输入最好是: City, State, Country or City, Country。
+   - 使用 `search_flights` 查询机票，根据旅行时间推算返程日期，通过 `return_date` 参数在一次调用中同时查询去程和返程的机票,不要跳过。  
+   - 使用 `search_weather` 查询 `[目的地具体名称]` 在 `[期望出行时间]` 的天气情况，传入行程开始日期 `start_date` 和天数 `num_days`，工具只返回行程内的逐日天气；多城市行程把所有城市放进 `locations` 一次查询，地点最好是: City, State, Country or City, Country。
    - 使用 `search_web` 收集目的地的必游景点、当地美食、特色活动和交通选择。  
-   - 使用 `search_google_maps` 搜索酒店、餐厅、景点等具体场所,并进行路线规划逻辑，为每日行程中的景点/活动点设计合理的游览顺序，将相关酒店、景点的链接使用超链接的形式插入到行程中，酒店，餐厅的电话应该直接注释在一旁
+   - 使用 `search_google_maps_batch` 一次性搜索同一城市的酒店、餐厅、景点等具体场所（单个补充查询再用 `search_google_maps`）,并进行路线规划逻辑，为每日行程中的景点/活动点设计合理的游览顺序，将相关酒店、景点的链接使用超链接的形式插入到行程中，酒店，餐厅的电话应该直接注释在一旁
    - 只使用bilibili的general_search`: 基础搜索功能， 搜索旅游线路规划中的景点，餐厅，酒店的体验、攻略视频，要求输出播放量较高的视频的链接信息
+   - 如果用户消息中附带了【预查询信息】，直接使用其中的车票、机票、天气和网络信息，不要重复查询，只补充缺失的部分。
+   - 搜索类工具返回 `|` 分隔的表格（首行为表头）；只需浏览候选时可传 `verbosity="brief"`，需要完整长文本时传 `verbosity="full"`（会直接命中缓存）。
    - 在收集到足够信息后，立即停止工具调用。
 3. **行程规划与撰写**  
    - 按天设计详细行程，结合用户兴趣,旅行偏好，具体要求，行程节奏和目的地特色，推荐合理的景点顺序和交通方式（步行/打车/公交简述即可）。  
@@ -83,22 +106,34 @@ async def create_travel_agent(llm, serp_api_key: str):
 ])
 
 
-    # 4. 创建 Agent
-    agent = create_tool_calling_agent(llm, tools, prompt)
+    # 3. 创建 Agent（scratchpad 超出 token 预算时压缩较早的工具结果）
+    agent = create_bounded_tool_calling_agent(llm, tools, prompt, BoundedScratchpad())
 
-    # 5. 创建 Agent 执行器
-    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+    # 4. 创建 Agent 执行器：时间预算、工具配额和重复调用检测在代码中强制执行，
+    #    max_iterations / max_execution_time 只作为最后的保险
+    agent_executor = BudgetedAgentExecutor(
+        agent=agent,
+        tools=tools,
+        verbose=True,
+        max_iterations=MAX_TOOL_CALLS + 5,
+        max_execution_time=PLAN_DEADLINE + SYNTHESIS_RESERVE,
+    )
 
     return agent_executor
 
-async def get_langchain_plan(agent_executor, from_station, to_station, num_days, start_date):
+async def get_langchain_plan(agent_executor, from_station, to_station, num_days, start_date, callbacks=None):
     """使用 LangChain Agent 生成行程,包括车票信息"""
     prompt = (
         f"请为我规划一个从 {from_station} 出发到 {to_station} 的 {num_days} 天旅行，"
         f"出发日期为 {start_date}。"
         "请先用车票工具查询车次，然后把车票信息纳入行程规划。"
     )
-    response = await agent_executor.ainvoke({"input": prompt})
+    # 并发预查询交通、天气和网络信息，减少 Agent 串行调用工具的轮数
+    facts = await prefetch_travel_facts(
+        agent_executor.tools, from_station, to_station, start_date, num_days, callbacks=callbacks
+    )
+    prompt += format_prefetched_facts(facts, num_days)
+    response = await agent_executor.ainvoke({"input": prompt}, config={"callbacks": callbacks})
     return response["output"]
 
 async def create_html_agent(llm):
@@ -120,13 +155,15 @@ async def create_html_agent(llm):
     html_agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
     
     return html_agent_executor
-async def generate_html_itinerary(agent_executor, itinerary_text: str) -> str:
+async def generate_html_itinerary(agent_executor, itinerary_text: str, callbacks=None, raise_errors: bool = False) -> str:
     """
     使用LLM将文本行程转换为美观的HTML格式旅行规划表，适合A4纸打印。
     
     Args:
         llm: 语言模型实例
         itinerary_text: 文本格式的旅行行程
+        callbacks: 可选的 LangChain 回调（如 TraceRecorder）
+        raise_errors: True 时出错直接抛出异常，否则返回错误说明文本
         
     Returns:
         HTML格式的旅行规划表字符串
@@ -252,25 +289,47 @@ async def generate_html_itinerary(agent_executor, itinerary_text: str) -> str:
         full_prompt = html_prompt + "\n\n" + itinerary_text
         
         # 使用LLM生成HTML
-        response = await agent_executor.ainvoke({"input": full_prompt})
+        response = await agent_executor.ainvoke({"input": full_prompt}, config={"callbacks": callbacks})
         
         return response["output"]
         
     except Exception as e:
+        if raise_errors:
+            raise
         return f"生成HTML行程时出错: {e}"
     
-async def review_and_optimize_html(agent_executor, initial_html: str) -> str:
+async def review_and_optimize_html(agent_executor, initial_html: str, callbacks=None, raise_errors: bool = False) -> str:
     """
     使用第二个prompt对初始HTML代码进行审查和优化。
+
+    先在本地检查 HTML：没有缺陷时直接返回，不再调用 LLM；缺陷可以定位到片段时
+    只把这些片段发给 LLM 修复；无法定位、或片段修复后仍有缺陷时才整份审查。
     
     Args:
         llm: 语言模型实例
         initial_html: 初始HTML代码
+        callbacks: 可选的 LangChain 回调（如 TraceRecorder）
+        raise_errors: True 时出错直接抛出异常，否则返回错误说明文本
         
     Returns:
         优化后的HTML代码字符串
     """
     try:
+        # 本地检查：去掉引导文字和代码块标记后再看剩余缺陷
+        html = extract_html(initial_html)
+        report = validate_html(html)
+        if report.is_clean:
+            return html
+
+        fragment_prompt = build_fragment_prompt(report)
+        if fragment_prompt is not None:
+            response = await agent_executor.ainvoke({"input": fragment_prompt}, config={"callbacks": callbacks})
+            fixed, complete = apply_fragment_fixes(html, response["output"])
+            if complete and validate_html(fixed).is_clean:
+                return fixed
+            # 有替换项没能应用，或修复后仍有缺陷：在已修复的基础上改为整份审查
+            html = fixed
+
         # 二次审查的prompt
         review_prompt = """# Role: 代码二次审查助手
 
@@ -351,12 +410,180 @@ async def review_and_optimize_html(agent_executor, initial_html: str) -> str:
 
 请仔细处理输入，提取代码，并尽你所能将其打磨成一份符合所有原始设计要求、既美观又实用的旅行规划表，并仅输出纯净的HTML结果。"""
     # 组合提示词和初始HTML代码
-        full_prompt = review_prompt + "\n\n" + initial_html
+        full_prompt = review_prompt + "\n\n" + html
         
         # 使用LLM进行二次审查和优化
-        response = await agent_executor.ainvoke({"input": full_prompt})
+        response = await agent_executor.ainvoke({"input": full_prompt}, config={"callbacks": callbacks})
         
         return response["output"]
         
     except Exception as e:
-        return f"审查和优化HTML时出错: {e}"
\ No newline at end of file
+        if raise_errors:
+            raise
+        return f"审查和优化HTML时出错: {e}"
+
+
+async def _speculated_facts(prefetched):
+    """
+    接管填写表单时启动的推测性预查询。
+
+    推测被取消或失败时返回 None，由调用方重新预查询；仍在进行时最多再等待一个正常
+    预查询的截止时间，超时后与正常预查询超时一样返回空结果，由 Agent 自行补充。
+    等待超时不会取消推测，迟到的工具结果仍会写入 tool_cache 供 Agent 复用。
+    """
+    if prefetched is None:
+        return None
+    try:
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(prefetched)), timeout=PREFETCH_TIMEOUT)
+    except asyncio.TimeoutError:
+        return {}
+    except asyncio.CancelledError:
+        # 推测本身被取消时改为重新预查询；规划任务被取消时一并取消推测并继续向上抛出
+        if prefetched.cancelled():
+            return None
+        prefetched.cancel()
+        raise
+    except Exception:
+        return None
+
+
+async def _run_planning(job, agent_executor, request: dict, recorder: TraceRecorder, prefetched=None) -> str:
+    """预查询 + 流式规划，返回行程文本"""
+    from_station, to_station = request["from_station"], request["to_station"]
+    start_date, num_days = request["start_date"], request["num_days"]
+
+    job.update("正在并行查询交通、天气和目的地信息", 0.05)
+    with recorder.stage("prefetch"):
+        facts = await _speculated_facts(prefetched)
+        if facts:
+            job.log("⚡ 已复用填写表单时预查询的交通、天气和目的地信息")
+        elif facts is not None:
+            job.log("⏱️ 预查询未取得结果，由 AI Agent 自行查询所需信息")
+        else:
+            facts = await prefetch_travel_facts(
+                agent_executor.tools, from_station, to_station, start_date, num_days, callbacks=[recorder]
+            )
+    prompt = request["prompt"] + format_prefetched_facts(facts, num_days)
+
+    # 流式规划：工具调用推进进度，最终答案的 token 实时写入 job.text
+    job.update("AI Agent 正在思考和规划中", 0.2)
+
+    def on_tool(event):
+        if event.status == "start":
+            job.log(f"🔧 正在{event.label}…")
+        else:
+            job.log(f"✅ {event.label} 完成（{event.elapsed:.1f} 秒）")
+            job.update(progress=job.progress + 0.05)
+
+    # 边接收边解析行程，生成 HTML 和 ICS 时不必再解析一遍
+    parser = ItineraryParser()
+
+    def on_token(text):
+        job.text = text
+        parser.feed(text[parser.length:])
+        job.update("正在撰写行程", 0.6)
+
+    with recorder.stage("plan"):
+        result = await stream_itinerary(agent_executor, prompt, on_tool, on_token, callbacks=[recorder])
+    remember_parsed(result.output, parser)
+    return result.output
+
+
+async def run_plan_job(
+    job,
+    router,
+    request: dict,
+    fast_html: bool = True,
+    cache_key: str = None,
+    prefetched=None,
+):
+    """
+    后台任务队列中执行的完整规划流程：预查询 → 流式规划 → 生成 HTML。
+
+    进度、工具调用日志和流式文本写入 `job`，供界面轮询展示。
+
+    Args:
+        job: job_queue.Job
+        router: model_tiers.StageRouter，按阶段选择模型档位对应的执行器
+        request: 表单内容，包含 from_station / to_station / start_date / num_days / prompt
+        fast_html: True 时用本地模板渲染 HTML，False 时调用 LLM 生成并审查
+        cache_key: plan_cache 的缓存键，给出时成功结果写入整体规划缓存
+        prefetched: 填写表单时启动的推测性预查询（concurrent.futures.Future），
+            给出时直接使用其结果，不再重新预查询
+
+    Returns:
+        {"itinerary": 行程文本, "final_html": HTML, "ics": ICS 文件内容,
+         "trace": 追踪摘要、瀑布图数据与执行预算统计}
+    """
+    # 记录本次规划每一步的耗时和 token，写入 logs/trace.jsonl
+    recorder = TraceRecorder()
+    to_station, start_date, num_days = request["to_station"], request["start_date"], request["num_days"]
+
+    def on_fallback(tier, fallback):
+        job.log(f"⚠️ {tier.model_id} 超时（{tier.timeout:g} 秒），改用 {fallback.model_id} 重新执行")
+
+    budgets = []
+
+    async def _plan(executor):
+        # 预查询和 Agent 循环共用同一个时间预算；超时换档位重试时使用新的预算，
+        # 不继承上一次尝试已用掉的时间、调用次数和强制输出状态
+        with budget_scope(PlanBudget()) as attempt_budget:
+            budgets.append(attempt_budget)
+            return await _run_planning(job, executor, request, recorder, prefetched)
+
+    itinerary = await router.run("plan", _plan, on_fallback)
+    budget = budgets[-1]
+    if budget.stopped:
+        # AgentExecutor 返回的是固定的停止说明，不能当作行程展示或缓存
+        raise PlanBudgetExhausted("AI Agent 达到迭代或时间上限后停止，未生成行程")
+    if budget.forced_reason:
+        job.log(f"⏱️ {budget.forced_reason}，已基于现有信息生成行程")
+
+    failed = False
+    if fast_html:
+        job.update("正在生成 HTML 报告", 0.9)
+        with recorder.stage("html_render"):
+            final_html = render_itinerary_html(itinerary, to_station, start_date, num_days)
+    else:
+        # 任一步出错时把错误说明作为 HTML 展示，整个结果不写入缓存
+        try:
+            job.update("正在生成精美的 HTML 报告", 0.7)
+            with recorder.stage("html_generate"):
+                initial_html = await router.run(
+                    "html_generate",
+                    lambda executor: generate_html_itinerary(executor, itinerary, callbacks=[recorder], raise_errors=True),
+                    on_fallback,
+                )
+        except Exception as e:
+            final_html, failed = f"生成HTML行程时出错: {e}", True
+        else:
+            try:
+                job.update("正在审查和优化 HTML", 0.85)
+                with recorder.stage("html_review"):
+                    final_html = await router.run(
+                        "html_review",
+                        lambda executor: review_and_optimize_html(
+                            executor, initial_html, callbacks=[recorder], raise_errors=True
+                        ),
+                        on_fallback,
+                    )
+            except Exception as e:
+                final_html, failed = f"审查和优化HTML时出错: {e}", True
+
+    # 日历文件随结果一起生成，生成失败时不影响行程和 HTML，也不写入缓存
+    try:
+        with recorder.stage("ics"):
+            ics_content = generate_ics_content(itinerary, datetime.combine(start_date, datetime.min.time()))
+    except Exception:
+        ics_content, failed = None, True
+    artifacts = {"itinerary": itinerary, "final_html": final_html, "ics": ics_content}
+    # 预算用完强制输出、或有工具调用被预算拒绝/取消时，行程是基于不完整信息生成的，
+    # 只展示给本次用户，不写入缓存
+    degraded = budget.forced_reason is not None or budget.rejected > 0
+    if cache_key and not failed and not degraded:
+        plan_cache.put(cache_key, artifacts, start_date)
+
+    return {
+        **artifacts,
+        "trace": {"summary": recorder.summary(), "rows": waterfall_rows(recorder.spans), "budget": budget.stats()},
+    }
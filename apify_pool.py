@@ -0,0 +1,233 @@
+"""
+Apify Token 池。
+
+原先每个工具固定使用一个 Key（地图 APIFY_API_1、天气 _2、航班 _3），负载上来时
+一个工具撞上账号的并发或额度上限，其余 Key 却闲着。这里把所有 Key 放进一个池，
+所有基于 Apify 的工具都从池中借用：
+
+- 每个 Key 有同时运行的 Actor 数上限，借满时换其他 Key 或等待；
+- 记录每个 Key 已花费的额度（Actor 运行结果中的 usageTotalUsd）和 429 次数；
+- 按剩余余量加权随机选择：空闲并发名额越多、剩余额度越多的 Key 越容易被选中；
+- 收到 429 的 Key 暂停一段时间（连续 429 时加倍），额度用尽的 Key 长时间停用。
+
+Key 来自 APIFY_API_TOKENS（逗号分隔），兼容旧的 APIFY_API_1/2/3。
+池是进程级单例，所有会话共享并发计数和停用状态。
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 每个 Key 同时运行的 Actor 数上限
+APIFY_MAX_RUNS_PER_KEY = int(os.environ.get("APIFY_MAX_RUNS_PER_KEY", "4"))
+# 每个 Key 的额度上限（美元），未设置时不按额度加权
+APIFY_CREDIT_LIMIT_USD = float(os.environ.get("APIFY_CREDIT_LIMIT_USD", "0")) or None
+# 收到 429 后暂停的时间（秒），连续 429 时加倍，不超过 THROTTLE_EJECT_MAX
+THROTTLE_EJECT = 10.0
+THROTTLE_EJECT_MAX = 300.0
+# 额度用尽（402 或额度类错误）后停用的时间（秒）
+EXHAUSTED_EJECT = float(os.environ.get("APIFY_EXHAUSTED_EJECT", "3600"))
+# 所有 Key 都借满时重新检查的间隔（秒）
+ACQUIRE_POLL = 0.2
+
+# Apify 返回的额度类错误
+EXHAUSTED_ERROR_TYPES = ("not-enough-usage-to-run-paid-actor", "platform-feature-disabled", "usage-limit-exceeded")
+
+
+class NoApifyKeyAvailable(Exception):
+    """没有配置 Key，或在等待时间内没有可用的 Key"""
+
+
+class ApifyKey:
+    """一个 Key 的运行状态；只在持有池锁时修改"""
+
+    def __init__(self, token: str, max_runs: int = APIFY_MAX_RUNS_PER_KEY, credit_limit: Optional[float] = APIFY_CREDIT_LIMIT_USD):
+        self.token = token
+        self.max_runs = max_runs
+        self.credit_limit = credit_limit
+        self.in_flight = 0
+        self.runs = 0
+        self.spent_usd = 0.0
+        self.throttled = 0
+        self.consecutive_throttles = 0
+        self.ejected_until = 0.0
+
+    @property
+    def label(self) -> str:
+        """日志和指标中只出现 Key 的末 4 位"""
+        return f"…{self.token[-4:]}"
+
+    def available(self, now: float) -> bool:
+        return self.in_flight < self.max_runs and now >= self.ejected_until and self.credit_left() != 0.0
+
+    def credit_left(self) -> Optional[float]:
+        if self.credit_limit is None:
+            return None
+        return max(self.credit_limit - self.spent_usd, 0.0)
+
+    def weight(self) -> float:
+        """余量权重：空闲并发名额 × 剩余额度比例"""
+        weight = float(self.max_runs - self.in_flight)
+        if self.credit_limit:
+            weight *= self.credit_left() / self.credit_limit
+        return weight
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "runs": self.runs,
+            "spent_usd": round(self.spent_usd, 4),
+            "credit_left_usd": None if self.credit_limit is None else round(self.credit_left(), 4),
+            "throttled": self.throttled,
+            "ejected_s": round(max(self.ejected_until - now, 0.0), 1),
+        }
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    return getattr(exc, "status_code", None)
+
+
+class ApifyKeyPool:
+    """
+    Apify Key 池，线程安全，同步和异步调用共用。
+
+        with pool.lease(timeout) as key:            # 同步
+            run = get_apify_client(key.token)...
+            pool.record_run(key, run)
+
+        async with pool.alease(timeout) as key:     # 异步
+            ...
+    """
+
+    def __init__(self, tokens: List[str], max_runs: int = APIFY_MAX_RUNS_PER_KEY, credit_limit: Optional[float] = APIFY_CREDIT_LIMIT_USD):
+        self.keys = [ApifyKey(t, max_runs, credit_limit) for t in dict.fromkeys(t for t in tokens if t)]
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    def _try_acquire(self) -> Optional[ApifyKey]:
+        """在持有锁时调用：按余量加权随机借出一个 Key"""
+        now = time.monotonic()
+        candidates = [k for k in self.keys if k.available(now)]
+        weights = [k.weight() for k in candidates]
+        if not candidates or not any(weights):
+            return None
+        key = random.choices(candidates, weights=weights)[0]
+        key.in_flight += 1
+        key.runs += 1
+        return key
+
+    def _release(self, key: ApifyKey, error: Optional[BaseException]):
+        with self._released:
+            key.in_flight -= 1
+            if error is not None:
+                self._on_error(key, error)
+            elif key.consecutive_throttles:
+                key.consecutive_throttles = 0
+            self._released.notify_all()
+
+    def _on_error(self, key: ApifyKey, error: BaseException):
+        """在持有锁时调用：429 暂停，额度用尽长时间停用"""
+        now = time.monotonic()
+        status, error_type = _status_code(error), getattr(error, "type", None)
+        if status == 402 or error_type in EXHAUSTED_ERROR_TYPES:
+            key.ejected_until = now + EXHAUSTED_EJECT
+            logger.warning("Apify Key %s 额度已用尽，停用 %.0f 秒", key.label, EXHAUSTED_EJECT)
+        elif status == 429:
+            key.throttled += 1
+            key.consecutive_throttles += 1
+            pause = min(THROTTLE_EJECT * 2 ** (key.consecutive_throttles - 1), THROTTLE_EJECT_MAX)
+            key.ejected_until = now + pause
+            logger.warning("Apify Key %s 被限流，暂停 %.0f 秒", key.label, pause)
+
+    def _unavailable(self) -> NoApifyKeyAvailable:
+        if not self.keys:
+            return NoApifyKeyAvailable("Apify API Key 未设置（APIFY_API_TOKENS）。")
+        return NoApifyKeyAvailable("所有 Apify Key 都已达到并发上限或被暂时停用，请稍后再试。")
+
+    # ---------- 借用 ----------
+    @contextmanager
+    def lease(self, timeout: float) -> Iterator[ApifyKey]:
+        """借用一个 Key，最多等待 timeout 秒；退出时归还，异常会计入该 Key 的状态"""
+        deadline = time.monotonic() + timeout
+        with self._released:
+            key = self._try_acquire()
+            while key is None and self.keys:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # 被停用的 Key 到期不会触发通知，因此定期重新检查
+                self._released.wait(min(remaining, ACQUIRE_POLL))
+                key = self._try_acquire()
+        if key is None:
+            raise self._unavailable()
+        try:
+            yield key
+        except Exception as e:
+            self._release(key, e)
+            raise
+        except BaseException:
+            self._release(key, None)
+            raise
+        else:
+            self._release(key, None)
+
+    @asynccontextmanager
+    async def alease(self, timeout: float) -> AsyncIterator[ApifyKey]:
+        """异步版本的 `lease`，等待时不阻塞事件循环"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                key = self._try_acquire()
+            if key is not None or not self.keys or time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(ACQUIRE_POLL)
+        if key is None:
+            raise self._unavailable()
+        try:
+            yield key
+        except Exception as e:
+            self._release(key, e)
+            raise
+        except BaseException:
+            self._release(key, None)
+            raise
+        else:
+            self._release(key, None)
+
+    def record_run(self, key: ApifyKey, run: Optional[dict]):
+        """记录 Actor 运行花费的额度"""
+        usage = (run or {}).get("usageTotalUsd")
+        if usage:
+            with self._lock:
+                key.spent_usd += float(usage)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return {k.label: k.stats(now) for k in self.keys}
+
+
+def configured_tokens() -> List[str]:
+    tokens = [t.strip() for t in os.environ.get("APIFY_API_TOKENS", "").split(",")]
+    tokens += [os.environ.get(f"APIFY_API_{i}") for i in (1, 2, 3)]
+    return [t for t in tokens if t]
+
+
+# ==================== 进程级单例 ====================
+_pool: Optional[ApifyKeyPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_apify_pool() -> ApifyKeyPool:
+    """返回进程内唯一的 Apify Key 池，首次调用时读取环境变量"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ApifyKeyPool(configured_tokens())
+        return _pool
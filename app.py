@@ -1,26 +1,18 @@
 import streamlit as st
 import asyncio
-import threading
-from langchain_openai import ChatOpenAI
-from agent_logic import create_travel_agent, create_html_agent, get_langchain_plan, generate_html_itinerary, review_and_optimize_html
-from tools_update1 import generate_ics_content
+from agent_logic import run_plan_job
+from executor_pool import get_executor_pool
+from plan_cache import plan_cache, plan_cache_key
+from speculative import SpeculativePrefetch
+from upstreams import upstream_stats
+from apify_pool import get_apify_pool
+from job_queue import get_job_queue, QueueFullError, DONE, FAILED, QUEUED
 from datetime import datetime
 
 # ==================== 异步事件循环管理 ====================
-# 在一个后台线程中运行独立的事件循环，避免与Streamlit冲突
-def get_or_create_eventloop():
-    try:
-        return asyncio.get_event_loop()
-    except RuntimeError as ex:
-        if "There is no current event loop in thread" in str(ex):
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            return asyncio.get_event_loop()
-
-# 运行异步函数的辅助工具
-def run_async(coro):
-    loop = get_or_create_eventloop()
-    return loop.run_until_complete(coro)
+# 所有异步工作都提交到进程级的后台事件循环线程（async_runtime），
+# MCP 会话、HTTP 连接池、Agent 执行器等在所有会话和重跑之间只存在一份
+AGENT_INIT_TIMEOUT = 180
 
 # ==================== Streamlit UI 设置 ====================
 st.set_page_config(page_title="GGGroup AI 旅行计划器", page_icon="✈️", layout="wide")
@@ -94,16 +86,24 @@ st.markdown("""
 
 
 # 初始化 session state
-if 'agent_executor' not in st.session_state:
-    st.session_state.agent_executor = None
-if 'html_agent_executor' not in st.session_state:
-    st.session_state.html_agent_executor = None
-if 'html_agent_executor2' not in st.session_state:
-    st.session_state.html_agent_executor2 = None
+if 'agents' not in st.session_state:
+    st.session_state.agents = None
 if 'itinerary' not in st.session_state:
     st.session_state.itinerary = None
 if 'final_html' not in st.session_state:
     st.session_state.final_html = None
+if 'ics' not in st.session_state:
+    st.session_state.ics = None
+if 'last_trace' not in st.session_state:
+    st.session_state.last_trace = None
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = None
+if 'plan_request' not in st.session_state:
+    st.session_state.plan_request = None
+if 'job_error' not in st.session_state:
+    st.session_state.job_error = None
+if 'speculation' not in st.session_state:
+    st.session_state.speculation = SpeculativePrefetch()
 
 # ==================== 侧边栏配置 ====================
 with st.sidebar:
@@ -132,26 +132,33 @@ with st.sidebar:
 
         serp_api_key = st.text_input("输入 Serp API Key (用于网络搜索)", type="password")
 
-    # 初始化 Agent
-    if api_key and serp_api_key and not st.session_state.agent_executor:
+    html_mode = st.radio(
+        "HTML 报告模式",
+        ("快速（本地模板）", "精美（LLM 生成）"),
+        help="快速模式用本地模板即时生成；精美模式额外调用两次大模型生成并审查 HTML，耗时较长。"
+    )
+
+    # 从进程级执行器池取得 Agent：相同模型配置和密钥的会话共享同一组执行器
+    if api_key and serp_api_key:
+        pool = get_executor_pool()
         try:
-            with st.spinner("正在初始化AI Agent..."):
-                llm = ChatOpenAI(
-                    model=model_id,
-                    api_key=api_key,
-                    base_url=base_url,
-                    temperature=0,
-                    streaming=True
-                )
-                # 使用 run_async 运行异步初始化
-                st.session_state.agent_executor = run_async(create_travel_agent(llm, serp_api_key))
-                st.session_state.html_agent_executor = run_async(create_html_agent(llm))
-                st.session_state.html_agent_executor2 = run_async(create_html_agent(llm))
-            st.success("✅ AI Agent 初始化成功！")
+            if pool.make_key(model_id, base_url, api_key, serp_api_key) in pool:
+                st.session_state.agents = pool.acquire(model_id, base_url, api_key, serp_api_key)
+            else:
+                with st.spinner("正在初始化AI Agent..."):
+                    st.session_state.agents = pool.acquire(
+                        model_id, base_url, api_key, serp_api_key, timeout=AGENT_INIT_TIMEOUT
+                    )
+                st.success("✅ AI Agent 初始化成功！")
+        except asyncio.TimeoutError:
+            st.error(f"初始化 AI Agent 超时（{AGENT_INIT_TIMEOUT} 秒），请检查 MCP 服务后重试。")
+            st.stop()
         except Exception as e:
             st.error(f"初始化 AI Agent 时出错: {e}")
             st.stop()
-    if not st.session_state.agent_executor:
+    else:
+        st.session_state.agents = None
+    if not st.session_state.agents:
         st.markdown("""
             <div class="config-warning">
                 👈 请完成上方API配置以启动Agent
@@ -159,20 +166,27 @@ with st.sidebar:
         """, unsafe_allow_html=True)
 
 # ==================== 主界面 ====================
-if not st.session_state.agent_executor:
+if not st.session_state.agents:
     st.stop()
 
-with st.form("travel_form"):
-    st.header("📝 填写您的旅行需求")
-    
-    col1, col2 = st.columns(2)
-    with col1:
-        from_station = st.text_input("您的出发地", placeholder="例如：上海")
-        start_date = st.date_input("出发日期", value=datetime.today())
-    with col2:
-        to_station = st.text_input("您想去哪里？", placeholder="例如：日本东京")
-        num_days = st.number_input("您想旅行多少天？", min_value=1, max_value=30, value=7)
+st.header("📝 填写您的旅行需求")
+
+# 出发地、目的地和日期放在表单外：修改后立即重跑脚本，在用户填写偏好的同时
+# 后台预查询交通、天气和目的地信息，提交后规划任务直接复用
+col1, col2 = st.columns(2)
+with col1:
+    from_station = st.text_input("您的出发地", placeholder="例如：上海")
+    start_date = st.date_input("出发日期", value=datetime.today())
+with col2:
+    to_station = st.text_input("您想去哪里？", placeholder="例如：日本东京")
+    num_days = st.number_input("您想旅行多少天？", min_value=1, max_value=30, value=7)
+
+if st.session_state.speculation.update(
+    st.session_state.agents.plan_executor.tools, from_station, to_station, start_date, num_days
+):
+    st.caption("⚡ 正在后台预查询交通、天气和目的地信息")
 
+with st.form("travel_form"):
     st.subheader("旅行偏好")
     col3, col4 = st.columns(2)
     with col3:
@@ -199,9 +213,6 @@ if submit_button:
     if not to_station or not from_station:
         st.warning("请输入出发地和目的地。")
     else:
-        st.session_state.itinerary = None
-        st.session_state.final_html = None
-        
         prompt = (
             f"请为我规划一个从 {from_station} 出发到 {to_station} 的 {num_days} 天旅行，"
             f"出发日期为 {start_date.strftime('%Y-%m-%d')}。"
@@ -210,42 +221,149 @@ if submit_button:
             f"其他具体要求：{specific_requirements if specific_requirements else '无'}。"
             "请先用车票或机票工具查询交通信息，然后把这些信息纳入行程规划。"
         )
+        request = {
+            "from_station": from_station,
+            "to_station": to_station,
+            "start_date": start_date,
+            "num_days": num_days,
+            "travel_style": travel_style,
+            "trip_pace": trip_pace,
+            "specific_requirements": specific_requirements,
+            "prompt": prompt,
+        }
+        agents = st.session_state.agents
+        cache_key = plan_cache_key(request, agents.key.model_id, agents.key.base_url, html_mode)
+        cached = plan_cache.get(cache_key)
 
-        with st.spinner("AI Agent 正在思考和规划中..."):
-            try:
-                response = run_async(st.session_state.agent_executor.ainvoke({"input": prompt}))
-                itinerary_text = response["output"]
-                st.session_state.itinerary = itinerary_text
-            except Exception as e:
-                st.error(f"Agent 执行出错: {e}")
-                st.stop()
-        
-        with st.spinner("正在生成精美的HTML报告..."):
+        if cached is not None:
+            # 相同的需求在交通数据有效期内直接复用上一次的完整结果
+            st.session_state.job_id = None
+            st.session_state.plan_request = request
+            st.session_state.itinerary = cached["itinerary"]
+            st.session_state.final_html = cached["final_html"]
+            st.session_state.ics = cached["ics"]
+            st.session_state.job_error = None
+            st.toast("⚡ 已复用相同需求的规划结果")
+        else:
+            # 规划交给后台任务队列执行，脚本线程只负责轮询进度
             try:
-                initial_html = run_async(generate_html_itinerary(st.session_state.html_agent_executor, st.session_state.itinerary))
-                final_html = run_async(review_and_optimize_html(st.session_state.html_agent_executor2, initial_html))
-                st.session_state.final_html = final_html
-            except Exception as e:
-                st.error(f"生成HTML文件时出错: {e}")
+                job = get_job_queue().submit(
+                    run_plan_job,
+                    agents.router,
+                    request,
+                    fast_html=html_mode == "快速（本地模板）",
+                    cache_key=cache_key,
+                    prefetched=st.session_state.speculation.take(from_station, to_station, start_date, num_days),
+                    label=f"{from_station} → {to_station}",
+                )
+                st.session_state.job_id = job.id
+                st.session_state.plan_request = request
+                st.session_state.itinerary = None
+                st.session_state.final_html = None
+                st.session_state.ics = None
+                st.session_state.job_error = None
+            except QueueFullError as e:
+                st.warning(str(e))
+
+# ==================== 任务进度 ====================
+@st.fragment(run_every=1.0)
+def show_job_progress():
+    """每秒刷新一次后台任务状态，任务结束后取回结果并整页重跑"""
+    queue = get_job_queue()
+    job = queue.get(st.session_state.job_id)
+    if job is None:
+        st.session_state.job_id = None
+        st.rerun()
+
+    if job.finished:
+        if job.status == DONE:
+            st.session_state.itinerary = job.result["itinerary"]
+            st.session_state.final_html = job.result["final_html"]
+            st.session_state.ics = job.result["ics"]
+            st.session_state.last_trace = job.result["trace"]
+        elif job.status == FAILED:
+            st.session_state.job_error = f"Agent 执行出错: {job.error}"
+        st.session_state.job_id = None
+        st.rerun()
+
+    if job.status == QUEUED:
+        stats = queue.stats()
+        st.info(
+            f"⏳ 排队中：前面还有 {max(queue.position(job.id) - 1, 0)} 个任务"
+            f"（正在运行 {stats['running']}/{stats['max_concurrent']}）"
+        )
+    else:
+        st.progress(job.progress, text=f"{job.label}：{job.stage}……")
+        if job.events:
+            with st.expander("工具调用进度", expanded=not job.text):
+                for event in job.events:
+                    st.write(event)
+        if job.text:
+            st.markdown(job.text)
+
+    if st.button("取消任务", key=f"cancel-{job.id}"):
+        queue.cancel(job.id)
+
+
+if st.session_state.job_id:
+    show_job_progress()
+if st.session_state.job_error:
+    st.error(st.session_state.job_error)
+
+# ==================== 性能诊断面板 ====================
+if st.session_state.last_trace:
+    with st.sidebar.expander("🔍 性能诊断（上一次规划）", expanded=False):
+        summary = st.session_state.last_trace["summary"]
+        st.caption(
+            f"总耗时 {summary['wall_ms'] / 1000:.1f} 秒 · LLM {summary['llm_calls']} 次 · "
+            f"工具 {summary['tool_calls']} 次（缓存命中 {summary['cache_hits']}）· "
+            f"tokens {summary['input_tokens']} / {summary['output_tokens']}"
+        )
+        rows = st.session_state.last_trace["rows"]
+        if rows:
+            import altair as alt
+            import pandas as pd
+
+            chart = alt.Chart(pd.DataFrame(rows)).mark_bar().encode(
+                x=alt.X("start_ms:Q", title="毫秒"),
+                x2="end_ms:Q",
+                y=alt.Y("step:N", sort=None, title=None),
+                color=alt.Color("kind:N", legend=None),
+                tooltip=["step", "duration_ms", "tokens", "bytes", "cache", "error"],
+            )
+            st.altair_chart(chart, use_container_width=True)
+
+        # 外部服务的进程级指标：成功/调用次数、重试、对冲、熔断状态
+        for name, stats in upstream_stats().items():
+            st.caption(
+                f"{name}：成功 {stats.get('success', 0)}/{stats.get('calls', 0)} · 平均 {stats['avg_ms']:.0f} ms · "
+                f"重试 {stats.get('retries', 0)} · 对冲 {stats.get('hedges', 0)} · 熔断 {stats['breaker']}"
+            )
+        for label, stats in get_apify_pool().stats().items():
+            st.caption(
+                f"Apify Key {label}：运行中 {stats['in_flight']} · 累计 {stats['runs']} 次 · "
+                f"已用 ${stats['spent_usd']} · 429 {stats['throttled']} 次"
+                + (f" · 暂停 {stats['ejected_s']:.0f} 秒" if stats["ejected_s"] else "")
+            )
 
 if st.session_state.itinerary:
+    plan_request = st.session_state.plan_request
     st.header("📅 您的专属行程")
     
     tab1, tab2 = st.tabs(["行程详情 (Markdown)", "可视化报告 (HTML)"])
 
     with tab1:
         st.markdown(st.session_state.itinerary)
-        try:
-            ics_content = generate_ics_content(st.session_state.itinerary,  datetime.combine(start_date, datetime.min.time()))
+        if st.session_state.ics:
             st.download_button(
                 label="📥 下载为日历文件 (.ics)",
-                data=ics_content,
-                file_name=f"{to_station}_travel_itinerary.ics",
+                data=st.session_state.ics,
+                file_name=f"{plan_request['to_station']}_travel_itinerary.ics",
                 mime="text/calendar",
                 use_container_width=True
             )
-        except Exception as e:
-            st.error(f"生成日历文件时出错: {e}")
+        else:
+            st.error("生成日历文件时出错，请重新生成行程。")
 
     with tab2:
         if st.session_state.final_html:
@@ -253,7 +371,7 @@ if st.session_state.itinerary:
             st.download_button(
                 label="📥 下载HTML行程表 (.html)",
                 data=st.session_state.final_html,
-                file_name=f"{to_station}_travel_itinerary.html",
+                file_name=f"{plan_request['to_station']}_travel_itinerary.html",
                 mime="text/html",
                 use_container_width=True
             )
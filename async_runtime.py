@@ -0,0 +1,133 @@
+"""
+进程级的 asyncio 事件循环线程。
+
+Streamlit 每次重跑脚本都可能在不同的线程上执行，在调用线程上
+`run_until_complete` 会让 MCP 会话、HTTP 连接池、Agent 等异步资源绑定到
+“碰巧创建它们的线程”，无法安全复用。这里在整个进程内只启动一个后台线程
+运行事件循环，所有异步工作都通过 `run_coroutine_threadsafe` 提交到这个循环：
+
+- `submit(coro, timeout)`：任意线程提交协程，返回 `concurrent.futures.Future`；
+- `run(coro, timeout)`：同步等待结果，超时后取消协程；
+- `arun(coro)`：在别的事件循环中等待在本循环上执行的协程；
+- MCP 连接池、任务队列和共享 HTTP 客户端都只在这个循环上各存在一份。
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRuntime:
+    """在专用后台线程中常驻运行的事件循环"""
+
+    def __init__(self, name: str = "async-runtime"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """后台事件循环，首次访问时启动线程"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._run_loop, name=self.name, daemon=True)
+                self._thread.start()
+        return self._loop
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def in_loop_thread(self) -> bool:
+        """当前线程是否就是事件循环线程"""
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro: Awaitable, timeout: Optional[float] = None) -> concurrent.futures.Future:
+        """
+        从任意线程提交协程，立即返回 Future。
+
+        对 Future 调用 `cancel()` 会取消循环中的协程；给出 timeout 时协程
+        超时后被取消，Future 以 `asyncio.TimeoutError` 结束。
+        """
+        if timeout is not None:
+            coro = asyncio.wait_for(coro, timeout)
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable, timeout: Optional[float] = None) -> Any:
+        """
+        同步执行协程并返回结果（供 Streamlit 脚本等同步代码使用）。
+
+        Raises:
+            asyncio.TimeoutError: 超过 timeout 秒，协程已被取消
+            RuntimeError: 在事件循环线程内调用（会造成死锁）
+        """
+        if self.in_loop_thread():
+            if asyncio.iscoroutine(coro):
+                coro.close()
+            raise RuntimeError("不能在事件循环线程内同步等待协程，请直接 await")
+        future = self.submit(coro, timeout)
+        try:
+            return future.result()
+        except BaseException:
+            # 调用方被中断（如 KeyboardInterrupt）时不让协程继续在后台运行
+            future.cancel()
+            raise
+
+    async def arun(self, coro: Awaitable) -> Any:
+        """在调用方的事件循环中等待一个运行在本循环上的协程"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def call_soon(self, callback: Callable, *args):
+        """线程安全地在事件循环中调度一个普通回调"""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def close(self, timeout: float = 10.0):
+        """取消循环中剩余的任务并停止线程"""
+        if self._loop is None or not self._loop.is_running():
+            return
+
+        async def _cancel_pending():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        try:
+            asyncio.run_coroutine_threadsafe(_cancel_pending(), self._loop).result(timeout)
+        except Exception as e:
+            logger.warning("关闭事件循环时出错: %r", e)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None and not self.in_loop_thread():
+            self._thread.join(timeout)
+
+
+# ==================== 进程级单例 ====================
+_runtime: Optional[AsyncRuntime] = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime() -> AsyncRuntime:
+    """返回进程内唯一的事件循环线程"""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = AsyncRuntime()
+            atexit.register(_runtime.close)
+        return _runtime
+
+
+def run_async(coro: Awaitable, timeout: Optional[float] = None) -> Any:
+    """在进程级事件循环上同步执行协程"""
+    return get_runtime().run(coro, timeout)
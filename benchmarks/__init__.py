@@ -0,0 +1,6 @@
+"""
+离线压测工具：用本地替身代替 LLM、SerpAPI、Apify 和 12306 MCP 服务，
+在不消耗 API 额度的情况下测量完整规划流水线的延迟、吞吐和内存。
+
+用法见 `python -m benchmarks.run_benchmark --help`。
+"""
@@ -0,0 +1,216 @@
+"""
+按脚本应答的假聊天模型，代替真实 LLM 驱动 Agent 流水线。
+
+模型根据提示词判断当前所处的阶段：
+
+- 规划 Agent 前 `tool_rounds` 轮：发出真实结构的工具调用（批量地图搜索 + 网络搜索）；
+- 规划 Agent 之后：基于工具结果写出 `Day N:` 结构的行程（Day 内部带
+  `**活动安排：**` 这类加粗小标题，与真实模型的输出风格一致）；
+- 执行预算用完后的强制输出轮：执行器以 `tool_choice="none"` 绑定工具并附上系统通知，
+  模型记录下绑定的 tool_choice，核对两者一致后直接写出行程；
+- HTML 生成：用本地模板渲染行程，包上引导语和代码块标记（可选去掉打印按钮，
+  让审查阶段走片段修复路径）；
+- HTML 片段修复 / 整份审查：返回对应的 JSON 修复项或清理后的 HTML。
+
+每次调用按 `latency` 等待后再输出，流式输出时按 `chunk_size` 分块、块间等待
+`token_delay`，并给出估算的 token 用量，供 tracing 统计。
+"""
+import asyncio
+import json
+import re
+import time
+import uuid
+from collections import Counter
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+from html_renderer import render_itinerary_html
+from scratchpad import count_tokens
+
+PLAN_REQUEST = re.compile(r"从\s*(\S+?)\s*出发到\s*(\S+?)\s*的\s*(\d+)\s*天旅行")
+FRAGMENT_ISSUE = re.compile(r"^\d+\.\s*(.+?)\n片段:\n(.*?)\n(?=\n?\d+\.\s|\Z)", re.MULTILINE | re.DOTALL)
+PRINT_BUTTON = re.compile(r"<button[^>]*window\.print\(\)[^>]*>.*?</button>", re.DOTALL)
+ITINERARY_DESTINATION = re.compile(r"到(\S+?)的\s*\d+\s*天行程")
+# agent_budget.FORCE_SYNTHESIS_MESSAGE 的开头
+FORCE_SYNTHESIS_NOTICE = "【系统通知】"
+
+
+def _table_column(text: str, header: str) -> List[str]:
+    """从工具返回的 `|` 分隔表格中取出某一列"""
+    values, index = [], None
+    for line in text.splitlines():
+        cells = line.split("|")
+        if len(cells) == 1:
+            index = None
+        elif header in cells:
+            index = cells.index(header)
+        elif index is not None and len(cells) > index and cells[index].strip():
+            values.append(cells[index].strip())
+    return values
+
+
+def _text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+
+class ScriptedChatModel(BaseChatModel):
+    """按脚本应答的假聊天模型，支持工具调用和流式输出"""
+
+    latency: float = 0.2
+    token_delay: float = 0.0
+    chunk_size: int = 40
+    html_defects: bool = True
+    # 规划 Agent 写行程前发出工具调用的轮数；超过执行预算时由预算强制输出
+    tool_rounds: int = 1
+    model_name: str = "scripted-fake"
+    # bind_tools 时给出的 tool_choice；绑定得到的副本与原模型共用 calls 计数
+    tool_choice: Optional[str] = None
+    calls: Dict[str, int] = Field(default_factory=Counter)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-fake"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model_name": self.model_name}
+
+    def bind_tools(self, tools, tool_choice: Optional[str] = None, **kwargs):
+        # 工具调用由脚本决定，不需要把工具定义绑定进请求，只记录 tool_choice
+        return self.model_copy(update={"tool_choice": tool_choice})
+
+    # ---------- 各阶段的脚本 ----------
+    def _respond(self, messages: List[BaseMessage]) -> AIMessage:
+        request = next((_text(m) for m in messages if isinstance(m, HumanMessage)), "")
+        if "旅行规划表设计提示词" in request:
+            return AIMessage(content=self._html(request))
+        if "HTML 片段修复助手" in request:
+            return AIMessage(content=self._fragment_fixes(request))
+        if "代码二次审查助手" in request:
+            start = request.find("<!DOCTYPE")
+            return AIMessage(content=request[start:] if start != -1 else request)
+        return self._plan(request, messages)
+
+    def _plan(self, request: str, messages: List[BaseMessage]) -> AIMessage:
+        match = PLAN_REQUEST.search(request)
+        origin, destination, num_days = match.groups() if match else ("出发地", "目的地", "3")
+        num_days = int(num_days)
+        observations = [m for m in messages if isinstance(m, ToolMessage)]
+        rounds = sum(1 for m in messages if isinstance(m, AIMessage) and m.tool_calls)
+
+        # 强制输出轮必须同时禁用工具并附上系统通知，只有其一说明执行器的预算路径有问题
+        forced = self.tool_choice == "none"
+        notified = FORCE_SYNTHESIS_NOTICE in _text(messages[-1])
+        if forced != notified:
+            raise AssertionError(f"强制输出轮不一致：tool_choice={self.tool_choice!r}，系统通知={notified}")
+        if forced:
+            self.calls["synthesis"] += 1
+        elif rounds < self.tool_rounds:
+            self.calls["tool_rounds"] += 1
+            suffix = f" {rounds + 1}" if rounds else ""
+            queries = [f"{destination} {kind}{suffix}" for kind in ("酒店", "餐厅", "景点")]
+            return AIMessage(content="", tool_calls=[
+                {"name": "search_google_maps_batch", "args": {"queries": queries, "location": destination},
+                 "id": f"call_{uuid.uuid4().hex[:8]}", "type": "tool_call"},
+                {"name": "search_web", "args": {"query": f"{destination} {num_days}天 行程 推荐{suffix}"},
+                 "id": f"call_{uuid.uuid4().hex[:8]}", "type": "tool_call"},
+            ])
+
+        names = [n for obs in observations for n in _table_column(_text(obs), "名称")] or [f"{destination}景点"]
+        lines = [f"这是为您规划的从{origin}到{destination}的 {num_days} 天行程：", ""]
+        for day in range(1, num_days + 1):
+            pick = lambda offset: names[(day * 3 + offset) % len(names)]
+            lines += [
+                f"Day {day}: {destination}深度游第 {day} 天",
+                "**活动安排：**",
+                f"- 上午：游览 [{pick(0)}](https://maps.example.com/{day}a)，步行前往下一站",
+                f"- 中午：午餐推荐 {pick(1)}，品尝当地美食",
+                f"- 下午：参观 {pick(2)}，地铁换乘约 30 分钟",
+                "**交通建议：**",
+                "- 市内以地铁为主，景点之间可步行",
+                f"- 晚上：入住酒店 {names[0]}（电话见地图信息）",
+                "",
+            ]
+        lines += ["## 天气与穿衣建议", "- 早晚温差较大，建议带薄外套和雨具", "", "## 行前准备", "- 身份证、充电器、常用药品"]
+        return AIMessage(content="\n".join(lines))
+
+    def _html(self, request: str) -> str:
+        itinerary = request[request.find("这是为您规划的"):] if "这是为您规划的" in request else request
+        match = ITINERARY_DESTINATION.search(itinerary)
+        html = render_itinerary_html(itinerary, destination=match.group(1) if match else "")
+        if self.html_defects:
+            html = PRINT_BUTTON.sub("", html)
+        return f"以下是为您生成的旅行规划表 HTML：\n```html\n{html}\n```"
+
+    @staticmethod
+    def _fragment_fixes(request: str) -> str:
+        fixes = []
+        for message, fragment in FRAGMENT_ISSUE.findall(request):
+            if "打印按钮" in message:
+                replacement = fragment + '\n<button class="no-print" onclick="window.print()">打印行程</button>'
+            elif "打印样式" in message:
+                replacement = "<style>@media print { .no-print { display: none !important; } }</style>\n" + fragment
+            else:
+                replacement = fragment
+            fixes.append({"original": fragment, "replacement": replacement})
+        return json.dumps(fixes, ensure_ascii=False)
+
+    # ---------- LangChain 接口 ----------
+    def _with_usage(self, messages: List[BaseMessage], message: AIMessage) -> AIMessage:
+        prompt_tokens = sum(count_tokens(_text(m)) for m in messages)
+        output_tokens = count_tokens(_text(message) + json.dumps(message.tool_calls, ensure_ascii=False))
+        message.usage_metadata = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": prompt_tokens + output_tokens,
+        }
+        message.response_metadata = {"model_name": self.model_name}
+        return message
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        message = self._with_usage(messages, self._respond(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        message = self._with_usage(messages, self._respond(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, message: AIMessage) -> Iterator[AIMessageChunk]:
+        if message.tool_calls:
+            yield AIMessageChunk(content="", tool_call_chunks=[
+                {"name": c["name"], "args": json.dumps(c["args"], ensure_ascii=False), "id": c["id"], "index": i}
+                for i, c in enumerate(message.tool_calls)
+            ])
+        else:
+            text = message.content
+            for start in range(0, len(text), self.chunk_size):
+                yield AIMessageChunk(content=text[start:start + self.chunk_size])
+        yield AIMessageChunk(content="", usage_metadata=message.usage_metadata,
+                             response_metadata=message.response_metadata)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for chunk in self._chunks(self._with_usage(messages, self._respond(messages))):
+            if run_manager and isinstance(chunk.content, str) and chunk.content:
+                run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+            if self.token_delay:
+                time.sleep(self.token_delay)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for chunk in self._chunks(self._with_usage(messages, self._respond(messages))):
+            if run_manager and isinstance(chunk.content, str) and chunk.content:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
@@ -0,0 +1,151 @@
+"""
+替身服务共用的确定性假数据。
+
+同一输入总是生成同样的结果（以输入的哈希为随机种子），数据结构与真实服务
+返回的字段保持一致，使工具的解析、格式化代码走完整路径。
+"""
+import hashlib
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+STATION_CODES = {
+    "北京": "BJP", "上海": "SHH", "杭州": "HZH", "广州": "GZQ", "深圳": "SZQ",
+    "成都": "CDW", "重庆": "CQW", "西安": "XAY", "南京": "NJH", "武汉": "WHN",
+}
+
+AIRLINES = {"1": "中国国际航空", "2": "东方航空", "3": "南方航空", "4": "海南航空"}
+PLACE_CATEGORIES = {"酒店": "酒店", "餐厅": "中餐馆", "美食": "小吃店", "景点": "旅游景点"}
+WEATHER_CONDITIONS = ["晴", "多云", "阴", "小雨", "阵雨"]
+
+
+def _rng(*parts) -> random.Random:
+    seed = hashlib.sha1("\0".join(map(str, parts)).encode("utf-8")).hexdigest()
+    return random.Random(int(seed[:12], 16))
+
+
+def station_code(city: str) -> str:
+    """常见城市用真实编码，其余城市生成稳定的三位字母编码"""
+    if city in STATION_CODES:
+        return STATION_CODES[city]
+    rng = _rng("station", city)
+    return "".join(rng.choice("ABCDEFGHJKLMNPQRSTWXYZ") for _ in range(3))
+
+
+def city_codes(cities: List[str]) -> Dict[str, dict]:
+    """`get-station-code-of-citys` 的返回结构"""
+    return {c: {"station_code": station_code(c), "station_name": c} for c in cities if c}
+
+
+def trains(from_code: str, to_code: str, date: str, count: int = 8) -> List[dict]:
+    rng = _rng("trains", from_code, to_code, date)
+    result = []
+    for i in range(count):
+        start = datetime.strptime("06:30", "%H:%M") + timedelta(minutes=95 * i + rng.randint(0, 40))
+        minutes = rng.randint(240, 420)
+        arrive = start + timedelta(minutes=minutes)
+        result.append({
+            "train_no": f"{rng.choice('GD')}{rng.randint(1, 999)}",
+            "from_station": from_code,
+            "to_station": to_code,
+            "start_time": start.strftime("%H:%M"),
+            "arrive_time": arrive.strftime("%H:%M"),
+            "duration": f"{minutes // 60:02d}:{minutes % 60:02d}",
+            "seats": {"商务座": rng.randint(0, 20), "一等座": rng.randint(0, 60), "二等座": rng.choice(["有", "无", rng.randint(1, 99)])},
+        })
+    return result
+
+
+def tickets_text(date: str, rows: List[dict]) -> str:
+    """与 12306-mcp `get-tickets` 相近的文本表格"""
+    lines = [f"{date} 车次 | 出发站 -> 到达站 | 出发时间 -> 到达时间 | 历时"]
+    for t in rows:
+        seats = "\n".join(f"- {k}: {v}" for k, v in t["seats"].items())
+        lines.append(
+            f"{t['train_no']} {t['from_station']} -> {t['to_station']} "
+            f"{t['start_time']} -> {t['arrive_time']} 历时：{t['duration']}\n{seats}"
+        )
+    return "\n".join(lines)
+
+
+def serp_results(query: str, count: int = 8) -> dict:
+    rng = _rng("serp", query)
+    return {
+        "search_metadata": {"status": "Success"},
+        "organic_results": [
+            {
+                "position": i + 1,
+                "title": f"{query} 攻略 {i + 1}",
+                "link": f"https://example.com/{rng.randint(10000, 99999)}",
+                "snippet": f"关于{query}的第 {i + 1} 条结果：" + "推荐景点、交通方式和当地美食。" * rng.randint(2, 5),
+            }
+            for i in range(count)
+        ],
+    }
+
+
+def places(queries: List[str], location: str, max_results: int) -> List[dict]:
+    """Google Maps Actor 的结果，每条带 searchString 以便批量查询分组"""
+    items = []
+    for query in queries:
+        rng = _rng("places", query, location)
+        category = next((v for k, v in PLACE_CATEGORIES.items() if k in query), "地点")
+        for i in range(max_results):
+            items.append({
+                "searchString": query,
+                "title": f"{query.split()[0]}{category}{i + 1}号",
+                "address": f"{location or ''}某区某路 {rng.randint(1, 500)} 号",
+                "rating": round(rng.uniform(3.8, 4.9), 1),
+                "reviewsCount": rng.randint(50, 5000),
+                "category": category,
+                "phone": f"+86 {rng.randint(100, 999)} {rng.randint(1000, 9999)} {rng.randint(1000, 9999)}",
+                "website": f"https://maps.example.com/place/{rng.randint(100000, 999999)}",
+            })
+    return items
+
+
+def weather(location: str, time_frame: str) -> List[dict]:
+    rng = _rng("weather", location)
+    days = {"ten_day": 10, "month": 30}.get(time_frame, 1)
+    today = datetime.today()
+    return [
+        {
+            "location": location,
+            "date": (today + timedelta(days=i)).strftime("%Y-%m-%d"),
+            "temperature": rng.randint(12, 30),
+            "condition": rng.choice(WEATHER_CONDITIONS),
+            "humidity": rng.randint(30, 90),
+            "windSpeed": rng.randint(3, 25),
+            "precipitation": rng.randint(0, 80),
+        }
+        for i in range(days)
+    ]
+
+
+def flights(run_input: dict, count: int = 6) -> List[dict]:
+    """航班 Actor 的结果：每条是一个完整方案，legs 与 origin.N / target.N / depart.N 一一对应"""
+    legs = []
+    while f"origin.{len(legs)}" in run_input:
+        n = len(legs)
+        legs.append((run_input[f"origin.{n}"], run_input.get(f"target.{n}"), run_input.get(f"depart.{n}")))
+    rng = _rng("flights", *legs)
+    items = []
+    for i in range(count):
+        item_legs, segments = [], {}
+        for n, (_, _, depart) in enumerate(legs):
+            seg_id = f"seg-{i}-{n}"
+            start = datetime.strptime(f"{depart} 07:00", "%Y-%m-%d %H:%M") + timedelta(minutes=110 * i)
+            segments[seg_id] = {
+                "marketing_carrier_id": rng.randint(1, len(AIRLINES)),
+                "marketing_flight_number": f"{rng.randint(1000, 9999)}",
+                "departure": start.isoformat(),
+                "arrival": (start + timedelta(minutes=rng.randint(100, 200))).isoformat(),
+            }
+            item_legs.append({"segment_ids": [seg_id]})
+        items.append({
+            "legs": item_legs,
+            "_segments": segments,
+            "_carriers": {k: {"name": v} for k, v in AIRLINES.items()},
+            "pricing_options": [{"price": {"amount": rng.randint(500, 2000) * len(legs)}} for _ in range(rng.randint(1, 4))],
+        })
+    return items
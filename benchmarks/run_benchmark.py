@@ -0,0 +1,299 @@
+"""
+完整规划流水线的离线压测。
+
+与 app.py 提交表单时走同一条路径：从进程级执行器池取得 Agent（executor_pool）→
+查询整体规划缓存（plan_cache）→ 未命中时把 `run_plan_job` 提交到后台任务队列
+（job_queue）并轮询到结束。任务内部依次经过预查询、流式规划、HTML 生成（本地模板，
+或 LLM 生成 + 审查）和 ICS 生成，各阶段耗时取自任务返回的追踪数据。
+
+LLM 由 `ScriptedChatModel` 代替，SerpAPI / Apify 由本地 HTTP 替身代替，
+12306 MCP 由 stdio 替身服务代替，全程不访问网络。
+
+报告各阶段和整体的 p50 / p95 延迟、N 个规划并发时的吞吐量、整体规划缓存命中数、
+执行器构建次数、进程峰值内存，以及各上游收到的请求数。规划数超过出行路线数时，
+重复的需求在 warm 模式下直接命中整体规划缓存。
+
+`--tool-rounds` 让假模型多轮调用工具，超过执行预算（agent_budget）后走强制输出路径：
+统计被强制输出的规划数，并核对每一次都是以 `tool_choice="none"` 完成的。
+
+    python -m benchmarks.run_benchmark --plans 20 --concurrency 4
+    python -m benchmarks.run_benchmark --plans 50 --concurrency 10 --cache warm --html fast --json bench.json
+    python -m benchmarks.run_benchmark --plans 6 --concurrency 3 --tool-rounds 15
+"""
+import argparse
+import concurrent.futures
+import json
+import math
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, List
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_mcp_server import stdio_server_config
+from benchmarks.stub_upstreams import StubUpstreams
+
+TRIPS = [("北京", "上海"), ("上海", "杭州"), ("广州", "成都"), ("南京", "西安"), ("深圳", "重庆"), ("武汉", "北京")]
+STAGES = ("agents", "queue_wait", "prefetch", "plan", "html_render", "html_generate", "html_review", "ics", "total")
+HTML_MODES = {"fast": "快速（本地模板）", "llm": "精美（LLM 生成）"}
+# 压测用的模型配置，决定执行器池和整体规划缓存的键
+MODEL_ID, API_KEY, SERP_API_KEY = "scripted-fake", "bench", "bench"
+# 轮询任务状态的间隔（秒）
+POLL_INTERVAL = 0.01
+
+
+def percentile(values: List[float], p: float) -> float:
+    """最近秩百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def check_itinerary(index: int, itinerary: str, num_days: int):
+    """解析结果必须保留每天的活动：Day 内部的加粗小标题不能把当天内容切走"""
+    from itinerary_parser import parsed_itinerary
+
+    parsed = parsed_itinerary(itinerary)
+    empty = [day.number for day in parsed.days if not day.activities]
+    if len(parsed.days) != num_days or empty:
+        raise RuntimeError(f"规划 {index} 的行程解析不完整：{len(parsed.days)} 天，无活动的天 {empty}")
+
+
+def make_request(index: int, start_date: date, num_days: int) -> dict:
+    """与 app.py 提交表单时相同结构的规划需求"""
+    origin, destination = TRIPS[index % len(TRIPS)]
+    prompt = (
+        f"请为我规划一个从 {origin} 出发到 {destination} 的 {num_days} 天旅行，"
+        f"出发日期为 {start_date.strftime('%Y-%m-%d')}。"
+        "我的旅行偏好是：无特殊风格。我希望行程节奏是 '适中'。其他具体要求：无。"
+        "请先用车票或机票工具查询交通信息，然后把这些信息纳入行程规划。"
+    )
+    return {
+        "from_station": origin,
+        "to_station": destination,
+        "start_date": start_date,
+        "num_days": num_days,
+        "travel_style": [],
+        "trip_pace": "适中",
+        "specific_requirements": "",
+        "prompt": prompt,
+    }
+
+
+def stage_timings(trace: dict) -> Dict[str, float]:
+    """从任务返回的瀑布图数据中取出各阶段耗时（毫秒）"""
+    timings: Dict[str, float] = defaultdict(float)
+    for row in trace["rows"]:
+        if row["kind"] == "stage":
+            timings[row["step"].split(":", 1)[1]] += row["end_ms"] - row["start_ms"]
+    return timings
+
+
+def run_plan(index: int, start_date: date, num_days: int, html_mode: str) -> Dict[str, float]:
+    """
+    按 app.py 的提交流程运行一次规划，返回各阶段耗时（毫秒）。
+
+    命中整体规划缓存时只有 agents 和 total 两项，并带上 plan_cache_hit 标记；
+    执行预算用完、强制输出的规划带上 budget_forced 标记。
+    """
+    from agent_logic import run_plan_job
+    from executor_pool import get_executor_pool
+    from job_queue import DONE, get_job_queue
+    from plan_cache import plan_cache, plan_cache_key
+
+    request = make_request(index, start_date, num_days)
+    started = time.perf_counter()
+    agents = get_executor_pool().acquire(MODEL_ID, None, API_KEY, SERP_API_KEY)
+    timings: Dict[str, float] = {"agents": (time.perf_counter() - started) * 1000}
+
+    cache_key = plan_cache_key(request, agents.key.model_id, agents.key.base_url, html_mode)
+    cached = plan_cache.get(cache_key)
+    if cached is not None:
+        check_itinerary(index, cached["itinerary"], num_days)
+        timings["total"] = (time.perf_counter() - started) * 1000
+        timings["plan_cache_hit"] = 1
+        return timings
+
+    job = get_job_queue().submit(
+        run_plan_job,
+        agents.router,
+        request,
+        fast_html=html_mode == HTML_MODES["fast"],
+        cache_key=cache_key,
+        label=f"bench-{index}",
+    )
+    while not job.finished:
+        time.sleep(POLL_INTERVAL)
+    if job.status != DONE:
+        raise RuntimeError(f"规划 {index} 失败：{job.error or job.status}")
+
+    result = job.result
+    if "Day 1" not in result["itinerary"] or "window.print(" not in result["final_html"] or not result["ics"]:
+        raise RuntimeError(f"规划 {index} 的输出不完整")
+    check_itinerary(index, result["itinerary"], num_days)
+
+    timings["queue_wait"] = (job.started_at - job.created_at) * 1000
+    timings.update(stage_timings(result["trace"]))
+    timings["total"] = (time.perf_counter() - started) * 1000
+    if result["trace"]["budget"]["forced_reason"]:
+        timings["budget_forced"] = 1
+    return timings
+
+
+def run_benchmark(args) -> dict:
+    from langchain_core.globals import set_verbose
+
+    from async_runtime import run_async
+    from benchmarks.fake_llm import ScriptedChatModel
+    from executor_pool import get_executor_pool
+    from job_queue import get_job_queue
+    from mcp_pool import get_mcp_pool
+    from plan_cache import plan_cache
+    from tool_cache import tool_cache
+
+    set_verbose(False)
+    if args.cache == "cold":
+        # 不保留任何缓存条目，每次工具调用都访问替身服务，每个规划都完整执行
+        for cache in (tool_cache, plan_cache._cache):
+            cache.max_memory_entries = 0
+            cache.path = None
+
+    llm = ScriptedChatModel(latency=args.llm_latency, token_delay=args.token_delay, tool_rounds=args.tool_rounds)
+    # 进程级单例首次创建时指定压测配置：执行器使用假模型，任务队列并发与压测一致
+    pool = get_executor_pool(llm_factory=lambda tier: llm)
+    get_job_queue(max_concurrent=args.concurrency, max_queued=max(args.plans, 1))
+    html_mode = HTML_MODES[args.html]
+    start_date = date.today() + timedelta(days=7)
+
+    # 先用替身配置创建进程级 MCP 连接池，构建执行器时会复用它
+    t = time.perf_counter()
+    mcp = get_mcp_pool({"train": stdio_server_config(args.upstream_latency)})
+    run_async(mcp.get_tools())
+    mcp_startup_ms = (time.perf_counter() - t) * 1000
+
+    # 执行器在第一次规划时构建，关闭它们的 verbose 输出
+    for executor in pool.acquire(MODEL_ID, None, API_KEY, SERP_API_KEY).router.executors.values():
+        executor.verbose = False
+
+    warmup_forced = sum(run_plan(i, start_date, args.days, html_mode).get("budget_forced", 0) for i in range(args.warmup))
+
+    results: List[Dict[str, float]] = []
+    errors: List[str] = []
+
+    def worker(i: int):
+        try:
+            results.append(run_plan(i, start_date, args.days, html_mode))
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+
+    # 每个线程相当于一个提交表单并轮询进度的 Streamlit 会话
+    t = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as sessions:
+        list(sessions.map(worker, range(args.plans)))
+    wall = time.perf_counter() - t
+
+    stages = defaultdict(list)
+    for timings in results:
+        for stage, ms in timings.items():
+            stages[stage].append(ms)
+
+    # 每个被强制输出的规划都必须恰好有一轮禁用工具的 LLM 调用
+    forced = len(stages.pop("budget_forced", []))
+    if llm.calls["synthesis"] != forced + warmup_forced:
+        errors.append(
+            f"强制输出不一致：{forced + warmup_forced} 个规划预算用完，"
+            f"tool_choice=\"none\" 的调用 {llm.calls['synthesis']} 次"
+        )
+
+    return {
+        "plans": args.plans,
+        "concurrency": args.concurrency,
+        "cache": args.cache,
+        "html": args.html,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_per_min": round(len(results) / wall * 60, 2) if wall else 0,
+        "plan_cache_hits": len(stages.pop("plan_cache_hit", [])),
+        "forced_synthesis": forced,
+        "executor_builds": pool.stats()["builds"],
+        "mcp_startup_ms": round(mcp_startup_ms, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stages": {
+            stage: {
+                "p50_ms": round(percentile(stages[stage], 50), 1),
+                "p95_ms": round(percentile(stages[stage], 95), 1),
+                "max_ms": round(max(stages[stage], default=0), 1),
+            }
+            for stage in STAGES
+            if stages[stage]
+        },
+    }
+
+
+def print_report(report: dict, upstream_requests: dict):
+    print(f"\n规划数 {report['plans']}，并发 {report['concurrency']}，缓存 {report['cache']}，"
+          f"HTML {report['html']}，失败 {len(report['errors'])}")
+    print(f"{'阶段':<14}{'p50 (ms)':>12}{'p95 (ms)':>12}{'max (ms)':>12}")
+    for stage, s in report["stages"].items():
+        print(f"{stage:<14}{s['p50_ms']:>12.1f}{s['p95_ms']:>12.1f}{s['max_ms']:>12.1f}")
+    print(f"\n总耗时 {report['wall_s']:.2f} s，吞吐 {report['throughput_per_min']:.1f} 个规划/分钟")
+    print(f"整体规划缓存命中 {report['plan_cache_hits']} 次，执行器构建 {report['executor_builds']} 次，"
+          f"预算用完强制输出 {report['forced_synthesis']} 次")
+    print(f"MCP 服务启动 {report['mcp_startup_ms']:.0f} ms，峰值内存 {report['peak_rss_mb']:.1f} MB")
+    print("上游请求数: " + ", ".join(f"{k}={v}" for k, v in sorted(upstream_requests.items())))
+    for error in report["errors"][:5]:
+        print(f"错误: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="旅行规划流水线离线压测")
+    parser.add_argument("--plans", type=int, default=10, help="规划总数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时运行的规划数")
+    parser.add_argument("--days", type=int, default=3, help="每个规划的旅行天数")
+    parser.add_argument("--warmup", type=int, default=1, help="不计入结果的预热规划数")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="假 LLM 每次调用的延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="假 LLM 流式输出的块间延迟（秒）")
+    parser.add_argument("--tool-rounds", type=int, default=1, help="假 LLM 写行程前调用工具的轮数，超过执行预算时强制输出")
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="SerpAPI / Apify / MCP 替身的延迟（秒）")
+    parser.add_argument("--cache", choices=("cold", "warm"), default="cold", help="cold 时禁用工具结果缓存和整体规划缓存")
+    parser.add_argument("--html", choices=tuple(HTML_MODES), default="llm", help="HTML 报告模式：fast 本地模板，llm 生成并审查")
+    parser.add_argument("--json", metavar="PATH", help="把结果另存为 JSON")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="travel-bench-")
+    upstreams = StubUpstreams(latency=args.upstream_latency).start()
+    # 必须在导入工具模块之前设置：API 地址、token 和缓存路径在导入时读取
+    os.environ.update(upstreams.env)
+    os.environ["TOOL_CACHE_PATH"] = os.path.join(workdir, "tool_cache.sqlite3")
+    os.environ["PLAN_CACHE_PATH"] = os.path.join(workdir, "plan_cache.sqlite3")
+    os.environ["STATION_INDEX_PATH"] = os.path.join(workdir, "station_index.tsv")
+    os.environ["STATION_INDEX_BOOTSTRAP"] = "0"
+    try:
+        report = run_benchmark(args)
+    finally:
+        upstreams.close()
+
+    report["upstream_requests"] = dict(upstreams.requests)
+    print_report(report, upstreams.requests)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
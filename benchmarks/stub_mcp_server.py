@@ -0,0 +1,104 @@
+"""
+12306 MCP 服务的本地替身。
+
+两种运行方式：
+
+- stdio（默认）：标准 MCP 服务，提供 `get-station-code-of-citys` 和 `get-tickets`
+  两个工具，参数与 12306-mcp 一致，可直接写进 MCP 服务配置；
+- `--http PORT`：`test_train_tickets.py` 使用的 JSON-RPC 接口（`POST /mcp`）。
+
+    python -m benchmarks.stub_mcp_server --latency 0.05
+    python -m benchmarks.stub_mcp_server --http 8080
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import fixtures
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def stdio_server_config(latency: float = 0.0) -> dict:
+    """可直接传给 MCP 连接池的 stdio 服务配置"""
+    return {
+        "command": sys.executable,
+        "args": ["-m", "benchmarks.stub_mcp_server", "--latency", str(latency)],
+        "transport": "stdio",
+        "cwd": REPO_ROOT,
+    }
+
+
+# ==================== stdio MCP ====================
+def run_stdio(latency: float):
+    from mcp.server.fastmcp import FastMCP
+
+    mcp = FastMCP("12306-stub", log_level="WARNING")
+
+    @mcp.tool(name="get-station-code-of-citys")
+    def get_station_code_of_citys(citys: str) -> str:
+        """通过中文城市名查询代表该城市的车站编码，多个城市用 | 分隔。"""
+        time.sleep(latency)
+        return json.dumps(fixtures.city_codes(citys.split("|")), ensure_ascii=False)
+
+    @mcp.tool(name="get-tickets")
+    def get_tickets(date: str, fromStation: str, toStation: str, trainFilterFlags: str = "") -> str:
+        """查询 12306 余票信息。"""
+        time.sleep(latency)
+        return fixtures.tickets_text(date, fixtures.trains(fromStation, toStation, date))
+
+    mcp.run("stdio")
+
+
+# ==================== HTTP JSON-RPC ====================
+class _RpcHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(self.latency)
+        params = request.get("params") or {}
+        method = request.get("method")
+
+        if method == "get-station-code-of-citys":
+            cities = params.get("citys") or ""
+            response = {"result": fixtures.city_codes(cities.split("|"))}
+        elif method == "get-tickets":
+            response = {"result": fixtures.trains(params.get("from_station"), params.get("to_station"), params.get("date"))}
+        else:
+            response = {"error": {"code": -32601, "message": f"Method not found: {method}"}}
+
+        body = json.dumps({"jsonrpc": "2.0", "id": request.get("id"), **response}, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def run_http(port: int, latency: float):
+    handler = type("RpcHandler", (_RpcHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    print(f"12306 替身服务: http://127.0.0.1:{server.server_address[1]}/mcp")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="12306 MCP 服务替身")
+    parser.add_argument("--latency", type=float, default=0.0, help="每次调用注入的延迟（秒）")
+    parser.add_argument("--http", type=int, metavar="PORT", help="以 JSON-RPC HTTP 方式运行")
+    args = parser.parse_args()
+    if args.http is not None:
+        run_http(args.http, args.latency)
+    else:
+        run_stdio(args.latency)
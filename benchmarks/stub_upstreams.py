@@ -0,0 +1,209 @@
+"""
+SerpAPI 和 Apify 的本地 HTTP 替身。
+
+工具代码通过环境变量 `SERPAPI_URL` / `APIFY_API_URL` 指向这里：
+
+- `GET  /search`                    —— SerpAPI 搜索
+- `POST /v2/acts/{actor}/runs`      —— 启动 Actor，立即返回 SUCCEEDED 的运行记录
+- `GET  /v2/acts/{actor}`           —— Actor 信息（客户端转发运行日志时读取）
+- `GET  /v2/actor-runs/{run}`       —— 查询运行状态
+- `GET  /v2/actor-runs/{run}/log`   —— 运行日志（始终为空）
+- `POST /v2/actor-runs/{run}/abort` —— 中止运行
+- `GET  /v2/datasets/{dataset}/items` —— 读取结果（支持 offset / limit 分页）
+
+每个请求可以注入固定延迟模拟上游耗时，并按路由统计请求次数。
+"""
+import gzip
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks import fixtures
+
+# Actor ID 与 tools_update1 中的常量一致
+ACTOR_ITEMS = {
+    "nwua9Gu5YrADL7ZDj": lambda run_input: fixtures.places(
+        run_input.get("searchStringsArray", []),
+        run_input.get("locationQuery", ""),
+        run_input.get("maxCrawledPlacesPerSearch", 5),
+    ),
+    "utztKy0FeZBtJyhx8": lambda run_input: [
+        item
+        for location in run_input.get("locations", [])
+        for item in fixtures.weather(location, run_input.get("timeFrame", "today"))
+    ],
+    "tiveIS4hgXOMtu3Hf": fixtures.flights,
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_StubServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status: int = 200, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, text: str):
+        body = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self, method: str):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Encoding") == "gzip":
+            # Apify 客户端会压缩请求体
+            body = gzip.decompress(body)
+
+        stub = self.server.stub
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        if method == "GET" and parts == ["search"]:
+            stub.count("serpapi")
+            return self._send_json(fixtures.serp_results(query.get("q", "")))
+
+        if method == "POST" and len(parts) == 4 and parts[:2] == ["v2", "acts"] and parts[3] == "runs":
+            stub.count(f"actor:{parts[2]}")
+            run_input = json.loads(body or b"{}")
+            return self._send_json({"data": stub.start_run(parts[2], run_input)}, status=201)
+
+        if method == "GET" and len(parts) == 3 and parts[:2] == ["v2", "acts"]:
+            return self._send_json({"data": {"id": parts[2], "name": f"stub-{parts[2]}", "username": "bench"}})
+
+        if method == "GET" and len(parts) == 4 and parts[:2] == ["v2", "actor-runs"] and parts[3] == "log":
+            return self._send_text("")
+
+        if method == "POST" and len(parts) == 4 and parts[:2] == ["v2", "actor-runs"] and parts[3] == "abort":
+            stub.count("abort")
+            run = stub.runs.get(parts[2])
+            if run is None:
+                return self._send_json({"error": {"type": "record-not-found", "message": "Actor run was not found"}}, status=404)
+            if run["status"] in ("READY", "RUNNING"):
+                run["status"] = "ABORTED"
+            return self._send_json({"data": run})
+
+        if method == "GET" and len(parts) == 3 and parts[:2] == ["v2", "actor-runs"]:
+            run = stub.runs.get(parts[2])
+            if run is None:
+                return self._send_json({"error": {"type": "record-not-found", "message": "Actor run was not found"}}, status=404)
+            return self._send_json({"data": run})
+
+        if method == "GET" and len(parts) == 4 and parts[:2] == ["v2", "datasets"] and parts[3] == "items":
+            items = stub.datasets.get(parts[2], [])
+            offset = int(query.get("offset", 0))
+            limit = int(query.get("limit", len(items) or 1))
+            page = items[offset:offset + limit]
+            return self._send_json(page, headers={
+                "x-apify-pagination-total": str(len(items)),
+                "x-apify-pagination-offset": str(offset),
+                "x-apify-pagination-count": str(len(page)),
+                "x-apify-pagination-limit": str(limit),
+                "x-apify-pagination-desc": "",
+            })
+
+        self._send_json({"error": {"type": "page-not-found", "message": f"{method} {url.path} 不在替身服务范围内"}}, status=404)
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    stub: "StubUpstreams"
+
+
+class StubUpstreams:
+    """
+    在后台线程中运行的 SerpAPI + Apify 替身。
+
+    Args:
+        latency: 每个请求注入的延迟（秒）
+        host: 监听地址
+        port: 监听端口，0 表示随机可用端口
+    """
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.runs: Dict[str, dict] = {}
+        self.datasets: Dict[str, List[dict]] = {}
+        self.requests: Counter = Counter()
+        self._lock = threading.Lock()
+        self._server = _StubServer((host, port), _Handler)
+        self._server.stub = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def env(self) -> Dict[str, str]:
+        """让工具代码指向替身所需的环境变量"""
+        return {
+            "SERPAPI_URL": f"{self.base_url}/search",
+            "APIFY_API_URL": self.base_url,
+            "SERP_API_KEY": "bench",
+            "APIFY_API_TOKENS": "bench-1,bench-2,bench-3",
+        }
+
+    def count(self, route: str):
+        with self._lock:
+            self.requests[route] += 1
+
+    def start_run(self, actor_id: str, run_input: dict) -> dict:
+        make_items = ACTOR_ITEMS.get(actor_id, lambda _: [])
+        run_id, dataset_id = uuid.uuid4().hex[:17], uuid.uuid4().hex[:17]
+        run = {
+            "id": run_id,
+            "actId": actor_id,
+            "status": "SUCCEEDED",
+            "defaultDatasetId": dataset_id,
+            "startedAt": "2025-01-01T00:00:00.000Z",
+            "finishedAt": "2025-01-01T00:00:01.000Z",
+            "usageTotalUsd": 0.002,
+        }
+        with self._lock:
+            self.datasets[dataset_id] = make_items(run_input)
+            self.runs[run_id] = run
+        return run
+
+    def start(self) -> "StubUpstreams":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-upstreams", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
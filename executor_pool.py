@@ -0,0 +1,196 @@
+"""
+进程级的 Agent 执行器池。
+
+Agent、提示词和工具绑定在创建后都不会再改变，同一组模型配置和密钥完全可以
+在所有浏览器会话之间共享。这里按 (model_id, base_url, 密钥指纹) 缓存构建好的
+执行器组合：
+
+- 新会话填入已有的配置时直接命中，初始化只需几毫秒；
+- 生成 HTML 和审查 HTML 使用同一个执行器，不再各建一份；
+- 每个模型档位（见 model_tiers）各建一组执行器，由 StageRouter 按阶段路由；
+- 超过空闲时间或总数上限时按 LRU 淘汰，内存不再随打开的标签页线性增长；
+- 密钥只以哈希指纹出现在缓存键中。
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from langchain_openai import ChatOpenAI
+
+from agent_logic import create_html_agent, create_travel_agent
+from async_runtime import run_async
+from model_tiers import ModelTier, StageRouter, build_tiers, required_executors
+
+logger = logging.getLogger(__name__)
+
+# 缓存的执行器组合上限与空闲淘汰时间（秒）
+MAX_POOLED_AGENTS = int(os.environ.get("AGENT_POOL_SIZE", "8"))
+AGENT_IDLE_TTL = float(os.environ.get("AGENT_POOL_IDLE_TTL", "3600"))
+# 构建执行器（含首次启动 MCP 服务）的超时时间（秒）
+AGENT_BUILD_TIMEOUT = 180.0
+
+
+class AgentKey(NamedTuple):
+    model_id: str
+    base_url: Optional[str]
+    fingerprint: str
+
+
+def credential_fingerprint(*secrets: Optional[str]) -> str:
+    """密钥的短哈希，只用于区分不同的凭据，不可逆推出原文"""
+    digest = hashlib.sha256("\0".join(s or "" for s in secrets).encode("utf-8")).hexdigest()
+    return digest[:16]
+
+
+@dataclass
+class AgentBundle:
+    """一组可在会话间共享的执行器"""
+    key: AgentKey
+    router: StageRouter
+    created_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+
+    @property
+    def plan_executor(self):
+        return self.router.executor("plan")
+
+
+def build_llm(tier: ModelTier) -> ChatOpenAI:
+    return ChatOpenAI(
+        model=tier.model_id,
+        api_key=tier.api_key,
+        base_url=tier.base_url,
+        temperature=0,
+        streaming=True,
+        stream_usage=True,
+        # 单次请求的超时略长于阶段超时，由 StageRouter 统一处理超时和回退
+        timeout=tier.timeout + 5 if tier.timeout else None,
+    )
+
+
+async def build_agent_bundle(
+    key: AgentKey,
+    api_key: str,
+    serp_api_key: str,
+    llm_factory: Callable[[ModelTier], Any] = build_llm,
+) -> AgentBundle:
+    tiers = build_tiers(key.model_id, key.base_url, api_key)
+    llms: Dict[str, Any] = {}
+    executors: Dict[Tuple[str, str], Any] = {}
+    for name, kind in sorted(required_executors(tiers)):
+        llm = llms.setdefault(name, llm_factory(tiers[name]))
+        if kind == "plan":
+            executors[(name, kind)] = await create_travel_agent(llm, serp_api_key)
+        else:
+            executors[(name, kind)] = await create_html_agent(llm)
+    return AgentBundle(key, StageRouter(tiers, executors))
+
+
+class AgentExecutorPool:
+    """
+    按模型配置和密钥指纹缓存的执行器池，线程安全。
+
+    Args:
+        max_entries: 最多缓存的执行器组合数量
+        idle_ttl: 超过该时间（秒）未被使用的组合会被淘汰
+        llm_factory: 根据模型档位创建聊天模型，默认 ChatOpenAI（压测时替换为假模型）
+    """
+
+    def __init__(
+        self,
+        max_entries: int = MAX_POOLED_AGENTS,
+        idle_ttl: float = AGENT_IDLE_TTL,
+        llm_factory: Callable[[ModelTier], Any] = build_llm,
+    ):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.llm_factory = llm_factory
+        self._bundles: "OrderedDict[AgentKey, AgentBundle]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: Dict[AgentKey, threading.Lock] = {}
+        self.builds = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_id: str, base_url: Optional[str], api_key: str, serp_api_key: str) -> AgentKey:
+        return AgentKey(model_id, base_url or None, credential_fingerprint(api_key, serp_api_key))
+
+    def _evict(self, now: float):
+        """在持有 _lock 时调用：淘汰空闲过久和超出上限的组合"""
+        for key in [k for k, b in self._bundles.items() if now - b.last_used > self.idle_ttl]:
+            del self._bundles[key]
+            self.evictions += 1
+        while len(self._bundles) > self.max_entries:
+            self._bundles.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: AgentKey) -> Optional[AgentBundle]:
+        """命中时返回组合并刷新使用时间，否则返回 None"""
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            bundle = self._bundles.get(key)
+            if bundle is not None:
+                bundle.last_used = now
+                self._bundles.move_to_end(key)
+            return bundle
+
+    def acquire(
+        self,
+        model_id: str,
+        base_url: Optional[str],
+        api_key: str,
+        serp_api_key: str,
+        timeout: float = AGENT_BUILD_TIMEOUT,
+    ) -> AgentBundle:
+        """
+        返回该配置的执行器组合，不存在时在进程级事件循环上构建。
+
+        同一配置的并发请求只会构建一次，其余请求等待构建结果。
+        """
+        key = self.make_key(model_id, base_url, api_key, serp_api_key)
+        bundle = self.get(key)
+        if bundle is not None:
+            return bundle
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            bundle = self.get(key)
+            if bundle is None:
+                logger.info("构建 Agent 执行器: %s @ %s", key.model_id, key.base_url or "default")
+                bundle = run_async(build_agent_bundle(key, api_key, serp_api_key, self.llm_factory), timeout=timeout)
+                with self._lock:
+                    self._bundles[key] = bundle
+                    self.builds += 1
+                    self._evict(time.time())
+        with self._lock:
+            self._build_locks.pop(key, None)
+        return bundle
+
+    def __contains__(self, key: AgentKey) -> bool:
+        with self._lock:
+            return key in self._bundles
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._bundles), "builds": self.builds, "evictions": self.evictions}
+
+
+# ==================== 进程级单例 ====================
+_pool: Optional[AgentExecutorPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_executor_pool(**kwargs) -> AgentExecutorPool:
+    """返回进程内唯一的执行器池，所有 Streamlit 会话共享"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = AgentExecutorPool(**kwargs)
+        return _pool
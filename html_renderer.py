@@ -0,0 +1,113 @@
+"""
+本地模板渲染 HTML 行程表（“快速”模式）。
+
+与 `generate_html_itinerary` + `review_and_optimize_html` 两轮 LLM 生成相比，
+这里直接把 Day 结构的行程解析后套入 `templates/itinerary.html.j2`，
+遵循同一套设计规范（A4、Tailwind、Font Awesome、打印样式、暖黄色调），
+毫秒级完成，不消耗 token。解析结果和渲染结果都按行程摘要缓存。
+"""
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from markupsafe import Markup, escape
+
+from itinerary_parser import Activity, DigestMemo, itinerary_digest, parsed_itinerary
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+ICONS = {
+    "transport": "fa-solid fa-train",
+    "food": "fa-solid fa-utensils",
+    "hotel": "fa-regular fa-building",
+    "sight": "fa-regular fa-flag",
+}
+
+_BOLD = re.compile(r"\*\*(.+?)\*\*")
+_LINK = re.compile(r"\[([^\]]+)\]\((https?://[^)\s]+)\)")
+
+
+def inline_md(text: str) -> Markup:
+    """转义文本后，只还原加粗和链接两种行内 Markdown"""
+    html = str(escape(text))
+    html = _LINK.sub(r'<a href="\2" target="_blank" class="text-orange-600 underline">\1</a>', html)
+    html = _BOLD.sub(r"<strong>\1</strong>", html)
+    return Markup(html)
+
+
+_env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(["html", "j2"]),
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+_env.filters["inline_md"] = inline_md
+
+_html = DigestMemo()
+
+
+def _activity_time(activity: Activity) -> str:
+    """活动前的时间标签：写明的时间优先，其次是时段名称"""
+    if activity.start is None:
+        return activity.slot
+    label = activity.start.strftime("%H:%M")
+    return f"{label}-{activity.end.strftime('%H:%M')}" if activity.end else label
+
+
+def render_itinerary_html(
+    itinerary_text: str,
+    destination: str = "",
+    start_date: Optional[date] = None,
+    num_days: Optional[int] = None,
+) -> str:
+    """
+    用本地模板把文本行程渲染成可打印的 HTML。
+
+    Args:
+        itinerary_text: `Day N:` 结构的行程文本
+        destination: 目的地，用于标题
+        start_date: 出发日期，提供时为每天标注日期
+        num_days: 旅行天数，用于副标题
+
+    Returns:
+        完整的 HTML 文档字符串
+    """
+    if isinstance(start_date, datetime):
+        start_date = start_date.date()
+    return _html.get_or_build(
+        (itinerary_digest(itinerary_text), destination, start_date, num_days),
+        lambda: _render(itinerary_text, destination, start_date, num_days),
+    )
+
+
+def _render(itinerary_text: str, destination: str, start_date: Optional[date], num_days: Optional[int]) -> str:
+    parsed = parsed_itinerary(itinerary_text)
+
+    days = []
+    for day in parsed.days:
+        day_date = start_date + timedelta(days=day.number - 1) if start_date else None
+        days.append({
+            "number": day.number,
+            "title": day.title,
+            "date": day_date.strftime("%m月%d日") if day_date else "",
+            "activities": [
+                {"text": a.summary if a.start else a.text, "kind": a.kind, "time": _activity_time(a)} for a in day.activities
+            ],
+        })
+
+    subtitle_parts = []
+    if start_date:
+        subtitle_parts.append(f"{start_date.strftime('%Y年%m月%d日')} 出发")
+    if num_days or days:
+        subtitle_parts.append(f"共 {num_days or len(days)} 天")
+
+    return _env.get_template("itinerary.html.j2").render(
+        title=f"{destination} 旅行规划表" if destination else "旅行规划表",
+        subtitle=" · ".join(subtitle_parts),
+        intro=parsed.intro,
+        days=days,
+        extras=[{"title": s.title, "lines": s.lines} for s in parsed.extras],
+        icons=ICONS,
+    )
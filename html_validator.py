@@ -0,0 +1,261 @@
+"""
+生成 HTML 的本地检查器。
+
+`review_and_optimize_html` 以前总是把整份 HTML 交给第二个 LLM 审查。这里先在本地
+找出真正存在的缺陷：代码前的引导文字、Markdown 代码块标记、缺少 `@media print`、
+缺少打印按钮、未知 CDN 域名和未闭合标签。引导文字和代码块标记直接在本地去掉；
+其余缺陷只把出问题的片段发给 LLM 修复，没有缺陷时完全跳过第二次 LLM 调用。
+"""
+import json
+import re
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse
+
+ALLOWED_CDN_HOSTS = {
+    "cdn.tailwindcss.com",
+    "cdnjs.cloudflare.com",
+    "cdn.jsdelivr.net",
+    "unpkg.com",
+    "fonts.googleapis.com",
+    "fonts.gstatic.com",
+    "use.fontawesome.com",
+    "kit.fontawesome.com",
+}
+
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+}
+# 浏览器允许省略结束标签的元素，不算作未闭合
+OPTIONAL_END_TAGS = {"p", "li", "dt", "dd", "tr", "td", "th", "thead", "tbody", "tfoot", "option", "colgroup"}
+# 未闭合标签片段的最大行数；所在块更长时不再按片段修复，改为整份审查
+MAX_FRAGMENT_LINES = 120
+
+_FENCE = re.compile(r"^\s*```[\w-]*\s*$", re.MULTILINE)
+_DOC_START = re.compile(r"<!DOCTYPE\s+html|<html[\s>]", re.IGNORECASE)
+_DOC_END = re.compile(r"</html\s*>", re.IGNORECASE)
+
+
+@dataclass
+class Issue:
+    code: str
+    message: str
+    # 原文中需要替换的确切片段；为空表示只能整体处理
+    fragment: str = ""
+    # 片段在 HTML 中的起止行号（从 1 开始），用于合并相互重叠的片段
+    lines: Optional[Tuple[int, int]] = None
+
+
+@dataclass
+class HtmlReport:
+    issues: List[Issue] = field(default_factory=list)
+    has_document: bool = True
+    # 去掉引导文字和代码块标记后实际检查的 HTML
+    html: str = ""
+
+    @property
+    def is_clean(self) -> bool:
+        return not self.issues
+
+    @property
+    def codes(self) -> List[str]:
+        return [issue.code for issue in self.issues]
+
+
+def extract_html(text: str) -> str:
+    """去掉 HTML 前后的说明文字和 Markdown 代码块标记"""
+    start = _DOC_START.search(text)
+    if not start:
+        return _FENCE.sub("", text).strip()
+    ends = list(_DOC_END.finditer(text))
+    end = ends[-1].end() if ends else len(text)
+    return _FENCE.sub("", text[start.start():end]).strip()
+
+
+class _TagChecker(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []  # (tag, 起始标签原文, 行号)
+        self.mismatched = []  # (tag, 起始标签原文, 行号, 所在块结束标签的行号)
+        self.resources = []  # (起始标签原文, url)
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        text = self.get_starttag_text() or f"<{tag}>"
+        if tag == "script" and attrs.get("src"):
+            self.resources.append((text, attrs["src"]))
+        if tag == "link" and attrs.get("href"):
+            self.resources.append((text, attrs["href"]))
+        if tag not in VOID_ELEMENTS:
+            self.stack.append((tag, text, self.getpos()[0]))
+
+    def handle_startendtag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "link" and attrs.get("href"):
+            self.resources.append((self.get_starttag_text() or "", attrs["href"]))
+
+    def handle_endtag(self, tag):
+        if tag in VOID_ELEMENTS:
+            return
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                # 中间被跳过的元素没有结束标签
+                for skipped in self.stack[i + 1:]:
+                    if skipped[0] not in OPTIONAL_END_TAGS:
+                        self.mismatched.append((*skipped, self.getpos()[0]))
+                del self.stack[i:]
+                return
+
+
+def _context(html: str, line: int, end_line: Optional[int] = None) -> str:
+    """
+    未闭合标签从起始行到所在块结束标签所在行的片段，缺失的结束标签一定落在其中；
+    所在块到文档末尾都没有结束时取到文档末尾。超过 MAX_FRAGMENT_LINES 行时返回空串。
+    """
+    lines = html.splitlines(keepends=True)
+    end = len(lines) if end_line is None else end_line
+    if end - line + 1 > MAX_FRAGMENT_LINES:
+        return ""
+    return "".join(lines[line - 1: end])
+
+
+def _lines_of(html: str, fragment: str) -> Optional[Tuple[int, int]]:
+    """片段第一次出现的起止行号；找不到时返回 None"""
+    offset = html.find(fragment) if fragment else -1
+    if offset == -1:
+        return None
+    start = html.count("\n", 0, offset) + 1
+    return start, start + fragment.count("\n")
+
+
+def validate_html(text: str) -> HtmlReport:
+    """检查 HTML 文本，返回实际存在的缺陷列表"""
+    report = HtmlReport()
+    start = _DOC_START.search(text)
+    if not start:
+        report.has_document = False
+        report.issues.append(Issue("no_document", "没有找到 <html> 文档"))
+        return report
+
+    if text[:start.start()].strip():
+        report.issues.append(Issue("leading_prose", "HTML 之前有说明文字"))
+    if _FENCE.search(text):
+        report.issues.append(Issue("markdown_fence", "包含 Markdown 代码块标记"))
+
+    html = report.html = extract_html(text)
+    lower = html.lower()
+    if "@media print" not in lower:
+        anchor = "</head>" if "</head>" in html else ""
+        report.issues.append(Issue("no_print_css", "缺少 @media print 打印样式", anchor))
+    if "window.print(" not in lower:
+        body = re.search(r"<body[^>]*>", html, re.IGNORECASE)
+        report.issues.append(Issue("no_print_button", "缺少打印按钮", body.group(0) if body else ""))
+
+    checker = _TagChecker()
+    checker.feed(html)
+    checker.close()
+
+    for tag_text, url in checker.resources:
+        host = urlparse(url if not url.startswith("//") else "https:" + url).hostname
+        if host and host not in ALLOWED_CDN_HOSTS:
+            report.issues.append(Issue("unknown_cdn", f"使用了未知的 CDN 域名 {host}", tag_text))
+
+    unclosed = checker.mismatched + [
+        (*item, None) for item in checker.stack if item[0] not in OPTIONAL_END_TAGS | {"html", "body", "head"}
+    ]
+    for tag, _, line, end_line in unclosed:
+        fragment = _context(html, line, end_line)
+        end = line + fragment.count("\n") - fragment.endswith("\n")
+        report.issues.append(
+            Issue("unclosed_tag", f"<{tag}> 标签（第 {line} 行）未闭合", fragment, (line, end) if fragment else None)
+        )
+
+    for issue in report.issues:
+        if issue.lines is None:
+            issue.lines = _lines_of(html, issue.fragment)
+    return report
+
+
+# ==================== 片段修复 ====================
+FRAGMENT_REVIEW_PROMPT = """# Role: HTML 片段修复助手
+
+下面是一份旅行规划表 HTML 中检查出的问题，以及每个问题对应的原文片段。
+请只修复这些问题，设计规范保持不变（A4 打印、TailwindCSS、Font Awesome、暖黄色调、中文文本）：
+- 缺少打印样式：在片段前补充 <style>，包含 @media print（隐藏 .no-print 元素、避免卡片跨页切割）；
+- 缺少打印按钮：在 <body> 后补充带 no-print 类、调用 window.print() 的按钮；
+- 未知 CDN：换成 cdn.tailwindcss.com / cdnjs.cloudflare.com / cdn.jsdelivr.net / fonts.googleapis.com 上的等价资源；
+- 未闭合标签：补全结束标签。
+
+严格只输出一个 JSON 数组，不要任何解释或 Markdown 标记，每项格式为：
+{"original": "原文片段（必须与给出的片段完全一致）", "replacement": "修复后的片段"}
+
+问题列表：
+"""
+
+
+def _merge_fragments(issues: List[Issue], html: str) -> Optional[List[Tuple[str, str]]]:
+    """
+    把行范围重叠的缺陷合并成一个片段，返回 (问题说明, 片段) 列表。
+
+    重叠的片段分别替换时，先应用的修复会改掉后一个片段的原文，使其无法再匹配。
+    合并后的片段超过 MAX_FRAGMENT_LINES 行时返回 None。
+    """
+    groups: List[list] = []  # [起始行, 结束行, 缺陷列表]
+    for issue in sorted((i for i in issues if i.lines), key=lambda i: i.lines):
+        start, end = issue.lines
+        if groups and start <= groups[-1][1]:
+            groups[-1][1] = max(groups[-1][1], end)
+            groups[-1][2].append(issue)
+        else:
+            groups.append([start, end, [issue]])
+
+    lines = html.splitlines(keepends=True)
+    merged = []
+    for start, end, group in groups:
+        if len(group) == 1:
+            merged.append((group[0].message, group[0].fragment))
+            continue
+        if end - start + 1 > MAX_FRAGMENT_LINES:
+            return None
+        merged.append(("；".join(i.message for i in group), "".join(lines[start - 1: end])))
+    merged += [(i.message, i.fragment) for i in issues if not i.lines]
+    return merged
+
+
+def build_fragment_prompt(report: HtmlReport) -> Optional[str]:
+    """只包含缺陷片段的修复提示词；存在无法定位的缺陷时返回 None"""
+    issues = [i for i in report.issues if i.code not in ("leading_prose", "markdown_fence")]
+    if not issues or any(not i.fragment for i in issues):
+        return None
+    fragments = _merge_fragments(issues, report.html)
+    if fragments is None:
+        return None
+    parts = [FRAGMENT_REVIEW_PROMPT]
+    for n, (message, fragment) in enumerate(fragments, 1):
+        parts.append(f"{n}. {message}\n片段:\n{fragment}\n")
+    return "\n".join(parts)
+
+
+def apply_fragment_fixes(html: str, llm_output: str) -> Tuple[str, bool]:
+    """
+    把 LLM 返回的 JSON 替换项应用到 HTML 上。
+
+    Returns:
+        (替换后的 HTML, 是否所有替换项都已应用)；解析失败时返回 (原 HTML, False)
+    """
+    text = _FENCE.sub("", llm_output).strip()
+    start, end = text.find("["), text.rfind("]")
+    try:
+        fixes = json.loads(text[start:end + 1]) if start != -1 else []
+    except ValueError:
+        return html, False
+    complete = isinstance(fixes, list) and bool(fixes)
+    for fix in fixes if isinstance(fixes, list) else []:
+        original, replacement = (fix.get("original"), fix.get("replacement")) if isinstance(fix, dict) else (None, None)
+        if original and isinstance(replacement, str) and original in html:
+            html = html.replace(original, replacement, 1)
+        else:
+            complete = False
+    return html, complete
@@ -0,0 +1,86 @@
+"""
+共享的 HTTP / Apify 客户端。
+
+工具函数不再每次调用都新建连接：同步路径复用一个带连接池的 `requests.Session`，
+异步路径复用 `httpx.AsyncClient` 和 `ApifyClientAsync`。异步客户端的连接池
+绑定在创建它的事件循环上，因此按事件循环分别缓存。
+"""
+import asyncio
+import os
+import threading
+import weakref
+from typing import Dict, Optional
+
+import httpx
+import requests
+from apify_client import ApifyClient, ApifyClientAsync
+from requests.adapters import HTTPAdapter
+
+# 普通 HTTP 请求的超时时间（秒）
+HTTP_TIMEOUT = 20.0
+# 连接池大小
+POOL_MAXSIZE = 20
+# Apify 客户端自身对单个 API 请求的重试次数；整次调用的重试和熔断由 upstreams 负责
+APIFY_MAX_RETRIES = 2
+# Apify API 地址，默认为官方服务；压测时指向本地替身（见 benchmarks/）
+APIFY_API_URL = os.environ.get("APIFY_API_URL") or None
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_apify_clients: Dict[str, ApifyClient] = {}
+_async_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_async_apify_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, ApifyClientAsync]]" = weakref.WeakKeyDictionary()
+
+
+def get_http_session() -> requests.Session:
+    """返回进程内共享的 keep-alive `requests.Session`"""
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_MAXSIZE, pool_maxsize=POOL_MAXSIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def get_apify_client(token: str) -> ApifyClient:
+    """按 token 缓存的同步 Apify 客户端"""
+    with _lock:
+        client = _apify_clients.get(token)
+        if client is None:
+            client = _apify_clients[token] = ApifyClient(token, api_url=APIFY_API_URL, max_retries=APIFY_MAX_RETRIES)
+        return client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """返回当前事件循环共享的 keep-alive `httpx.AsyncClient`"""
+    loop = asyncio.get_running_loop()
+    client = _async_http_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=POOL_MAXSIZE, max_keepalive_connections=POOL_MAXSIZE),
+        )
+        _async_http_clients[loop] = client
+    return client
+
+
+def get_apify_client_async(token: str) -> ApifyClientAsync:
+    """返回当前事件循环中按 token 缓存的异步 Apify 客户端"""
+    loop = asyncio.get_running_loop()
+    clients = _async_apify_clients.setdefault(loop, {})
+    client = clients.get(token)
+    if client is None:
+        client = clients[token] = ApifyClientAsync(token, api_url=APIFY_API_URL, max_retries=APIFY_MAX_RETRIES)
+    return client
+
+
+async def aclose_async_clients():
+    """关闭当前事件循环上的异步客户端（事件循环结束前调用）"""
+    loop = asyncio.get_running_loop()
+    client = _async_http_clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+    _async_apify_clients.pop(loop, None)
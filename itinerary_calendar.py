@@ -0,0 +1,74 @@
+"""
+根据结构化行程生成 iCalendar (.ics) 文件。
+
+每天一个全天事件（包含当天的完整安排），能确定时间的活动另外生成带起止时间
+的事件，导入日历后可以直接看到每个时段的安排。结果按行程摘要和出发日期缓存。
+"""
+from datetime import date, datetime, timedelta
+from typing import Optional, Union
+
+from icalendar import Calendar, Event
+
+from itinerary_parser import DigestMemo, ParsedItinerary, itinerary_digest, parsed_itinerary, timed_activities
+
+_ics = DigestMemo()
+
+
+def _event(summary: str, description: str, start, end) -> Event:
+    event = Event()
+    event.add("summary", summary)
+    event.add("description", description)
+    event.add("dtstart", start)
+    event.add("dtend", end)
+    event.add("dtstamp", datetime.now())
+    return event
+
+
+def build_calendar(parsed: ParsedItinerary, start_date: date, fallback_text: str = "") -> Calendar:
+    """
+    把结构化行程转换成日历。
+
+    Args:
+        parsed: 解析后的行程
+        start_date: 第 1 天的日期
+        fallback_text: 没有 Day N 结构时作为单个全天事件描述的原文
+    """
+    cal = Calendar()
+    cal.add("prodid", "-//AI 旅行计划器//github.com//")
+    cal.add("version", "2.0")
+
+    if not parsed.days:
+        # 没有 Day N 格式时，把整个文本作为单个事件
+        cal.add_component(_event("旅行行程", fallback_text, start_date, start_date + timedelta(days=1)))
+        return cal
+
+    for day in parsed.days:
+        day_date = start_date + timedelta(days=day.number - 1)
+        summary = f"第 {day.number} 天行程" + (f"：{day.title}" if day.title else "")
+        cal.add_component(_event(summary, "\n".join(day.lines), day_date, day_date + timedelta(days=1)))
+
+        for item in timed_activities(day):
+            activity = item.activity
+            description = f"{activity.slot}：{activity.text}" if activity.slot else activity.text
+            cal.add_component(_event(
+                activity.summary,
+                description,
+                datetime.combine(day_date, item.start),
+                datetime.combine(day_date, item.end),
+            ))
+    return cal
+
+
+def generate_ics_content(plan_text: str, start_date: Optional[Union[date, datetime]] = None) -> bytes:
+    """
+    根据行程文本生成 iCalendar (.ics) 文件内容，同一份行程和出发日期只生成一次。
+    """
+    if start_date is None:
+        start_date = datetime.today()
+    if isinstance(start_date, datetime):
+        start_date = start_date.date()
+
+    return _ics.get_or_build(
+        (itinerary_digest(plan_text), start_date),
+        lambda: build_calendar(parsed_itinerary(plan_text), start_date, plan_text).to_ical(),
+    )
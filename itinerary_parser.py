@@ -0,0 +1,368 @@
+"""
+把 Agent 输出的 `Day N:` 结构行程解析成 天 → 时段 → 活动 的结构化数据。
+
+本地 HTML 模板、ICS 日历和下载文件都从同一份解析结果派生：
+
+- `ItineraryParser` 逐行增量解析，每行只处理一次，可以边接收流式文本边解析；
+- `parsed_itinerary` 按行程文本的摘要缓存解析结果，同一份行程只解析一次；
+- 活动行首的时间（如 `09:00-11:30`）和时段标题（如 `**上午**`）换算成
+  活动的起止时间，用于生成带时间的日历事件。
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import time
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+# 行首的 Day N / 第 N 天（允许前面有 Markdown 标题/加粗标记）
+DAY_HEADER = re.compile(r"^[#>*\s]*(?:Day\s*(\d+)|第\s*(\d+)\s*天)\s*[:：]?\s*(.*)$", re.IGNORECASE)
+# 标题行，如 "## 天气"、"### 活动安排"、"**穿衣建议**"
+SECTION_HEADER = re.compile(r"^(?:(#{1,6})\s*(.+?)|\*\*(.+?)\*\*[:：]?)\s*$")
+# 一级、二级标题总是开始新的附加模块；更低级别的标题和加粗标题在 Day 内部只是小标题
+TOP_LEVEL_HEADER = 2
+# 行程结束后的附加模块常用标题，出现在 Day 内部时同样结束当天的内容
+EXTRA_TITLES = (
+    "天气", "穿衣", "行前", "出行准备", "必备", "注意事项", "温馨提示", "小贴士", "实用信息",
+    "预算", "费用", "总结", "总体建议",
+)
+
+# 日内时段标题，出现在 Day 内部时不视为新的附加模块
+TIME_SLOTS = ("早上", "上午", "中午", "下午", "傍晚", "晚上", "夜间", "早餐", "午餐", "晚餐", "交通", "住宿")
+
+# 时段标题没有写明时间时使用的默认时间窗口；交通、住宿没有固定时间
+SLOT_WINDOWS: Dict[str, Tuple[time, time]] = {
+    "早上": (time(8, 0), time(9, 0)),
+    "早餐": (time(8, 0), time(9, 0)),
+    "上午": (time(9, 0), time(12, 0)),
+    "中午": (time(12, 0), time(13, 30)),
+    "午餐": (time(12, 0), time(13, 0)),
+    "下午": (time(14, 0), time(17, 30)),
+    "傍晚": (time(17, 30), time(19, 0)),
+    "晚餐": (time(18, 0), time(19, 30)),
+    "晚上": (time(19, 30), time(21, 30)),
+    "夜间": (time(21, 30), time(23, 0)),
+}
+# 只写了开始时间的活动默认持续的分钟数
+DEFAULT_ACTIVITY_MINUTES = 60
+
+_TIME = r"(\d{1,2})[:：](\d{2})"
+_RANGE = rf"{_TIME}(?:\s*[-~～–—至到]\s*{_TIME})?"
+# 时段标题，如 "上午"、"下午（14:00-17:00）：参观博物馆"
+SLOT_LINE = re.compile(
+    rf"^({'|'.join(TIME_SLOTS)})\s*(?:[（(]\s*{_RANGE}\s*[)）])?\s*(?:[:：]\s*(.*))?$"
+)
+# 标题本身就是时段名（可带时间或说明），"交通建议"、"住宿推荐" 这类标题不算
+SLOT_TITLE = re.compile(rf"^(?:{'|'.join(TIME_SLOTS)})\s*(?:$|[:：（(])")
+# 行首的列表符号
+LIST_MARKER = re.compile(r"^\s*(?:[-*+]|\d+[.、])\s+")
+# 活动行首的时间，如 "09:00 抵达"、"[14:00-16:30] 游览"
+ACTIVITY_TIME = re.compile(rf"^[\[【（(]?\s*{_RANGE}\s*[\]】）)]?\s*[:：\-–—]?\s*")
+
+ACTIVITY_KEYWORDS = {
+    "transport": ("高铁", "火车", "航班", "飞机", "地铁", "公交", "打车", "出租", "步行", "机场", "车站", "列车"),
+    "food": ("早餐", "午餐", "晚餐", "美食", "餐厅", "小吃", "咖啡", "餐"),
+    "hotel": ("酒店", "入住", "退房", "住宿", "民宿"),
+}
+
+
+@dataclass
+class Activity:
+    """一条活动；start / end 只在文本中写明了时间时才有值"""
+    text: str
+    kind: str
+    slot: str = ""
+    start: Optional[time] = None
+    end: Optional[time] = None
+
+    @property
+    def summary(self) -> str:
+        """去掉行首时间和 Markdown 标记后的活动描述"""
+        return ACTIVITY_TIME.sub("", _plain(self.text)).strip() or _plain(self.text)
+
+
+@dataclass
+class TimeSlot:
+    """一天中的一个时段；没有时段标题的活动归入名称为空的时段"""
+    name: str = ""
+    start: Optional[time] = None
+    end: Optional[time] = None
+    activities: List[Activity] = field(default_factory=list)
+
+
+@dataclass
+class Section:
+    title: str
+    lines: List[str] = field(default_factory=list)
+
+
+@dataclass
+class DaySection(Section):
+    number: int = 0
+    slots: List[TimeSlot] = field(default_factory=list)
+
+    @property
+    def activities(self) -> List[Activity]:
+        return [a for slot in self.slots for a in slot.activities]
+
+
+@dataclass
+class ParsedItinerary:
+    intro: List[str] = field(default_factory=list)
+    days: List[DaySection] = field(default_factory=list)
+    extras: List[Section] = field(default_factory=list)
+
+
+class TimedActivity(NamedTuple):
+    activity: Activity
+    start: time
+    end: time
+
+
+def classify_activity(text: str) -> str:
+    """粗略判断一行活动的类型：transport / food / hotel / sight"""
+    for kind, words in ACTIVITY_KEYWORDS.items():
+        if any(w in text for w in words):
+            return kind
+    return "sight"
+
+
+def _clean(line: str) -> str:
+    return LIST_MARKER.sub("", line).strip()
+
+
+def _plain(line: str) -> str:
+    """去掉列表符号、标题符号和加粗标记，只用于识别时段和时间"""
+    return _clean(line).replace("**", "").lstrip("#> ").strip()
+
+
+def _time(hour: Optional[str], minute: Optional[str]) -> Optional[time]:
+    if hour is None or int(hour) > 23 or int(minute) > 59:
+        return None
+    return time(int(hour), int(minute))
+
+
+# ==================== 增量解析 ====================
+class ItineraryParser:
+    """
+    逐行增量解析行程文本。
+
+    `feed` 可以多次传入流式文本的新增部分，只有完整的行会被解析，
+    未结束的最后一行留到下一次 `feed` 或 `close`；每行只处理一次。
+
+        parser = ItineraryParser()
+        parser.feed(chunk)
+        parsed = parser.close()
+    """
+
+    def __init__(self):
+        self.parsed = ParsedItinerary()
+        self.length = 0
+        self._digest = hashlib.sha1()
+        self._pending: List[str] = []
+        self._current: Optional[Section] = None
+        self._slot: Optional[TimeSlot] = None
+
+    def feed(self, chunk: str) -> "ItineraryParser":
+        if not chunk:
+            return self
+        self.length += len(chunk)
+        self._digest.update(chunk.encode("utf-8"))
+        end = chunk.rfind("\n")
+        if end < 0:
+            self._pending.append(chunk)
+            return self
+        complete = "".join(self._pending) + chunk[:end]
+        self._pending = [chunk[end + 1:]]
+        for line in complete.split("\n"):
+            self._line(line)
+        return self
+
+    def close(self) -> ParsedItinerary:
+        """解析最后一行并返回结果"""
+        tail, self._pending = "".join(self._pending), []
+        if tail:
+            self._line(tail)
+        return self.parsed
+
+    def digest(self) -> str:
+        """已传入文本的摘要，与 `itinerary_digest(全文)` 相同"""
+        return self._digest.hexdigest()
+
+    # ---------- 逐行处理 ----------
+    def _line(self, raw: str):
+        line = raw.strip()
+        if not line or set(line) <= set("-*_="):
+            return
+
+        day = DAY_HEADER.match(line)
+        if day:
+            self._current = DaySection(title=day.group(3).strip(" *#"), number=int(day.group(1) or day.group(2)))
+            self._slot = None
+            self.parsed.days.append(self._current)
+            return
+
+        if isinstance(self._current, DaySection):
+            slot = SLOT_LINE.match(_plain(line))
+            if slot:
+                self._start_slot(slot)
+                self._current.lines.append(_clean(line))
+                return
+
+        header = SECTION_HEADER.match(line)
+        if header and self.parsed.days:
+            if self._opens_extra(header):
+                title = (header.group(2) or header.group(3)).strip(" *#:：")
+                self._current, self._slot = Section(title=title), None
+                self.parsed.extras.append(self._current)
+                return
+            if isinstance(self._current, DaySection):
+                # Day 内部的小标题只保留为当天的文字，不算作活动；
+                # 之后的条目不再属于前一个时段
+                self._current.lines.append(_clean(line))
+                self._slot = None
+                return
+
+        text = _clean(line)
+        if self._current is None:
+            self.parsed.intro.append(text)
+            return
+        self._current.lines.append(text)
+        if isinstance(self._current, DaySection):
+            self._add_activity(text)
+
+    def _opens_extra(self, header: "re.Match") -> bool:
+        """
+        标题是否开始新的附加模块。
+
+        附加模块之后的标题都开始新模块；Day 内部只有一级、二级标题或常用的附加模块
+        标题才结束当天，`**活动安排：**`、`### 交通建议` 这类小标题留在当天。
+        """
+        title = (header.group(2) or header.group(3)).strip(" *#:：")
+        if SLOT_TITLE.match(title):
+            return False
+        if not isinstance(self._current, DaySection):
+            return True
+        level = len(header.group(1) or "")
+        return 0 < level <= TOP_LEVEL_HEADER or any(word in title for word in EXTRA_TITLES)
+
+    def _start_slot(self, match: "re.Match"):
+        name = match.group(1)
+        start, end = _time(match.group(2), match.group(3)), _time(match.group(4), match.group(5))
+        if start is None:
+            start, end = SLOT_WINDOWS.get(name, (None, None))
+        self._slot = TimeSlot(name=name, start=start, end=end)
+        self._current.slots.append(self._slot)
+        if match.group(6):
+            self._add_activity(match.group(6).strip())
+
+    def _add_activity(self, text: str):
+        if self._slot is None:
+            self._slot = TimeSlot()
+            self._current.slots.append(self._slot)
+        timed = ACTIVITY_TIME.match(_plain(text))
+        start = end = None
+        if timed:
+            start, end = _time(timed.group(1), timed.group(2)), _time(timed.group(3), timed.group(4))
+        self._slot.activities.append(
+            Activity(text=text, kind=classify_activity(text), slot=self._slot.name, start=start, end=end)
+        )
+
+
+def parse_itinerary(text: str) -> ParsedItinerary:
+    """按 Day N、时段和附加模块标题把行程文本切分成结构化数据"""
+    return ItineraryParser().feed(text).close()
+
+
+# ==================== 活动时间 ====================
+def _minutes(t: time) -> int:
+    return t.hour * 60 + t.minute
+
+
+def _from_minutes(minutes: int) -> time:
+    minutes = min(max(minutes, 0), 23 * 60 + 59)
+    return time(minutes // 60, minutes % 60)
+
+
+def timed_activities(day: DaySection) -> List[TimedActivity]:
+    """
+    一天中可以确定时间的活动，按开始时间排序。
+
+    行首写明时间的活动直接使用该时间（只有开始时间时默认持续
+    DEFAULT_ACTIVITY_MINUTES 分钟）；时段内都没有写时间的活动平分时段的时间窗口；
+    其余活动没有时间，只出现在当天的全天事件里。
+    """
+    timed: List[TimedActivity] = []
+    for slot in day.slots:
+        explicit = [a for a in slot.activities if a.start is not None]
+        for a in explicit:
+            end = a.end if a.end and a.end > a.start else _from_minutes(_minutes(a.start) + DEFAULT_ACTIVITY_MINUTES)
+            timed.append(TimedActivity(a, a.start, end))
+        if explicit or not slot.activities or slot.start is None or slot.end is None or slot.end <= slot.start:
+            continue
+        begin, span = _minutes(slot.start), _minutes(slot.end) - _minutes(slot.start)
+        count = len(slot.activities)
+        for i, a in enumerate(slot.activities):
+            timed.append(TimedActivity(
+                a, _from_minutes(begin + span * i // count), _from_minutes(begin + span * (i + 1) // count)
+            ))
+    return sorted(timed, key=lambda t: t.start)
+
+
+# ==================== 按摘要缓存 ====================
+def itinerary_digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class DigestMemo:
+    """
+    以行程摘要（及渲染参数）为键缓存派生结果的小型 LRU，线程安全。
+
+    Streamlit 重跑、重新提交相同需求时，解析结果、HTML 和 ICS 直接复用。
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def get_or_build(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = build()
+            self.put(key, value)
+        return value
+
+
+_parsed = DigestMemo()
+
+
+def parsed_itinerary(text: str) -> ParsedItinerary:
+    """解析行程文本，同一份文本只解析一次；返回的结果是共享的，不要修改"""
+    return _parsed.get_or_build(itinerary_digest(text), lambda: parse_itinerary(text))
+
+
+def remember_parsed(text: str, parser: ItineraryParser) -> bool:
+    """
+    流式规划结束后登记增量解析的结果，之后的 `parsed_itinerary(text)` 直接命中。
+    解析器接收的文本与最终文本不一致时不登记，返回 False。
+    """
+    if parser.length != len(text) or parser.digest() != itinerary_digest(text):
+        return False
+    _parsed.put(parser.digest(), parser.close())
+    return True
@@ -0,0 +1,239 @@
+"""
+后台规划任务队列。
+
+一次完整规划（预查询 + Agent 循环 + 两次 HTML 生成）要跑好几分钟，放在
+Streamlit 脚本线程里执行时，这段时间内该会话无法重跑，任何控件操作都可能
+打断任务。这里把任务交给进程级事件循环（async_runtime）上的固定数量 worker 执行：
+
+- 每个任务有 ID、排队位置、当前阶段、进度和流式文本，界面只需轮询快照；
+- 同时运行的规划数有上限（准入控制），避免多用户同时提交时打爆 LLM 限流；
+- 排队数量也有上限，超出时拒绝提交；
+- 已结束的任务保留一段时间供界面取回结果，之后自动清理。
+"""
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from async_runtime import get_runtime
+
+logger = logging.getLogger(__name__)
+
+# 同时运行的规划数和排队上限，可用环境变量调整
+MAX_CONCURRENT_JOBS = int(os.environ.get("PLAN_MAX_CONCURRENT", "2"))
+MAX_QUEUED_JOBS = int(os.environ.get("PLAN_MAX_QUEUED", "20"))
+# 已结束任务的保留时间（秒）
+JOB_RETENTION = 3600.0
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class QueueFullError(RuntimeError):
+    """排队任务已达上限"""
+
+
+@dataclass
+class Job:
+    """一个后台任务的状态，由 worker 更新、界面线程读取"""
+    id: str
+    label: str = ""
+    status: str = QUEUED
+    stage: str = "排队中"
+    progress: float = 0.0
+    text: str = ""
+    events: List[str] = field(default_factory=list)
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    _task: Optional[asyncio.Task] = field(default=None, repr=False)
+    _cancel_requested: bool = field(default=False, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def update(self, stage: Optional[str] = None, progress: Optional[float] = None):
+        """更新当前阶段和进度（0~1）"""
+        if stage is not None:
+            self.stage = stage
+        if progress is not None:
+            self.progress = max(self.progress, min(progress, 1.0))
+
+    def log(self, message: str):
+        """追加一条进度日志"""
+        self.events.append(message)
+
+
+JobFunc = Callable[..., Awaitable[Dict[str, Any]]]
+
+
+class JobQueue:
+    """
+    有并发上限的后台任务队列。
+
+    任务函数是协程函数，第一个参数为 `Job`，通过 `job.update` / `job.log` /
+    `job.text` 报告进度，返回值作为任务结果保存在 `job.result` 中。
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT_JOBS,
+        max_queued: int = MAX_QUEUED_JOBS,
+        retention: float = JOB_RETENTION,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.retention = retention
+
+        self._jobs: Dict[str, Job] = {}
+        self._pending: Deque[str] = deque()
+        self._lock = threading.Lock()
+        # 先取得事件循环线程，保证退出时任务队列先于事件循环关闭
+        self._runtime = get_runtime()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    # ---------- worker ----------
+    def _ensure_workers(self):
+        with self._lock:
+            if self._queue is None:
+                self._runtime.run(self._start_workers())
+
+    async def _start_workers(self):
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.max_concurrent)]
+
+    async def _worker(self, index: int):
+        while True:
+            job, func, args, kwargs = await self._queue.get()
+            with self._lock:
+                if job.id in self._pending:
+                    self._pending.remove(job.id)
+                # 移出排队列表和切换为运行中在同一把锁内完成，不会出现“排队中但不在队列里”
+                if not job._cancel_requested:
+                    job.status, job.started_at = RUNNING, time.time()
+            if job._cancel_requested:
+                self._queue.task_done()
+                continue
+
+            job.update(stage="开始执行")
+            # 任务在独立的 Task 中运行，取消它不会影响 worker 本身
+            job._task = asyncio.create_task(func(job, *args, **kwargs))
+            if job._cancel_requested:
+                job._task.cancel()
+            try:
+                job.result = await job._task
+                job.status = DONE
+                job.update(stage="已完成", progress=1.0)
+            except asyncio.CancelledError:
+                job.status, job.stage = CANCELLED, "已取消"
+                if not job._cancel_requested:
+                    # worker 本身被取消（关闭队列或事件循环），不再处理后续任务
+                    raise
+            except Exception as e:
+                logger.exception("任务 %s 执行失败", job.id)
+                job.status, job.stage, job.error = FAILED, "执行失败", f"{type(e).__name__}: {e}"
+            finally:
+                job._task = None
+                job.finished_at = time.time()
+                self._queue.task_done()
+
+    # ---------- 对外接口 ----------
+    def submit(self, func: JobFunc, *args, label: str = "", **kwargs) -> Job:
+        """
+        提交一个任务，立即返回 `Job`。
+
+        Raises:
+            QueueFullError: 排队任务已达上限
+        """
+        self._ensure_workers()
+        self._prune()
+        job = Job(id=uuid.uuid4().hex[:12], label=label)
+        with self._lock:
+            if len(self._pending) >= self.max_queued:
+                raise QueueFullError(f"当前排队任务已达上限（{self.max_queued} 个），请稍后再试")
+            self._jobs[job.id] = job
+            self._pending.append(job.id)
+        self._runtime.call_soon(self._queue.put_nowait, (job, func, args, kwargs))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def position(self, job_id: str) -> int:
+        """排队位置（1 表示下一个执行），不在队列中时返回 0"""
+        with self._lock:
+            try:
+                return self._pending.index(job_id) + 1
+            except ValueError:
+                return 0
+
+    def cancel(self, job_id: str) -> bool:
+        """取消排队中或运行中的任务，返回是否发出了取消"""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        job._cancel_requested = True
+        with self._lock:
+            if job_id in self._pending:
+                self._pending.remove(job_id)
+                job.status, job.stage, job.finished_at = CANCELLED, "已取消", time.time()
+                return True
+        task = job._task
+        if task is not None:
+            self._runtime.call_soon(task.cancel)
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        """排队中 / 运行中的任务数"""
+        with self._lock:
+            running = sum(1 for j in self._jobs.values() if j.status == RUNNING)
+            return {"queued": len(self._pending), "running": running, "max_concurrent": self.max_concurrent}
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            for job_id in [i for i, j in self._jobs.items() if j.finished and (j.finished_at or 0) < cutoff]:
+                del self._jobs[job_id]
+
+    async def _aclose(self):
+        tasks = [j._task for j in self._jobs.values() if j._task] + self._workers
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self, timeout: float = 10.0):
+        """取消所有任务并停止 worker（事件循环本身由 async_runtime 管理）"""
+        if self._queue is None:
+            return
+        for job_id in list(self._jobs):
+            self.cancel(job_id)
+        try:
+            self._runtime.submit(self._aclose()).result(timeout)
+        except Exception as e:
+            logger.warning("关闭任务队列时出错: %r", e)
+        self._queue = None
+
+
+# ==================== 进程级单例 ====================
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue(**kwargs) -> JobQueue:
+    """返回进程内唯一的任务队列，所有 Streamlit 会话共享"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(**kwargs)
+            atexit.register(_queue.close)
+        return _queue
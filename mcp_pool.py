@@ -0,0 +1,261 @@
+"""
+进程级 MCP 服务连接池。
+
+`MultiServerMCPClient.get_tools()` 返回的工具在每次调用时都会重新建立会话，
+对 stdio 服务而言就是重新拉起一次 `npx` / `uv` 子进程。本模块让每个配置的
+MCP 服务在整个进程内只启动一次并长期保持会话：
+
+- 所有 Streamlit 会话共享同一批已预热的服务进程和工具列表；
+- 后台定期 ping 做健康检查，服务崩溃（例如 `Bad file descriptor` 启动失败）
+  后按指数退避自动重启；
+- 每个服务有独立的并发上限，多个用户的工具调用在少量进程上排队复用。
+"""
+import asyncio
+import atexit
+import logging
+import threading
+from typing import Dict, List, Optional, Union
+
+import anyio
+from langchain_core.tools import BaseTool, StructuredTool
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import load_mcp_tools
+
+from async_runtime import get_runtime
+
+logger = logging.getLogger(__name__)
+
+# 视为“服务已断开”的异常，遇到后会触发重启。
+# 单次调用超时不在其中：慢调用只报告给调用方，重启共享服务会中断其他会话的调用；
+# 服务真正卡死时由健康检查的 ping 超时触发重启。
+_CONNECTION_ERRORS = (
+    anyio.ClosedResourceError,
+    anyio.BrokenResourceError,
+    ConnectionError,
+    OSError,
+)
+
+
+class _ServerHandle:
+    """单个 MCP 服务的运行状态"""
+
+    def __init__(self, name: str, max_concurrency: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.ready = asyncio.Event()
+        self.restart_requested = asyncio.Event()
+        self.tools: Dict[str, BaseTool] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.restarts = 0
+        self.in_flight = 0
+        self.last_error: Optional[str] = None
+
+
+class MCPServerPool:
+    """
+    长期持有 MCP 会话的连接池。
+
+    会话都运行在进程级事件循环线程（async_runtime）上，因此可以被任意线程、
+    任意事件循环中的 Agent 共享；`get_tools()` 返回的工具会把调用转交到这个循环上执行。
+    """
+
+    def __init__(
+        self,
+        servers_config: dict,
+        max_concurrency: Union[int, Dict[str, int]] = 4,
+        health_interval: float = 30.0,
+        start_timeout: float = 60.0,
+        call_timeout: float = 120.0,
+    ):
+        self.servers_config = servers_config
+        self.max_concurrency = max_concurrency
+        self.health_interval = health_interval
+        self.start_timeout = start_timeout
+        self.call_timeout = call_timeout
+
+        self._client = MultiServerMCPClient(servers_config)
+        self._handles: Dict[str, _ServerHandle] = {}
+        self._tools: Optional[List[BaseTool]] = None
+        self._closed = False
+        # 先取得事件循环线程，保证退出时连接池先于事件循环关闭
+        self._runtime = get_runtime()
+
+    # ---------- 后台事件循环 ----------
+    async def _run_in_pool(self, coro):
+        """在进程级事件循环上执行协程，并在调用方的事件循环中等待结果"""
+        return await self._runtime.arun(coro)
+
+    def _concurrency_for(self, name: str) -> int:
+        if isinstance(self.max_concurrency, dict):
+            return self.max_concurrency.get(name, 4)
+        return self.max_concurrency
+
+    # ---------- 服务生命周期 ----------
+    async def _serve(self, handle: _ServerHandle):
+        """保持一个服务的会话，崩溃或健康检查失败后自动重启"""
+        backoff = 1.0
+        while not self._closed:
+            try:
+                async with self._client.session(handle.name) as session:
+                    tools = await load_mcp_tools(session)
+                    handle.tools = {t.name: t for t in tools}
+                    handle.last_error = None
+                    handle.ready.set()
+                    backoff = 1.0
+                    logger.info("MCP 服务 %s 已就绪，共 %d 个工具", handle.name, len(tools))
+                    await self._watch(handle, session)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # anyio 会把子进程异常包装成 ExceptionGroup
+                handle.last_error = repr(e)
+                logger.warning("MCP 服务 %s 异常退出: %r", handle.name, e)
+            finally:
+                handle.ready.clear()
+
+            if self._closed:
+                break
+            handle.restarts += 1
+            logger.info("%.0f 秒后重启 MCP 服务 %s (第 %d 次)", backoff, handle.name, handle.restarts)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+    async def _watch(self, handle: _ServerHandle, session):
+        """定期 ping 服务；收到重启请求或 ping 失败时返回/抛出以触发重启"""
+        while not self._closed:
+            try:
+                await asyncio.wait_for(handle.restart_requested.wait(), timeout=self.health_interval)
+            except asyncio.TimeoutError:
+                await asyncio.wait_for(session.send_ping(), timeout=10.0)
+                continue
+            handle.restart_requested.clear()
+            logger.info("MCP 服务 %s 收到重启请求", handle.name)
+            return
+
+    async def _start(self):
+        for name in self.servers_config:
+            if name not in self._handles:
+                handle = _ServerHandle(name, self._concurrency_for(name))
+                handle.task = asyncio.create_task(self._serve(handle), name=f"mcp-{name}")
+                self._handles[name] = handle
+
+    async def _wait_ready(self):
+        await self._start()
+        names = list(self._handles)
+
+        async def _wait(handle: _ServerHandle):
+            # 已经失败重启过的服务不再阻塞新会话，等它恢复后再纳入工具列表
+            if handle.restarts and not handle.ready.is_set():
+                raise asyncio.TimeoutError
+            await asyncio.wait_for(handle.ready.wait(), timeout=self.start_timeout)
+
+        results = await asyncio.gather(
+            *(_wait(self._handles[n]) for n in names), return_exceptions=True
+        )
+
+        tools: List[BaseTool] = []
+        complete = True
+        for name, result in zip(names, results):
+            handle = self._handles[name]
+            if isinstance(result, BaseException):
+                complete = False
+                logger.warning("MCP 服务 %s 未就绪，暂不提供其工具: %s", name, handle.last_error)
+                continue
+            tools.extend(self._wrap_tool(handle, t) for t in handle.tools.values())
+        return tools, complete
+
+    # ---------- 工具调用 ----------
+    def _wrap_tool(self, handle: _ServerHandle, tool: BaseTool) -> BaseTool:
+        """包装 MCP 工具：调用时按服务限流，并在池的事件循环上执行"""
+        server_name, tool_name = handle.name, tool.name
+
+        async def _call(**kwargs):
+            return await self._run_in_pool(self._invoke(server_name, tool_name, kwargs))
+
+        return StructuredTool(
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            coroutine=_call,
+            response_format=tool.response_format,
+            metadata=tool.metadata,
+        )
+
+    async def _invoke(self, server_name: str, tool_name: str, kwargs: dict):
+        handle = self._handles[server_name]
+        async with handle.semaphore:
+            await asyncio.wait_for(handle.ready.wait(), timeout=self.start_timeout)
+            # 服务重启后工具对象会更新，因此每次调用时重新查找
+            tool = handle.tools[tool_name]
+            handle.in_flight += 1
+            try:
+                return await asyncio.wait_for(tool.coroutine(**kwargs), timeout=self.call_timeout)
+            except asyncio.TimeoutError:
+                # Python 3.11 起 TimeoutError 是 OSError 的子类，必须先于连接错误处理
+                raise
+            except _CONNECTION_ERRORS:
+                handle.restart_requested.set()
+                raise
+            finally:
+                handle.in_flight -= 1
+
+    # ---------- 对外接口 ----------
+    async def get_tools(self) -> List[BaseTool]:
+        """启动（如尚未启动）所有服务，并返回所有会话共享的工具列表"""
+        if self._tools is None:
+            tools, complete = await self._run_in_pool(self._wait_ready())
+            if not complete:
+                # 有服务尚未就绪时不缓存，后续会话会重新尝试纳入其工具
+                return tools
+            self._tools = tools
+        return list(self._tools)
+
+    def restart(self, server_name: str):
+        """请求重启指定服务"""
+        handle = self._handles.get(server_name)
+        if handle is not None:
+            self._runtime.call_soon(handle.restart_requested.set)
+
+    def status(self) -> Dict[str, dict]:
+        """各服务的健康状态，便于在界面或日志中展示"""
+        return {
+            name: {
+                "ready": h.ready.is_set(),
+                "restarts": h.restarts,
+                "in_flight": h.in_flight,
+                "max_concurrency": h.max_concurrency,
+                "last_error": h.last_error,
+            }
+            for name, h in self._handles.items()
+        }
+
+    async def _aclose(self):
+        self._closed = True
+        tasks = [h.task for h in self._handles.values() if h.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self, timeout: float = 10.0):
+        """关闭所有服务会话（事件循环本身由 async_runtime 管理）"""
+        if self._closed or not self._handles:
+            return
+        try:
+            self._runtime.submit(self._aclose()).result(timeout)
+        except Exception as e:
+            logger.warning("关闭 MCP 连接池时出错: %r", e)
+
+
+# ==================== 进程级单例 ====================
+_pool: Optional[MCPServerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_mcp_pool(servers_config: dict, **kwargs) -> MCPServerPool:
+    """返回进程内唯一的 MCP 连接池，首次调用时用给定配置创建"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = MCPServerPool(servers_config, **kwargs)
+            atexit.register(_pool.close)
+        return _pool
@@ -0,0 +1,158 @@
+"""
+按流水线阶段分档路由模型。
+
+规划需要旗舰模型的推理能力，而生成 HTML、审查 HTML 主要是机械的格式化工作，
+用同一个旗舰模型只会白白承担它的延迟和费用。这里把模型分成档位：
+
+- strong：侧边栏选择的模型，默认用于规划；
+- fast：同一服务商的轻量模型（可用环境变量指向其他地址），默认用于 HTML 生成和审查。
+
+每个档位有自己的地址、超时时间和并发上限；某个阶段在该档位超时后，自动换到
+回退档位重新执行一次（fast 超时回退到 strong）。
+
+上下文压缩（scratchpad）是本地的确定性摘要，不调用模型，因此不参与分档。
+"""
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Set, Tuple, TypeVar
+
+from agent_budget import PLAN_DEADLINE, SYNTHESIS_RESERVE
+
+logger = logging.getLogger(__name__)
+
+STRONG, FAST = "strong", "fast"
+
+# 各阶段默认使用的档位，可用 MODEL_TIER_<阶段> 覆盖，如 MODEL_TIER_HTML_REVIEW=strong
+STAGE_TIERS = {
+    stage: os.environ.get(f"MODEL_TIER_{stage.upper()}", default)
+    for stage, default in (("plan", STRONG), ("html_generate", FAST), ("html_review", FAST))
+}
+# 阶段使用的执行器种类：规划 Agent 或 HTML Agent
+STAGE_KINDS = {"plan": "plan", "html_generate": "html", "html_review": "html"}
+# 超时后换用的档位
+TIER_FALLBACKS = {FAST: STRONG}
+
+# 侧边栏模型对应的轻量模型，FAST_MODEL_ID 未设置时使用；不在表中时与 strong 相同
+FAST_MODEL_DEFAULTS = {
+    "gpt-4o": "gpt-4o-mini",
+    "qwen3-coder-plus": "qwen3-coder-flash",
+}
+FAST_MODEL_ID = os.environ.get("FAST_MODEL_ID")
+FAST_MODEL_BASE_URL = os.environ.get("FAST_MODEL_BASE_URL")
+FAST_MODEL_API_KEY = os.environ.get("FAST_MODEL_API_KEY")
+
+# 一个阶段在各档位上的超时时间（秒）；strong 需要容纳整个规划预算
+STRONG_MODEL_TIMEOUT = float(os.environ.get("STRONG_MODEL_TIMEOUT", PLAN_DEADLINE + SYNTHESIS_RESERVE + 30))
+FAST_MODEL_TIMEOUT = float(os.environ.get("FAST_MODEL_TIMEOUT", "90"))
+# 同一模型地址上同时运行的阶段数上限（进程内所有会话共享）
+STRONG_MODEL_CONCURRENCY = int(os.environ.get("STRONG_MODEL_CONCURRENCY", "8"))
+FAST_MODEL_CONCURRENCY = int(os.environ.get("FAST_MODEL_CONCURRENCY", "16"))
+
+T = TypeVar("T")
+
+
+class ModelTier(NamedTuple):
+    name: str
+    model_id: str
+    base_url: Optional[str]
+    api_key: str
+    timeout: Optional[float]
+    max_concurrency: int
+    fallback: Optional[str] = None
+
+
+def build_tiers(model_id: str, base_url: Optional[str], api_key: str) -> Dict[str, ModelTier]:
+    """根据侧边栏的模型配置和环境变量生成全部档位"""
+    return {
+        STRONG: ModelTier(
+            STRONG, model_id, base_url, api_key,
+            STRONG_MODEL_TIMEOUT, STRONG_MODEL_CONCURRENCY, TIER_FALLBACKS.get(STRONG),
+        ),
+        FAST: ModelTier(
+            FAST,
+            FAST_MODEL_ID or FAST_MODEL_DEFAULTS.get(model_id, model_id),
+            FAST_MODEL_BASE_URL or base_url,
+            FAST_MODEL_API_KEY or api_key,
+            FAST_MODEL_TIMEOUT, FAST_MODEL_CONCURRENCY, TIER_FALLBACKS.get(FAST),
+        ),
+    }
+
+
+def required_executors(tiers: Dict[str, ModelTier], stage_tiers: Dict[str, str] = STAGE_TIERS) -> Set[Tuple[str, str]]:
+    """需要构建的 (档位, 执行器种类)，包括回退档位"""
+    required = set()
+    for stage, name in stage_tiers.items():
+        while name in tiers and (name, STAGE_KINDS[stage]) not in required:
+            required.add((name, STAGE_KINDS[stage]))
+            name = tiers[name].fallback
+    return required
+
+
+# ==================== 并发上限 ====================
+# 按模型地址共享，同一模型被多个会话、多个执行器组合使用时共用一个上限
+_limits: Dict[Tuple[str, Optional[str]], asyncio.Semaphore] = {}
+_limits_lock = threading.Lock()
+
+
+def _limit(tier: ModelTier) -> asyncio.Semaphore:
+    with _limits_lock:
+        key = (tier.model_id, tier.base_url)
+        if key not in _limits:
+            _limits[key] = asyncio.Semaphore(tier.max_concurrency)
+        return _limits[key]
+
+
+class StageRouter:
+    """
+    把流水线阶段路由到对应档位的执行器。
+
+    Args:
+        tiers: 档位名 → ModelTier
+        executors: (档位名, 执行器种类) → 执行器
+        stage_tiers: 阶段 → 档位名
+    """
+
+    def __init__(
+        self,
+        tiers: Dict[str, ModelTier],
+        executors: Dict[Tuple[str, str], Any],
+        stage_tiers: Dict[str, str] = STAGE_TIERS,
+    ):
+        self.tiers = tiers
+        self.executors = executors
+        self.stage_tiers = stage_tiers
+
+    def tier(self, stage: str) -> ModelTier:
+        return self.tiers[self.stage_tiers[stage]]
+
+    def executor(self, stage: str, tier: Optional[str] = None):
+        return self.executors[(tier or self.stage_tiers[stage], STAGE_KINDS[stage])]
+
+    async def run(
+        self,
+        stage: str,
+        call: Callable[[Any], Awaitable[T]],
+        on_fallback: Optional[Callable[[ModelTier, ModelTier], None]] = None,
+    ) -> T:
+        """
+        在阶段对应的档位上执行 `call(执行器)`。
+
+        等待并发名额的时间不计入超时；超时后换到回退档位重新执行，
+        没有回退档位时抛出 asyncio.TimeoutError。
+        """
+        tier, tried = self.tier(stage), set()
+        while True:
+            tried.add(tier.name)
+            try:
+                async with _limit(tier):
+                    return await asyncio.wait_for(call(self.executor(stage, tier.name)), timeout=tier.timeout)
+            except asyncio.TimeoutError:
+                fallback = self.tiers.get(tier.fallback)
+                if fallback is None or fallback.name in tried:
+                    raise
+                logger.warning("%s 在 %s 档位（%s）超时，改用 %s 档位", stage, tier.name, tier.model_id, fallback.name)
+                if on_fallback:
+                    on_fallback(tier, fallback)
+                tier = fallback
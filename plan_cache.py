@@ -0,0 +1,106 @@
+"""
+完整规划结果的内容寻址缓存。
+
+热门线路经常被用完全相同的表单内容反复请求，而 LLM 以 temperature=0 运行，
+同样的输入没必要再跑一遍几分钟的 Agent。这里以规范化后的表单内容（去空白、
+忽略大小写、旅行风格排序、日期按天）加上模型配置和 HTML 模式作为键，缓存
+行程 Markdown、最终 HTML 和 ICS 文件。
+
+缓存时间跟随交通数据的新鲜度：默认与航班查询结果的缓存时间一致，出发日期
+已过的规划不缓存。底层复用 tool_cache 的两级 TTL 缓存，使用单独的数据库文件。
+"""
+import os
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Optional, Union
+
+from tool_cache import TOOL_TTLS, TTLCache, make_key
+
+PLAN_CACHE_PATH = os.environ.get(
+    "PLAN_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "plan_cache.sqlite3"),
+)
+# 规划结果里包含车票和航班信息，缓存时间不超过交通数据本身的缓存时间
+PLAN_CACHE_TTL = float(os.environ.get("PLAN_CACHE_TTL", TOOL_TTLS["search_flights"]))
+
+
+def _as_date(value: Union[date, datetime, str]) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def plan_cache_key(
+    request: Dict[str, Any],
+    model_id: str,
+    base_url: Optional[str] = None,
+    html_mode: str = "",
+) -> str:
+    """
+    根据表单内容和模型配置生成缓存键。
+
+    Args:
+        request: 表单内容，包含 from_station / to_station / start_date / num_days /
+            travel_style / trip_pace / specific_requirements
+        model_id: 模型 ID
+        base_url: 模型 API 地址
+        html_mode: HTML 生成方式，不同方式的 HTML 结果不同
+    """
+    styles: Iterable[str] = request.get("travel_style") or []
+    params = {
+        "from_station": request["from_station"],
+        "to_station": request["to_station"],
+        "start_date": _as_date(request["start_date"]).isoformat(),
+        "num_days": int(request["num_days"]),
+        "travel_style": sorted({s.strip() for s in styles if s.strip()}),
+        "trip_pace": request.get("trip_pace") or "",
+        "specific_requirements": (request.get("specific_requirements") or "").strip(),
+        "model_id": model_id,
+        "base_url": base_url or "",
+        "html_mode": html_mode,
+    }
+    return make_key("plan", params)
+
+
+def plan_ttl(start_date: Union[date, datetime, str], ttl: float = PLAN_CACHE_TTL) -> float:
+    """出发日期已过的规划不缓存（返回 0）"""
+    return ttl if _as_date(start_date) >= date.today() else 0.0
+
+
+class PlanCache:
+    """行程、HTML 和 ICS 的整体缓存"""
+
+    def __init__(self, path: Optional[str] = PLAN_CACHE_PATH, ttl: float = PLAN_CACHE_TTL, max_memory_entries: int = 128):
+        self.ttl = ttl
+        self._cache = TTLCache(path, max_memory_entries=max_memory_entries)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """命中时返回 {"itinerary", "final_html", "ics"}，ics 为 bytes"""
+        value = self._cache.get("plan", key)
+        if value is None:
+            return None
+        return {**value, "ics": value["ics"].encode("utf-8")}
+
+    def put(self, key: str, artifacts: Dict[str, Any], start_date: Union[date, datetime, str]):
+        ttl = plan_ttl(start_date, self.ttl)
+        if ttl <= 0:
+            return
+        value = {
+            "itinerary": artifacts["itinerary"],
+            "final_html": artifacts["final_html"],
+            "ics": artifacts["ics"].decode("utf-8"),
+        }
+        self._cache.set("plan", key, value, ttl)
+
+    def invalidate(self, key: str):
+        self._cache.delete(key)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return self._cache.stats().get("plan", {"hits": 0, "disk_hits": 0, "misses": 0})
+
+
+plan_cache = PlanCache()
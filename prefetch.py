@@ -0,0 +1,132 @@
+"""
+Agent 循环之前的并行预查询。
+
+表单已经给出了出发地、目的地、出发日期和天数，系统提示词要求的往返车票、
+往返机票、行程期间的天气和目的地网络信息彼此独立，不需要等 LLM 一轮一轮地决定。
+这里把它们一次性并发查询（每个调用有独立的超时），结果拼进用户提示词，
+Agent 只需基于这些事实进行规划。
+"""
+import asyncio
+import json
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional, Union
+
+from langchain_core.tools import BaseTool
+
+logger = logging.getLogger(__name__)
+
+# 单个预查询调用的超时时间（秒）
+PREFETCH_TIMEOUT = 60.0
+
+DateLike = Union[date, datetime, str]
+
+
+def _as_date(value: DateLike) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def trip_dates(start_date: DateLike, num_days: int):
+    """返回 (出发日期, 返程日期) 字符串，返程为行程最后一天"""
+    start = _as_date(start_date)
+    back = start + timedelta(days=max(int(num_days), 1) - 1)
+    return start.strftime("%Y-%m-%d"), back.strftime("%Y-%m-%d")
+
+
+async def _call(tools: Dict[str, BaseTool], name: str, args: dict, timeout: float, callbacks=None) -> str:
+    tool = tools.get(name)
+    if tool is None:
+        return f"未提供工具 {name}，跳过。"
+    try:
+        result = await asyncio.wait_for(tool.ainvoke(args, config={"callbacks": callbacks}), timeout=timeout)
+    except asyncio.TimeoutError:
+        return f"查询超时（{timeout:.0f} 秒）。"
+    except Exception as e:
+        return f"查询出错: {e}"
+    return result if isinstance(result, str) else str(result)
+
+
+async def _train_tickets(tools, from_station, to_station, depart, back, timeout, callbacks=None) -> Dict[str, str]:
+    """先查一次车站编码，再并发查询往返车票"""
+    station_tool = "get-station-code-of-citys"
+    tickets_tool = "get-tickets"
+    if station_tool not in tools or tickets_tool not in tools:
+        return {}
+
+    raw = await _call(tools, station_tool, {"citys": f"{from_station}|{to_station}"}, timeout, callbacks)
+    try:
+        codes = json.loads(raw)
+        from_code = codes[from_station]["station_code"]
+        to_code = codes[to_station]["station_code"]
+    except (ValueError, KeyError, TypeError):
+        message = f"无法获取车站编码: {raw}"
+        return {"去程火车票": message, "返程火车票": message}
+
+    outbound, inbound = await asyncio.gather(
+        _call(tools, tickets_tool, {"date": depart, "fromStation": from_code, "toStation": to_code}, timeout, callbacks),
+        _call(tools, tickets_tool, {"date": back, "fromStation": to_code, "toStation": from_code}, timeout, callbacks),
+    )
+    return {"去程火车票": outbound, "返程火车票": inbound}
+
+
+async def prefetch_travel_facts(
+    tools: Iterable[BaseTool],
+    from_station: str,
+    to_station: str,
+    start_date: DateLike,
+    num_days: int,
+    timeout: float = PREFETCH_TIMEOUT,
+    callbacks=None,
+) -> Dict[str, str]:
+    """
+    并发查询往返车票、往返机票、目的地天气和网络信息。
+
+    Args:
+        tools: Agent 可用的工具列表（如 `agent_executor.tools`）
+        from_station: 出发地
+        to_station: 目的地
+        start_date: 出发日期
+        num_days: 旅行天数
+        timeout: 每个调用的超时时间（秒）
+        callbacks: 传给工具调用的 LangChain 回调（如 TraceRecorder）
+
+    Returns:
+        {信息名称: 查询结果} 的有序字典，单项失败不会影响其他项
+    """
+    tools_by_name = {t.name: t for t in tools}
+    depart, back = trip_dates(start_date, num_days)
+
+    lookups = {
+        "往返航班": (
+            "search_flights",
+            {"origin": from_station, "target": to_station, "depart": depart, "return_date": back},
+        ),
+        "目的地天气": ("search_weather", {"locations": [to_station], "start_date": depart, "num_days": num_days}),
+        "目的地景点与美食": ("search_web", {"query": f"{to_station} 必游景点 当地美食 交通"}),
+    }
+    labels = list(lookups)
+    results = await asyncio.gather(
+        _train_tickets(tools_by_name, from_station, to_station, depart, back, timeout, callbacks),
+        *(_call(tools_by_name, name, args, timeout, callbacks) for name, args in lookups.values()),
+    )
+
+    facts: Dict[str, str] = dict(results[0])
+    facts.update(zip(labels, results[1:]))
+    logger.info("预查询完成: %s", ", ".join(facts))
+    return facts
+
+
+def format_prefetched_facts(facts: Dict[str, str], num_days: Optional[int] = None) -> str:
+    """把预查询结果整理成附加在用户提示词后的文本"""
+    if not facts:
+        return ""
+    parts = ["\n\n【预查询信息】以下信息已由系统提前查询，请直接使用，不要重复调用相同的工具："]
+    if num_days:
+        parts.append(f"（天气已按 {num_days} 天行程的日期截取）")
+    for label, text in facts.items():
+        parts.append(f"\n### {label}\n{text}")
+    return "\n".join(parts)
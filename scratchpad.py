@@ -0,0 +1,232 @@
+"""
+规划 Agent 的有界 scratchpad。
+
+AgentExecutor 会把每次工具调用的原始结果都放进 `agent_scratchpad`，之后每一轮
+LLM 调用都要重新发送全部内容（网页摘要、地图列表、十天天气、航班、车票表……），
+单轮延迟随工具调用次数不断增长。这里给 scratchpad 设定 token 预算：超出时把
+较早的工具结果压缩成结构化摘要，最近几次结果保持原样，并在每一轮记录提示词大小。
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from langchain.agents.format_scratchpad.tools import format_to_tool_messages
+from langchain.agents.output_parsers.tools import ToolsAgentOutputParser
+from langchain_core.agents import AgentAction
+from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import RunnableBranch, RunnableConfig, RunnableLambda
+
+from agent_budget import force_synthesis_message, should_synthesize, within_deadline
+
+logger = logging.getLogger(__name__)
+
+# scratchpad 的默认 token 预算
+DEFAULT_CONTEXT_BUDGET = int(os.environ.get("AGENT_CONTEXT_BUDGET", "12000"))
+# 压缩摘要的缓存条目上限；执行器在进程内长期共享，缓存不能无限增长
+SUMMARY_MEMO_ENTRIES = 256
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count_tokens(text: str) -> int:
+        return len(_encoding.encode(text, disallowed_special=()))
+except Exception:  # 没有 tiktoken 或无法加载编码表时粗略估算
+    def count_tokens(text: str) -> int:
+        return max(1, len(text) // 2)
+
+
+def _message_text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, str):
+        text = content
+    else:
+        text = "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    for call in getattr(message, "tool_calls", None) or []:
+        text += f"{call.get('name', '')}{call.get('args', '')}"
+    return text
+
+
+def _split_tables(observation: str) -> List[list]:
+    """
+    按 tool_output.format_table 的格式拆分工具结果，返回 [标题, 表头, 数据行] 列表。
+
+    不含 `|` 的行是表格上方的说明行（或独立的提示），其后第一行 `|` 行是表头。
+    """
+    tables: List[list] = []
+    for line in observation.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if "|" not in line:
+            tables.append([line, None, []])
+        elif not tables:
+            tables.append([None, line, []])
+        elif tables[-1][1] is None:
+            tables[-1][1] = line
+        else:
+            tables[-1][2].append(line)
+    return tables
+
+
+def summarize_observation(tool_name: str, observation: str, max_records: int = 5, max_line: int = 80) -> str:
+    """
+    把一次工具结果压缩成结构化摘要。
+
+    搜索类工具返回 `|` 分隔的表格（每行一条记录）：保留说明行、表头和每张表的前
+    max_records 行。其他文本按空行拆成记录，每条只保留前两行。
+    """
+    tables = _split_tables(observation)
+    if any(header for _, header, _ in tables):
+        total = sum(len(rows) for _, _, rows in tables)
+        lines = [f"[已压缩 {tool_name} 结果：原 {len(observation)} 字，共 {total} 条]"]
+        for title, header, rows in tables:
+            lines += [text[:max_line] for text in (title, header) if text]
+            lines += [row[:max_line] for row in rows[:max_records]]
+            if len(rows) > max_records:
+                lines.append(f"……其余 {len(rows) - max_records} 条已省略")
+        return "\n".join(lines)
+
+    records = [r.strip() for r in observation.split("\n\n") if r.strip()]
+    if len(records) <= 1:
+        records = [line for line in observation.splitlines() if line.strip()]
+
+    lines = [f"[已压缩 {tool_name} 结果：原 {len(observation)} 字，共 {len(records)} 条]"]
+    for record in records[:max_records]:
+        head = [line.strip()[:max_line] for line in record.splitlines()[:2] if line.strip()]
+        lines.append("- " + " | ".join(head))
+    if len(records) > max_records:
+        lines.append(f"- ……其余 {len(records) - max_records} 条已省略")
+    return "\n".join(lines)
+
+
+class ScratchpadStats(NamedTuple):
+    """一轮 LLM 调用的提示词统计，随每次调用返回，不保存在共享的格式化器上"""
+    scratchpad_tokens: int
+    compacted: int
+    prompt_tokens: int = 0
+
+
+class BoundedScratchpad:
+    """
+    带 token 预算的 scratchpad 格式化器。
+
+    执行器池中的同一个实例会被并发的多个规划共用，因此每轮的统计随调用返回，
+    实例上只保存有上限的摘要缓存。
+
+    Args:
+        budget: scratchpad 允许的最大 token 数
+        keep_recent: 始终保持原样的最近工具结果数量
+        summarize: 压缩函数 (tool_name, observation) -> 摘要
+    """
+
+    def __init__(
+        self,
+        budget: int = DEFAULT_CONTEXT_BUDGET,
+        keep_recent: int = 2,
+        summarize: Callable[[str, str], str] = summarize_observation,
+    ):
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.summarize = summarize
+        self._summaries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _summary(self, action: AgentAction, observation: str) -> Tuple[str, int]:
+        key = hashlib.sha1(f"{action.tool}\0{observation}".encode("utf-8")).hexdigest()
+        with self._lock:
+            if key in self._summaries:
+                self._summaries.move_to_end(key)
+                return self._summaries[key]
+        summary = self.summarize(action.tool, observation)
+        entry = (summary, count_tokens(summary))
+        with self._lock:
+            self._summaries[key] = entry
+            while len(self._summaries) > SUMMARY_MEMO_ENTRIES:
+                self._summaries.popitem(last=False)
+        return entry
+
+    def format(self, intermediate_steps: Sequence[Tuple[AgentAction, str]]) -> List[BaseMessage]:
+        """与 `format_to_tool_messages` 相同的输出，但超预算时压缩较早的工具结果"""
+        return self.compact(intermediate_steps)[0]
+
+    def compact(self, intermediate_steps: Sequence[Tuple[AgentAction, str]]) -> Tuple[List[BaseMessage], ScratchpadStats]:
+        """格式化 scratchpad，同时返回本次的 token 统计"""
+        steps = [(action, obs if isinstance(obs, str) else str(obs)) for action, obs in intermediate_steps]
+        sizes = [count_tokens(obs) for _, obs in steps]
+        total = sum(sizes)
+
+        compacted = 0
+        compactable = max(0, len(steps) - self.keep_recent)
+        for i in range(compactable):
+            if total <= self.budget:
+                break
+            action, obs = steps[i]
+            summary, summary_tokens = self._summary(action, obs)
+            if summary_tokens < sizes[i]:
+                steps[i] = (action, summary)
+                total -= sizes[i] - summary_tokens
+                sizes[i] = summary_tokens
+                compacted += 1
+
+        messages = format_to_tool_messages(steps)
+        scratchpad_tokens = sum(count_tokens(_message_text(m)) for m in messages)
+        return messages, ScratchpadStats(scratchpad_tokens, compacted)
+
+    def render(
+        self,
+        prompt,
+        inputs: Dict[str, Any],
+        extra: Sequence[BaseMessage] = (),
+        config: Optional[RunnableConfig] = None,
+    ) -> Tuple[PromptValue, ScratchpadStats]:
+        """
+        用压缩后的 scratchpad（末尾追加 extra）填充提示词模板，并记录本轮提示词大小。
+        """
+        messages, stats = self.compact(inputs["intermediate_steps"])
+        prompt_value = prompt.invoke({**inputs, "agent_scratchpad": messages + list(extra)}, config)
+        stats = stats._replace(prompt_tokens=sum(count_tokens(_message_text(m)) for m in prompt_value.to_messages()))
+        logger.info(
+            "Agent 本轮提示词 %d tokens（scratchpad %d / 预算 %d，已压缩 %d 条工具结果）",
+            stats.prompt_tokens, stats.scratchpad_tokens, self.budget, stats.compacted,
+        )
+        return prompt_value, stats
+
+
+def create_bounded_tool_calling_agent(llm, tools, prompt, scratchpad: Optional[BoundedScratchpad] = None):
+    """
+    与 `create_tool_calling_agent` 结构相同的 Agent，但 scratchpad 受 token 预算约束。
+
+    当前规划的执行预算（agent_budget）用完后，下一轮 LLM 调用禁止使用工具，
+    并在 scratchpad 末尾追加通知，要求基于已有信息直接输出最终答案；
+    这一轮调用本身也受预算截止时间约束。
+    """
+    scratchpad = scratchpad or BoundedScratchpad()
+    llm_with_tools = llm.bind_tools(tools)
+    llm_without_tools = llm.bind_tools(tools, tool_choice="none")
+
+    def _plan_prompt(x, config: RunnableConfig) -> PromptValue:
+        return scratchpad.render(prompt, x, config=config)[0]
+
+    def _final_prompt(x, config: RunnableConfig) -> PromptValue:
+        extra = [HumanMessage(content=force_synthesis_message())]
+        return scratchpad.render(prompt, x, extra, config)[0]
+
+    def _synthesize(prompt_value: PromptValue, config: RunnableConfig):
+        return llm_without_tools.invoke(prompt_value, config)
+
+    async def _asynthesize(prompt_value: PromptValue, config: RunnableConfig):
+        return await within_deadline(llm_without_tools.ainvoke(prompt_value, config))
+
+    plan = RunnableLambda(_plan_prompt) | llm_with_tools | ToolsAgentOutputParser()
+    synthesize = (
+        RunnableLambda(_final_prompt)
+        | RunnableLambda(_synthesize, afunc=_asynthesize)
+        | ToolsAgentOutputParser()
+    )
+    return RunnableBranch((should_synthesize, synthesize), plan)
@@ -0,0 +1,125 @@
+"""
+表单填写过程中的推测性预查询。
+
+出发地、目的地、出发日期和天数通常比旅行风格、具体要求早得多确定。这几项
+填好后就在进程级事件循环上启动预查询（往返车票、往返机票、行程天气、目的地
+网页信息），同时预热目的地常用的地图搜索；用户点击提交时，规划任务直接接过
+这个进行中或已完成的结果，不再重新查询。
+
+- 输入变化时取消上一次推测，只保留与当前输入一致的一份；
+- 每个会话的推测次数有上限，反复修改输入不会无限消耗 API 额度；
+- 工具结果同时写入 tool_cache，即使推测结果没有被接管也不浪费。
+"""
+import asyncio
+import concurrent.futures
+import logging
+import os
+from datetime import date
+from typing import Dict, Iterable, Optional, Tuple
+
+from langchain_core.tools import BaseTool
+
+from async_runtime import get_runtime
+from prefetch import DateLike, _as_date, prefetch_travel_facts
+
+logger = logging.getLogger(__name__)
+
+# 每个会话最多启动的推测次数
+MAX_SPECULATIONS = int(os.environ.get("SPECULATIVE_PREFETCH_LIMIT", "3"))
+# 预热的目的地地图搜索（与规划 Agent 常用的查询一致）
+WARM_PLACE_QUERIES = ("酒店", "餐厅", "景点")
+
+SpeculationKey = Tuple[str, str, date, int]
+
+
+async def _warm_places(tools: Dict[str, BaseTool], to_station: str):
+    tool = tools.get("search_google_maps_batch")
+    if tool is None:
+        return
+    queries = [f"{to_station} {q}" for q in WARM_PLACE_QUERIES]
+    try:
+        await tool.ainvoke({"queries": queries, "location": to_station})
+    except Exception as e:
+        logger.info("预热地图搜索失败: %r", e)
+
+
+async def speculate(
+    tools: Iterable[BaseTool],
+    from_station: str,
+    to_station: str,
+    start_date: DateLike,
+    num_days: int,
+) -> Dict[str, str]:
+    """预查询规划所需的事实，同时预热目的地地图搜索，返回 prefetch_travel_facts 的结果"""
+    tools = list(tools)
+    facts, _ = await asyncio.gather(
+        prefetch_travel_facts(tools, from_station, to_station, start_date, num_days),
+        _warm_places({t.name: t for t in tools}, to_station),
+    )
+    return facts
+
+
+class SpeculativePrefetch:
+    """
+    一个会话的推测性预查询状态，保存在 st.session_state 中。
+
+    Args:
+        max_runs: 本会话最多启动的推测次数
+    """
+
+    def __init__(self, max_runs: int = MAX_SPECULATIONS):
+        self.max_runs = max_runs
+        self.runs = 0
+        self.key: Optional[SpeculationKey] = None
+        self.future: Optional[concurrent.futures.Future] = None
+        # 已交给规划任务的输入，提交后的重跑不再为它重复推测
+        self.taken: Optional[SpeculationKey] = None
+
+    @staticmethod
+    def make_key(from_station: str, to_station: str, start_date: DateLike, num_days: int) -> Optional[SpeculationKey]:
+        """输入不完整时返回 None"""
+        from_station, to_station = (from_station or "").strip(), (to_station or "").strip()
+        if not from_station or not to_station or not start_date or not num_days:
+            return None
+        return from_station, to_station, _as_date(start_date), int(num_days)
+
+    def cancel(self):
+        if self.future is not None and not self.future.done():
+            self.future.cancel()
+        self.key, self.future = None, None
+
+    def update(
+        self,
+        tools: Iterable[BaseTool],
+        from_station: str,
+        to_station: str,
+        start_date: DateLike,
+        num_days: int,
+    ) -> bool:
+        """
+        根据当前输入启动、保留或取消推测，返回当前输入是否有对应的推测。
+        """
+        key = self.make_key(from_station, to_station, start_date, num_days)
+        if key is not None and key == self.key:
+            return True
+
+        self.cancel()
+        if key is None or key == self.taken or self.runs >= self.max_runs:
+            return False
+
+        self.key = key
+        self.future = get_runtime().submit(speculate(tools, *key))
+        self.runs += 1
+        logger.info("启动推测性预查询（第 %d/%d 次）: %s → %s", self.runs, self.max_runs, key[0], key[1])
+        return True
+
+    def take(
+        self, from_station: str, to_station: str, start_date: DateLike, num_days: int
+    ) -> Optional[concurrent.futures.Future]:
+        """提交时取走与输入一致的推测结果（Future），之后由规划任务负责等待"""
+        key = self.make_key(from_station, to_station, start_date, num_days)
+        if key is None or key != self.key or self.future is None or self.future.cancelled():
+            return None
+        future, self.key, self.future = self.future, None, None
+        self.taken = key
+        return future
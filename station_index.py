@@ -0,0 +1,334 @@
+"""
+本地 12306 车站编码索引。
+
+车站编码表几乎不变，没必要每次查票前都调用一次 `get-station-code-of-citys`。
+本模块把城市名、站名、全拼和简拼映射到车站编码，加载一次后在进程内用
+有序数组 + 二分查找解析；遇到索引里没有的城市才回退到 MCP 服务，并把
+返回结果并入索引，下次直接命中。
+
+- 磁盘上还没有索引时，首次加载在后台线程从 12306 下载完整车站表构建一次；
+- 学习到的新车站先在内存中生效，合并后延迟写盘，不在请求路径上重写整个文件。
+
+索引也可以从 12306 的 `station_name.js` 手动全量构建：
+    python station_index.py [station_name.js 路径]
+"""
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+import uuid
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from langchain_core.tools import BaseTool, StructuredTool
+
+STATION_INDEX_PATH = os.environ.get(
+    "STATION_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "station_index.tsv"),
+)
+STATION_NAMES_URL = "https://kyfw.12306.cn/otn/resources/js/framework/station_name.js"
+# 没有索引文件时是否在后台下载完整车站表（离线环境可设为 0）
+STATION_INDEX_BOOTSTRAP = os.environ.get("STATION_INDEX_BOOTSTRAP", "1") != "0"
+# 学习到新车站后延迟写盘的时间（秒），期间的多次更新合并为一次写入
+STATION_INDEX_SAVE_DELAY = float(os.environ.get("STATION_INDEX_SAVE_DELAY", "5"))
+
+logger = logging.getLogger(__name__)
+
+# 常见的口语别名
+ALIASES = {
+    "帝都": "北京",
+    "魔都": "上海",
+    "羊城": "广州",
+    "鹏城": "深圳",
+    "蓉城": "成都",
+    "山城": "重庆",
+    "春城": "昆明",
+    "泉城": "济南",
+}
+
+
+class Station(NamedTuple):
+    name: str
+    code: str
+    pinyin: str = ""
+    abbr: str = ""
+    city: str = ""
+
+
+def _normalize(name: str) -> str:
+    key = "".join(name.split()).casefold()
+    key = ALIASES.get(key, key)
+    for suffix in ("火车站", "站", "市"):
+        if len(key) > len(suffix) + 1 and key.endswith(suffix):
+            key = key[: -len(suffix)]
+            break
+    return key
+
+
+class StationIndex:
+    """有序键数组 + 下标数组，构建后只读"""
+
+    def __init__(self, stations: Iterable[Station] = ()):
+        self.stations: List[Station] = []
+        seen: Dict[str, int] = {}
+        for station in stations:
+            if station.code in seen:
+                self.stations[seen[station.code]] = station
+            else:
+                seen[station.code] = len(self.stations)
+                self.stations.append(station)
+
+        entries: Dict[str, int] = {}
+        # 城市键优先指向与城市同名的主站，其次是该城市的第一个车站
+        for i, s in enumerate(self.stations):
+            if s.city:
+                city_key = "c:" + _normalize(s.city)
+                if city_key not in entries or s.name == s.city:
+                    entries[city_key] = i
+        for i, s in enumerate(self.stations):
+            for key in (s.name, s.pinyin, s.abbr):
+                if key:
+                    entries.setdefault("s:" + _normalize(key), i)
+
+        ordered = sorted(entries.items())
+        self._keys = [k for k, _ in ordered]
+        self._positions = array("I", (i for _, i in ordered))
+
+    def __len__(self):
+        return len(self.stations)
+
+    def _find(self, key: str) -> Optional[Station]:
+        pos = bisect_left(self._keys, key)
+        if pos < len(self._keys) and self._keys[pos] == key:
+            return self.stations[self._positions[pos]]
+        return None
+
+    def resolve(self, name: str) -> Optional[Station]:
+        """按城市名、站名、全拼或简拼解析车站，找不到返回 None"""
+        key = _normalize(name)
+        return self._find("c:" + key) or self._find("s:" + key)
+
+    def station_code(self, name: str) -> Optional[str]:
+        station = self.resolve(name)
+        return station.code if station else None
+
+    def resolve_cities(self, cities: Iterable[str]) -> Tuple[Dict[str, dict], List[str]]:
+        """
+        按 `get-station-code-of-citys` 的返回格式解析多个城市。
+
+        Returns:
+            (已解析的 {城市: {"station_code", "station_name"}}, 未命中的城市列表)
+        """
+        found, missing = {}, []
+        for city in cities:
+            station = self.resolve(city)
+            if station is None:
+                missing.append(city)
+            else:
+                found[city] = {"station_code": station.code, "station_name": station.name}
+        return found, missing
+
+    # ---------- 持久化 ----------
+    def save(self, path: str = STATION_INDEX_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for s in self.stations:
+                f.write("\t".join(s) + "\n")
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = STATION_INDEX_PATH) -> "StationIndex":
+        if not os.path.exists(path):
+            return cls()
+        with open(path, encoding="utf-8") as f:
+            return cls(Station(*line.rstrip("\n").split("\t")) for line in f if line.strip())
+
+
+# ==================== 数据来源解析 ====================
+def parse_station_names_js(text: str) -> List[Station]:
+    """解析 12306 `station_name.js`：@bjb|北京北|VAP|beijingbei|bjb|0|0357|北京|..."""
+    stations = []
+    body = text.split("'")[1] if "'" in text else text
+    for chunk in body.split("@"):
+        fields = chunk.split("|")
+        if len(fields) < 5 or not fields[2]:
+            continue
+        city = fields[7] if len(fields) > 7 else ""
+        stations.append(Station(fields[1], fields[2], fields[3], fields[4], city))
+    return stations
+
+
+def stations_from_city_codes(payload: dict) -> List[Station]:
+    """把 `get-station-code-of-citys` 的返回结果转换成车站记录"""
+    stations = []
+    for city, info in payload.items():
+        if isinstance(info, dict) and info.get("station_code"):
+            stations.append(Station(info.get("station_name") or city, info["station_code"], city=city))
+    return stations
+
+
+# ==================== 进程级索引 ====================
+_index: Optional[StationIndex] = None
+_index_lock = threading.Lock()
+_save_timer: Optional[threading.Timer] = None
+_save_lock = threading.Lock()
+
+
+def _bootstrap():
+    try:
+        # 与下载期间学习到的车站合并，而不是整体替换
+        index = update_station_index(fetch_station_names(), persist=True)
+        logger.info("车站索引已从 12306 构建: %d 个车站", len(index))
+    except Exception as e:
+        logger.warning("下载 12306 车站表失败，继续按需学习车站编码: %r", e)
+
+
+def get_station_index() -> StationIndex:
+    """加载（仅首次）并返回进程内共享的车站索引"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = StationIndex.load()
+                if not len(_index) and STATION_INDEX_BOOTSTRAP:
+                    threading.Thread(target=_bootstrap, name="station-index-bootstrap", daemon=True).start()
+    return _index
+
+
+def flush_station_index(force: bool = False):
+    """把尚未落盘的更新立即写回磁盘；force=True 时无论是否有待写入都写一次"""
+    global _save_timer
+    with _index_lock:
+        pending = _save_timer is not None
+        if pending:
+            _save_timer.cancel()
+            _save_timer = None
+        index = _index
+    if (pending or force) and index is not None:
+        with _save_lock:
+            index.save()
+
+
+def _schedule_save():
+    """在持有锁时调用：延迟写盘，已有待执行的写入时不重复安排"""
+    global _save_timer
+    if _save_timer is None:
+        _save_timer = threading.Timer(STATION_INDEX_SAVE_DELAY, flush_station_index)
+        _save_timer.daemon = True
+        _save_timer.start()
+
+
+def update_station_index(stations: Iterable[Station], replace: bool = False, persist: bool = False) -> StationIndex:
+    """
+    合并（或替换）车站记录并替换进程内索引。
+
+    默认延迟写盘，短时间内的多次更新只写一次；persist=True 时立即写入。
+    """
+    global _index
+    stations = list(stations)
+    with _index_lock:
+        base = [] if replace or _index is None else _index.stations
+        index = StationIndex([*base, *stations])
+        _index = index
+        _schedule_save()
+    if persist:
+        flush_station_index()
+    return index
+
+
+# 进程退出前写入尚未落盘的更新
+atexit.register(flush_station_index)
+
+
+def fetch_station_names(url: str = STATION_NAMES_URL) -> List[Station]:
+    """下载并解析 12306 的完整车站表"""
+    from http_clients import HTTP_TIMEOUT, get_http_session
+
+    response = get_http_session().get(url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    return parse_station_names_js(response.text)
+
+
+def refresh_from_url(url: str = STATION_NAMES_URL) -> StationIndex:
+    """从 12306 下载完整车站表并重建索引"""
+    return update_station_index(fetch_station_names(url), replace=True, persist=True)
+
+
+def mcp_text(content) -> str:
+    """MCP 工具结果的文本：content 可能是字符串，也可能是内容块（字符串或 {"type": "text", ...}）列表"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, (list, tuple)):
+        return "".join(
+            block if isinstance(block, str)
+            else block.get("text", "") if isinstance(block, dict)
+            else getattr(block, "text", "")
+            for block in content
+        )
+    return str(content)
+
+
+async def _call_station_tool(station_tool: BaseTool, citys: str) -> Tuple[str, object]:
+    """调用 MCP 的车站编码工具，返回 (文本, artifact)；工具不带 artifact 时 artifact 为 None"""
+    if station_tool.response_format == "content_and_artifact":
+        # 以 ToolCall 调用才能拿到 artifact，直接传参数时只返回 content
+        message = await station_tool.ainvoke(
+            {"name": station_tool.name, "args": {"citys": citys}, "id": f"station-{uuid.uuid4().hex[:8]}", "type": "tool_call"}
+        )
+        return mcp_text(message.content), message.artifact
+    return mcp_text(await station_tool.ainvoke({"citys": citys})), None
+
+
+async def refresh_from_mcp(station_tool: BaseTool, cities: Iterable[str]) -> StationIndex:
+    """调用 MCP 的 `get-station-code-of-citys` 查询指定城市，并把结果并入索引"""
+    text, _ = await _call_station_tool(station_tool, "|".join(cities))
+    return update_station_index(stations_from_city_codes(json.loads(text)))
+
+
+def local_station_code_tool(station_tool: BaseTool) -> BaseTool:
+    """
+    用本地索引包装 MCP 的 `get-station-code-of-citys` 工具。
+
+    工具名、参数和返回形式（response_format）不变，全部命中时不发起 RPC；只有未命中的
+    城市才转发给 MCP 服务，并把结果学习进索引。
+    """
+    async def _lookup(citys: str) -> Tuple[str, object]:
+        cities = [c for c in citys.split("|") if c.strip()]
+        found, missing = get_station_index().resolve_cities(cities)
+        if not missing:
+            return json.dumps(found, ensure_ascii=False), None
+        text, artifact = await _call_station_tool(station_tool, "|".join(missing))
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            # 服务返回的是错误提示，原样交给 Agent
+            return (text if not found else json.dumps(found, ensure_ascii=False) + "\n" + text), artifact
+        update_station_index(stations_from_city_codes(payload))
+        found.update(payload)
+        return json.dumps(found, ensure_ascii=False), artifact
+
+    async def _resolve(citys: str):
+        content, artifact = await _lookup(citys)
+        return (content, artifact) if station_tool.response_format == "content_and_artifact" else content
+
+    return StructuredTool(
+        name=station_tool.name,
+        description=station_tool.description,
+        args_schema=station_tool.args_schema,
+        coroutine=_resolve,
+        response_format=station_tool.response_format,
+        metadata=station_tool.metadata,
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            index = update_station_index(parse_station_names_js(f.read()), replace=True, persist=True)
+    else:
+        index = refresh_from_url()
+    print(f"车站索引已更新: {len(index)} 个车站 -> {STATION_INDEX_PATH}")
@@ -0,0 +1,131 @@
+"""
+Agent 规划过程的流式输出。
+
+`consume_agent_events` 只依赖 `astream_events(version="v2")` 产生的事件字典，
+不关心事件来自真实的 AgentExecutor 还是测试里构造的列表，因此可以离线测试、
+压测首个内容出现的时间。工具调用进度先于最终答案的 token 回调给界面。
+"""
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, List, Optional
+
+# 事件名称中文标签，只用于界面展示
+TOOL_LABELS = {
+    "search_web": "网络搜索",
+    "search_google_maps": "地图搜索",
+    "search_google_maps_batch": "地图批量搜索",
+    "search_weather": "天气查询",
+    "search_flights": "航班查询",
+    "get-tickets": "火车票查询",
+    "get-station-code-of-citys": "车站编码查询",
+}
+
+
+@dataclass
+class ToolEvent:
+    name: str
+    status: str  # "start" | "end"
+    run_id: str
+    detail: str = ""
+    elapsed: float = 0.0
+
+    @property
+    def label(self) -> str:
+        return TOOL_LABELS.get(self.name, self.name)
+
+
+@dataclass
+class StreamState:
+    """一次规划的流式状态，同时记录首个事件和首个 token 的时间"""
+    started_at: float = field(default_factory=time.perf_counter)
+    text: str = ""
+    tool_events: List[ToolEvent] = field(default_factory=list)
+    first_event_at: Optional[float] = None
+    first_token_at: Optional[float] = None
+    output: Optional[str] = None
+
+    def _mark_event(self):
+        if self.first_event_at is None:
+            self.first_event_at = time.perf_counter() - self.started_at
+
+
+async def consume_agent_events(
+    events: AsyncIterator[dict],
+    on_tool: Optional[Callable[[ToolEvent], None]] = None,
+    on_token: Optional[Callable[[str], None]] = None,
+    min_interval: float = 0.05,
+    state: Optional[StreamState] = None,
+) -> StreamState:
+    """
+    消费 Agent 事件流。
+
+    Args:
+        events: `agent_executor.astream_events(..., version="v2")` 的事件流
+        on_tool: 工具开始/结束时回调
+        on_token: 最终答案文本增长时回调，参数为当前完整文本（按 min_interval 节流）
+        min_interval: token 回调的最小间隔（秒）
+        state: 可选的外部状态对象
+
+    Returns:
+        StreamState，其中 output 为最终行程文本
+    """
+    state = state or StreamState()
+    tool_started = {}
+    turn_text = ""
+    turn_has_tool_calls = False
+    last_emit = 0.0
+
+    async for event in events:
+        kind = event.get("event")
+        if kind == "on_chat_model_start":
+            # 新一轮 LLM 输出：上一轮如果是工具调用轮，其文本不属于最终答案
+            turn_text, turn_has_tool_calls = "", False
+
+        elif kind == "on_chat_model_stream":
+            chunk = event.get("data", {}).get("chunk")
+            if getattr(chunk, "tool_call_chunks", None):
+                turn_has_tool_calls = True
+            content = getattr(chunk, "content", "")
+            if isinstance(content, str) and content and not turn_has_tool_calls:
+                turn_text += content
+                state.text = turn_text
+                if state.first_token_at is None:
+                    state._mark_event()
+                    state.first_token_at = time.perf_counter() - state.started_at
+                now = time.perf_counter()
+                if on_token and now - last_emit >= min_interval:
+                    last_emit = now
+                    on_token(state.text)
+
+        elif kind in ("on_tool_start", "on_tool_end"):
+            state._mark_event()
+            run_id = str(event.get("run_id", ""))
+            if kind == "on_tool_start":
+                tool_started[run_id] = time.perf_counter()
+                detail = str(event.get("data", {}).get("input", ""))
+                tool_event = ToolEvent(event.get("name", ""), "start", run_id, detail)
+            else:
+                elapsed = time.perf_counter() - tool_started.pop(run_id, time.perf_counter())
+                tool_event = ToolEvent(event.get("name", ""), "end", run_id, elapsed=elapsed)
+            state.tool_events.append(tool_event)
+            if on_tool:
+                on_tool(tool_event)
+
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            # 最外层 AgentExecutor 结束，取其最终输出
+            output = event.get("data", {}).get("output")
+            if isinstance(output, dict) and "output" in output:
+                state.output = output["output"]
+
+    if state.output is None:
+        state.output = state.text
+    state.text = state.output
+    if on_token:
+        on_token(state.text)
+    return state
+
+
+async def stream_itinerary(agent_executor, prompt: str, on_tool=None, on_token=None, callbacks=None) -> StreamState:
+    """以流式方式运行规划 Agent"""
+    events = agent_executor.astream_events({"input": prompt}, config={"callbacks": callbacks}, version="v2")
+    return await consume_agent_events(events, on_tool=on_tool, on_token=on_token)
@@ -0,0 +1,48 @@
+from scratchpad import summarize_observation
+from tool_output import Column, field, format_table
+from tools_update1 import PLACE_COLUMNS, _format_places_batch
+
+COLUMNS = (Column("名称", field("name")), Column("评分", field("rating")), Column("地址", field("address")))
+
+
+def _records(count):
+    return [{"name": f"地点{i}", "rating": 4.5, "address": f"某路 {i} 号"} for i in range(count)]
+
+
+def test_keeps_title_header_and_first_rows():
+    table = format_table(COLUMNS, _records(8), title="东京（按评分排序）")
+    summary = summarize_observation("search_google_maps", table, max_records=3).splitlines()
+
+    assert summary[0] == f"[已压缩 search_google_maps 结果：原 {len(table)} 字，共 8 条]"
+    assert summary[1:6] == table.splitlines()[:5]
+    assert summary[6] == "……其余 5 条已省略"
+
+
+def test_short_table_is_kept_whole():
+    table = format_table(COLUMNS, _records(2))
+    summary = summarize_observation("search_google_maps", table).splitlines()
+
+    assert summary[1:] == table.splitlines()
+    assert "共 2 条" in summary[0]
+
+
+def test_batch_table_with_trailing_note():
+    grouped = {
+        "hotel": [{"title": f"酒店{i}", "rating": 4.2, "address": "新宿"} for i in range(6)],
+        "ramen": [],
+    }
+    output = _format_places_batch(["hotel", "ramen"], grouped)
+    summary = summarize_observation("search_google_maps_batch", output, max_records=2).splitlines()
+
+    lines = output.splitlines()
+    assert summary[1:4] == lines[:3]
+    assert summary[4] == "……其余 4 条已省略"
+    assert summary[5] == lines[-1]
+    assert lines[0].split("|")[1] == PLACE_COLUMNS[0].header
+
+
+def test_plain_text_falls_back_to_records():
+    text = "第一条\n详情一\n\n第二条\n详情二"
+    summary = summarize_observation("get-tickets", text).splitlines()
+
+    assert summary[1:] == ["- 第一条 | 详情一", "- 第二条 | 详情二"]
@@ -1,6 +1,7 @@
 # test_train_tickets.py
 # test_train_tickets.py
 import requests
+from station_index import get_station_index, update_station_index, stations_from_city_codes
 
 def search_train_tickets(from_city: str, to_city: str, date: str) -> str:
     url = "http://127.0.0.1:8080/mcp"  # MCP 服务地址
@@ -9,21 +10,26 @@ def search_train_tickets(from_city: str, to_city: str, date: str) -> str:
         "Accept": "application/json,text/event-stream"
     }
 
-    # 1. 获取车站编码
-    payload_station = {
-        "jsonrpc": "2.0",
-        "id": 1,
-        "method": "get-station-code-of-citys",
-        "params": {"cities": f"{from_city}|{to_city}"}
-    }
-    res_station = requests.post(url, json=payload_station, headers=headers, timeout=10).json()
-    print("车站编码返回:", res_station)
+    # 1. 获取车站编码：优先查本地索引，未命中时才请求 MCP 服务并记入索引
+    found, missing = get_station_index().resolve_cities([from_city, to_city])
+    if missing:
+        payload_station = {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "get-station-code-of-citys",
+            "params": {"citys": "|".join(missing)}
+        }
+        res_station = requests.post(url, json=payload_station, headers=headers, timeout=10).json()
+        print("车站编码返回:", res_station)
+
+        if "error" in res_station:
+            return f"获取车站编码失败: {res_station['error']}"
 
-    if "error" in res_station:
-        return f"获取车站编码失败: {res_station['error']}"
+        update_station_index(stations_from_city_codes(res_station["result"]))
+        found.update(res_station["result"])
 
-    from_code = res_station["result"].get(from_city, {}).get("station_code")
-    to_code = res_station["result"].get(to_city, {}).get("station_code")
+    from_code = found.get(from_city, {}).get("station_code")
+    to_code = found.get(to_city, {}).get("station_code")
 
     if not from_code or not to_code:
         return f"无法找到 {from_city} 或 {to_city} 的车站编码"
@@ -0,0 +1,319 @@
+"""
+SerpAPI / Apify 工具结果的持久化 TTL 缓存。
+
+两级结构：进程内 LRU（热点命中零 I/O）+ 磁盘 SQLite（进程重启后依然有效）。
+缓存键由工具名和规范化后的参数组成（去首尾空白、合并空格、忽略大小写），
+不同工具使用不同的过期时间：航班和天气变化快，景点和网页摘要可以缓存更久。
+
+写入、删除和清空只更新内存并排入队列，由后台线程批量写入磁盘（write-behind），
+调用方（常常是事件循环）不会等待 SQLite 提交；尚未落盘的改动在读取时优先生效。
+"""
+import asyncio
+import atexit
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "TOOL_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "tool_cache.sqlite3"),
+)
+
+# 各工具的缓存时间（秒）
+TOOL_TTLS = {
+    "search_flights": 30 * 60,
+    "search_weather": 60 * 60,
+    "search_google_maps": 7 * 24 * 3600,
+    "search_web": 24 * 3600,
+}
+
+# 缓存值的格式版本，格式变化时递增，旧条目随之失效
+CACHE_SCHEMA = 2
+
+logger = logging.getLogger(__name__)
+
+# 当前工具调用的缓存命中记录（"hits" / "disk_hits" / "misses"），由 tracing 设置和读取
+cache_events: ContextVar[Optional[list]] = ContextVar("cache_events", default=None)
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in sorted(value.items())}
+    return value
+
+
+def make_key(tool_name: str, params: Dict[str, Any]) -> str:
+    """根据工具名和规范化后的参数生成缓存键"""
+    payload = json.dumps([CACHE_SCHEMA, tool_name, _normalize(params)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    """内存 LRU + SQLite 的两级 TTL 缓存，线程安全"""
+
+    def __init__(self, path: Optional[str] = DEFAULT_CACHE_PATH, max_memory_entries: int = 1024):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._stats: Dict[str, Dict[str, int]] = {}
+        # 等待写入磁盘的改动：键 → (tool, value, expires_at)，None 表示删除；
+        # _flushing 是后台线程正在写入的一批，写完前读取同样以它为准
+        self._pending: Dict[str, Optional[tuple]] = {}
+        self._pending_clear = False
+        self._flushing: Dict[str, Optional[tuple]] = {}
+        self._flushing_clear = False
+        self._changed = threading.Condition(self._lock)
+        self._writer: Optional[threading.Thread] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL 模式下后台线程写入时不阻塞读取
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, tool TEXT, value TEXT, expires_at REAL)"
+        )
+        conn.commit()
+        return conn
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if self._conn is None and self.path:
+            self._conn = self._connect()
+        return self._conn
+
+    # ---------- 后台写入 ----------
+    def _persist(self, key: Optional[str], entry: Optional[tuple] = None):
+        """把一次改动排入写入队列；key 为 None 表示清空（调用方持有锁）"""
+        if not self.path:
+            return
+        if key is None:
+            self._pending.clear()
+            self._pending_clear = True
+        else:
+            self._pending[key] = entry
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name="tool-cache-writer", daemon=True)
+            self._writer.start()
+            atexit.register(self.flush)
+        self._changed.notify_all()
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            with self._lock:
+                while not self._pending and not self._pending_clear:
+                    self._changed.wait()
+                batch, clear = self._pending, self._pending_clear
+                self._pending, self._pending_clear = {}, False
+                self._flushing, self._flushing_clear = batch, clear
+            try:
+                with conn:
+                    if clear:
+                        conn.execute("DELETE FROM cache")
+                    for key, entry in batch.items():
+                        if entry is None:
+                            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                        else:
+                            tool, value, expires_at = entry
+                            conn.execute(
+                                "INSERT OR REPLACE INTO cache (key, tool, value, expires_at) VALUES (?, ?, ?, ?)",
+                                (key, tool, json.dumps(value, ensure_ascii=False), expires_at),
+                            )
+            except Exception as e:
+                logger.warning("写入缓存 %s 失败: %r", self.path, e)
+            with self._lock:
+                self._flushing, self._flushing_clear = {}, False
+                self._changed.notify_all()
+
+    def flush(self, timeout: Optional[float] = 10.0) -> bool:
+        """等待排队的改动写入磁盘，返回是否在超时前全部写完"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._pending or self._pending_clear or self._flushing or self._flushing_clear:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+        return True
+
+    def _unflushed(self, key: str) -> Tuple[bool, Optional[tuple]]:
+        """尚未落盘的改动：(是否以内存中的改动为准, 条目)；条目为 None 表示已删除"""
+        for changes, cleared in ((self._pending, self._pending_clear), (self._flushing, self._flushing_clear)):
+            if key in changes:
+                return True, changes[key]
+            if cleared:
+                return True, None
+        return False, None
+
+    def _count(self, tool: str, field: str):
+        stats = self._stats.setdefault(tool, {"hits": 0, "disk_hits": 0, "misses": 0})
+        stats[field] += 1
+        events = cache_events.get()
+        if events is not None:
+            events.append(field)
+
+    def _remember(self, key: str, expires_at: float, value: Any):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, tool: str, key: str) -> Optional[Any]:
+        """命中返回缓存值，未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self._count(tool, "hits")
+                    return entry[1]
+                del self._memory[key]
+
+            known, pending = self._unflushed(key)
+            if known:
+                # 改动还没写入磁盘（LRU 中已被淘汰），磁盘上的内容是旧的
+                if pending is not None and pending[2] > now:
+                    self._remember(key, pending[2], pending[1])
+                    self._count(tool, "hits")
+                    return pending[1]
+                self._count(tool, "misses")
+                return None
+
+            db = self._db()
+            if db is not None:
+                row = db.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] > now:
+                    value = json.loads(row[0])
+                    self._remember(key, row[1], value)
+                    self._count(tool, "disk_hits")
+                    return value
+
+            self._count(tool, "misses")
+            return None
+
+    def set(self, tool: str, key: str, value: Any, ttl: float):
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+            self._persist(key, (tool, value, expires_at))
+
+    def delete(self, key: str):
+        """删除一个条目（内存和磁盘）"""
+        with self._lock:
+            self._memory.pop(key, None)
+            self._persist(key, None)
+
+    def purge_expired(self) -> int:
+        """删除磁盘上已过期的条目，返回删除数量"""
+        with self._lock:
+            db = self._db()
+            if db is None:
+                return 0
+            cursor = db.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            db.commit()
+            return cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._persist(None)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """各工具的命中 / 磁盘命中 / 未命中次数"""
+        with self._lock:
+            return {tool: dict(s) for tool, s in self._stats.items()}
+
+
+tool_cache = TTLCache()
+
+
+def cached_tool(
+    tool_name: str, ttl: Optional[float] = None, cache: Optional[TTLCache] = None, ignore: Iterable[str] = ()
+):
+    """
+    给工具的取数函数加缓存，同时支持普通函数和协程函数。
+
+    被装饰的函数出错时应抛出异常，异常结果不会被缓存。
+    `ignore` 中的参数（如 API Key）不影响结果，不计入缓存键。
+    协程函数在同一事件循环上的相同未命中查询只执行一次，其余调用等待它的结果。
+    """
+    ttl = TOOL_TTLS.get(tool_name, 3600) if ttl is None else ttl
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def _key(args, kwargs) -> str:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return make_key(tool_name, {k: v for k, v in bound.arguments.items() if k not in ignore})
+
+        if asyncio.iscoroutinefunction(func):
+            # 正在进行的未命中查询：缓存键 → Future（只在创建它的事件循环上复用）
+            in_flight: Dict[str, asyncio.Future] = {}
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                store = cache or tool_cache
+                key = _key(args, kwargs)
+                value = store.get(tool_name, key)
+                if value is not None:
+                    return value
+
+                loop = asyncio.get_running_loop()
+                while key in in_flight and in_flight[key].get_loop() is loop:
+                    leader = in_flight[key]
+                    try:
+                        return await asyncio.shield(leader)
+                    except asyncio.CancelledError:
+                        if not leader.cancelled():
+                            raise
+                        # 发起查询的调用被取消了，由本调用重新查询
+
+                future = in_flight[key] = loop.create_future()
+                # 没有其他调用等待时，异常结果不必被取回
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                try:
+                    value = await func(*args, **kwargs)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except BaseException as e:
+                    future.set_exception(e)
+                    raise
+                finally:
+                    if in_flight.get(key) is future:
+                        del in_flight[key]
+                store.set(tool_name, key, value, ttl)
+                future.set_result(value)
+                return value
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            store = cache or tool_cache
+            key = _key(args, kwargs)
+            value = store.get(tool_name, key)
+            if value is None:
+                value = func(*args, **kwargs)
+                store.set(tool_name, key, value, ttl)
+            return value
+        return wrapper
+
+    return decorator
@@ -0,0 +1,87 @@
+"""
+工具结果的紧凑表格输出。
+
+工具结果会在之后的每一轮 LLM 调用中重复发送，逐条拼接的 “字段名: 值” 文本里
+字段名占了很大比例。这里把解析后的记录序列化为表格：表头只出现一次，每条
+记录一行，字段之间用 `|` 分隔，空字段留空。
+
+详细程度（verbosity）只影响输出，不影响查询和缓存，Agent 需要更多细节时
+换一个 verbosity 再调用会直接命中缓存：
+
+- brief：只保留关键列；
+- normal（默认）：全部字段，过长的文本截断；
+- full：全部字段，不截断。
+"""
+from typing import Any, Callable, Iterable, List, NamedTuple, Optional, Sequence
+
+BRIEF, NORMAL, FULL = "brief", "normal", "full"
+VERBOSITY_LEVELS = (BRIEF, NORMAL, FULL)
+
+
+class Column(NamedTuple):
+    """
+    表格的一列。
+
+    Args:
+        header: 表头
+        get: 从记录中取值的函数，返回 None 或空字符串时单元格留空
+        level: 从哪个详细程度开始输出该列
+        max_chars: 非 full 模式下单元格的最大长度
+    """
+    header: str
+    get: Callable[[Any], Any]
+    level: str = BRIEF
+    max_chars: Optional[int] = None
+
+
+def field(name: str) -> Callable[[dict], Any]:
+    """按键名取字典记录的字段"""
+    return lambda record: record.get(name)
+
+
+def normalize_verbosity(verbosity: Optional[str]) -> str:
+    verbosity = (verbosity or NORMAL).strip().lower()
+    return verbosity if verbosity in VERBOSITY_LEVELS else NORMAL
+
+
+def _cell(value: Any, max_chars: Optional[int]) -> str:
+    if value is None:
+        return ""
+    text = " ".join(str(value).split()).replace("|", "/")
+    if max_chars and len(text) > max_chars:
+        text = text[: max_chars - 1] + "…"
+    return text
+
+
+def format_table(
+    columns: Sequence[Column],
+    records: Iterable[Any],
+    verbosity: str = NORMAL,
+    title: Optional[str] = None,
+) -> str:
+    """
+    把记录序列化为表格文本。
+
+    Args:
+        columns: 全部列，按 verbosity 筛选
+        records: 记录，所有记录都为空的列不输出
+        verbosity: brief / normal / full
+        title: 表格上方的说明行（如地点、单位），只出现一次
+    """
+    verbosity = normalize_verbosity(verbosity)
+    rank = VERBOSITY_LEVELS.index(verbosity)
+    max_chars = verbosity != FULL
+    cells = [
+        [_cell(c.get(record), c.max_chars if max_chars else None) for c in columns]
+        for record in records
+    ]
+    # 按详细程度筛选列，所有记录都为空的列不输出
+    shown = [
+        i for i, c in enumerate(columns)
+        if VERBOSITY_LEVELS.index(c.level) <= rank and any(row[i] for row in cells)
+    ]
+
+    lines: List[str] = [title] if title else []
+    lines.append("|".join(columns[i].header for i in shown))
+    lines.extend("|".join(row[i] for i in shown) for row in cells)
+    return "\n".join(lines)
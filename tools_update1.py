@@ -1,100 +1,679 @@
+import asyncio
+import functools
+import heapq
+import logging
 import re
-from icalendar import Calendar, Event
+import time
+import unicodedata
 from datetime import datetime, timedelta
 import requests
+import httpx
 import os
 import json
-from langchain_core.tools import tool
+from langchain_core.tools import BaseTool, StructuredTool, tool
 from apify_client import ApifyClient
-from typing import List, Dict, Optional
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from http_clients import (
+    HTTP_TIMEOUT,
+    get_http_session,
+    get_apify_client,
+    get_async_http_client,
+    get_apify_client_async,
+)
+from tool_cache import TOOL_TTLS, cached_tool, make_key, tool_cache
+from tool_output import NORMAL, Column, field, format_table
+from upstreams import get_upstream
+from apify_pool import get_apify_pool
+from itinerary_calendar import generate_ics_content  # noqa: F401  兼容旧的导入位置
 
-apify_api_1 = os.environ.get("APIFY_API_1")
-apify_api_2 = os.environ.get("APIFY_API_2")
-apify_api_3 = os.environ.get("APIFY_API_3")
+logger = logging.getLogger(__name__)
 
-# ==================== ICS 生成函数 ====================
-def generate_ics_content(plan_text: str, start_date: datetime = None) -> bytes:
+# 可用环境变量指向本地替身服务（见 benchmarks/）
+SERPAPI_URL = os.environ.get("SERPAPI_URL", "https://serpapi.com/search")
+GOOGLE_MAPS_ACTOR = "nwua9Gu5YrADL7ZDj"
+WEATHER_ACTOR = "utztKy0FeZBtJyhx8"
+FLIGHT_ACTOR = "tiveIS4hgXOMtu3Hf"
+
+# ==================== 结果解析与格式化 ====================
+# 同步工具和异步工具共用同一套解析逻辑：取数函数把原始结果解析为记录
+# （可 JSON 序列化，直接写入缓存），工具再按 verbosity 输出紧凑表格（见 tool_output）。
+
+WEB_COLUMNS = (
+    Column("标题", field("title")),
+    Column("链接", field("link")),
+    Column("摘要", field("snippet"), NORMAL, 120),
+)
+
+
+def _web_records(results: dict) -> List[dict]:
+    return [
+        {
+            "title": result.get("title", "No title"),
+            "link": result.get("link", "#"),
+            "snippet": result.get("snippet", "No snippet available."),
+        }
+        for result in results.get("organic_results", [])[:5]
+    ]
+
+
+def _format_web_results(records: List[dict], verbosity: str = NORMAL) -> str:
+    if not records:
+        return "未找到相关信息。"
+    return format_table(WEB_COLUMNS, records, verbosity)
+
+
+def _maps_run_input(queries: List[str], location: Optional[str], max_results: int) -> dict:
+    run_input = {
+        "searchStringsArray": queries,
+        "maxCrawledPlacesPerSearch": max_results,
+        "language": "zh-CN",
+        "searchMatching": "all",
+        "website": "allPlaces",
+        "skipClosedPlaces": False,
+        "scrapePlaceDetailPage": False,
+        "includeWebResults": False,
+        "maxReviews": 0,
+    }
+
+    # 添加位置参数（如果提供）
+    if location:
+        run_input["locationQuery"] = location
+    return run_input
+
+
+PLACE_FIELDS = ("title", "rating", "reviewsCount", "category", "address", "phone", "website")
+PLACE_COLUMNS = (
+    Column("名称", field("title")),
+    Column("评分", field("rating")),
+    Column("评价数", field("reviewsCount"), NORMAL),
+    Column("类别", field("category")),
+    Column("地址", field("address"), NORMAL),
+    Column("电话", field("phone"), NORMAL),
+    Column("网站", field("website"), NORMAL),
+)
+
+
+def _place_record(item: dict) -> dict:
+    record = {key: item[key] for key in PLACE_FIELDS if item.get(key)}
+    record.setdefault("title", "N/A")
+    return record
+
+
+def _format_places(query: str, records: List[dict], verbosity: str = NORMAL) -> str:
+    if not records:
+        return f"未找到与 '{query}' 相关的地点。"
+    return format_table(PLACE_COLUMNS, records, verbosity)
+
+
+def _group_places(items, queries: List[str], max_results: int) -> Dict[str, List[dict]]:
+    """按 Actor 返回的 searchString 把地点结果分回各自的查询"""
+    grouped: Dict[str, List[dict]] = {q: [] for q in queries}
+    by_key = {" ".join(q.split()).casefold(): q for q in queries}
+    for item in items:
+        query = by_key.get(" ".join(str(item.get("searchString", "")).split()).casefold())
+        if query is None and len(queries) == 1:
+            query = queries[0]
+        if query is not None and len(grouped[query]) < max_results:
+            grouped[query].append(_place_record(item))
+    return grouped
+
+
+def _places_cache_key(query: str, location: Optional[str], max_results: int) -> str:
+    # 与 _fetch_places 的缓存键一致，批量查询和单次查询共享缓存
+    return make_key("search_google_maps", {"query": query, "location": location, "max_results": max_results})
+
+
+def _split_cached_places(queries: List[str], location: Optional[str], max_results: int):
+    """返回 (已缓存的 {查询: 记录}, 需要实际查询的列表)"""
+    found, missing = {}, []
+    for query in dict.fromkeys(q for q in queries if q.strip()):
+        cached = tool_cache.get("search_google_maps", _places_cache_key(query, location, max_results))
+        if cached is None:
+            missing.append(query)
+        else:
+            found[query] = cached
+    return found, missing
+
+
+def _store_places(grouped: Dict[str, List[dict]], location: Optional[str], max_results: int) -> Dict[str, List[dict]]:
+    for query, records in grouped.items():
+        tool_cache.set(
+            "search_google_maps",
+            _places_cache_key(query, location, max_results),
+            records,
+            TOOL_TTLS["search_google_maps"],
+        )
+    return grouped
+
+
+def _format_places_batch(queries: List[str], grouped: Dict[str, List[dict]], verbosity: str = NORMAL) -> str:
+    """所有查询的结果合成一张表，“查询”列标明每个地点属于哪个关键词"""
+    queries = [q for q in dict.fromkeys(queries) if q in grouped]
+    rows = [{"query": q, **record} for q in queries for record in grouped[q]]
+    not_found = [q for q in queries if not grouped[q]]
+
+    parts = []
+    if rows:
+        parts.append(format_table((Column("查询", field("query")),) + PLACE_COLUMNS, rows, verbosity))
+    if not_found:
+        parts.append("未找到相关地点的查询: " + "、".join(not_found))
+    return "\n".join(parts) or "未找到相关地点。"
+
+
+# ---------- 天气 ----------
+# 天气按地点取一次十天（或一个月）预报，缓存后按行程日期在本地截取；
+# 地点名先规范化，“上海市”“ 上海 ”“上海”共用同一份缓存，多个城市合并为一次 Actor 运行。
+
+# (timeFrame, 覆盖天数)，按行程最后一天距今天数选择最短的一个
+FORECAST_FRAMES = (("ten_day", 10), ("month", 30))
+
+
+def canonical_location(location: str) -> str:
     """
-    根据行程文本生成 iCalendar (.ics) 文件内容。
+    规范化地点名：全角转半角、统一逗号、合并空白、去掉中文城市名末尾的“市”，
+    英文部分首字母大写，如 " tokyo ，japan " → "Tokyo, Japan"。
     """
-    cal = Calendar()
-    cal.add('prodid', '-//AI 旅行计划器//github.com//')
-    cal.add('version', '2.0')
-
-    if start_date is None:
-        start_date = datetime.today()
-
-    # 匹配 Day X
-    day_pattern = re.compile(r'Day (\d+)[:\s]+(.*?)(?=Day \d+|$)', re.DOTALL)
-    days = day_pattern.findall(plan_text)
-
-    if not days:
-        # 如果没有 Day X 格式，则将整个文本作为单个事件
-        event = Event()
-        event.add('summary', "旅行行程")
-        event.add('description', plan_text)
-        event.add('dtstart', start_date.date())
-        event.add('dtend', start_date.date())
-        event.add("dtstamp", datetime.now())
-        cal.add_component(event)
-    else:
-        for day_num, day_content in days:
-            day_num = int(day_num)
-            current_date = start_date + timedelta(days=day_num - 1)
-            
-            event = Event()
-            event.add('summary', f"第 {day_num} 天行程")
-            event.add('description', day_content.strip())
-            event.add('dtstart', current_date.date())
-            event.add('dtend', current_date.date())
-            event.add("dtstamp", datetime.now())
-            cal.add_component(event)
-
-    return cal.to_ical()
+    text = unicodedata.normalize("NFKC", location)
+    parts = []
+    for part in re.split(r"[,、]", text):
+        part = " ".join(part.split())
+        if len(part) > 2 and part.endswith("市"):
+            part = part[:-1]
+        if part.isascii():
+            part = part.title()
+        if part and part.casefold() not in (p.casefold() for p in parts):
+            parts.append(part)
+    return ", ".join(parts)
 
-# ==================== 搜索工具 ====================
-@tool
-def search_web(query: str) -> str:
+
+def _forecast_frame(start: datetime, num_days: int, today: datetime) -> Optional[Tuple[str, int]]:
+    """行程与预报范围有重叠时返回 (timeFrame, 天数)，否则返回 None"""
+    first = (start - today).days
+    last = first + max(num_days, 1) - 1
+    if last < 0:
+        return None
+    for frame, days in FORECAST_FRAMES:
+        if last < days:
+            return frame, days
+    # 行程只有一部分落在最长的预报范围内时，仍取最长的预报并返回重叠的部分
+    frame, days = FORECAST_FRAMES[-1]
+    return (frame, days) if first < days else None
+
+
+def _weather_run_input(locations: List[str], time_frame: str, days: int, units: str) -> dict:
+    return {
+        "locations": locations,
+        "timeFrame": time_frame,
+        "units": units,
+        "maxItems": days * len(locations),
+        "proxyConfiguration": {"useApifyProxy": True},
+    }
+
+
+WEATHER_FIELDS = ("date", "temperature", "condition", "humidity", "windSpeed", "precipitation")
+
+
+def _weather_record(item: dict, fallback_date: datetime) -> dict:
+    """Actor 结果没有日期时，按返回顺序从查询当天起逐日编号"""
+    record = {key: item[key] for key in WEATHER_FIELDS if key in item}
+    record["date"] = str(record.get("date") or fallback_date.strftime("%Y-%m-%d"))[:10]
+    return record
+
+
+def _group_weather(items, locations: List[str], today: datetime) -> Dict[str, List[dict]]:
+    """按结果中的 location 字段把批量查询的结果分回各个地点"""
+    grouped: Dict[str, List[dict]] = {loc: [] for loc in locations}
+    by_key = {loc.casefold(): loc for loc in locations}
+    for item in items:
+        location = by_key.get(canonical_location(str(item.get("location", ""))).casefold())
+        if location is None and len(locations) == 1:
+            location = locations[0]
+        if location is not None:
+            records = grouped[location]
+            records.append(_weather_record(item, today + timedelta(days=len(records))))
+    return grouped
+
+
+def _weather_cache_key(location: str, time_frame: str, units: str) -> str:
+    return make_key("search_weather", {"location": location, "time_frame": time_frame, "units": units})
+
+
+def _split_cached_weather(locations: List[str], time_frame: str, units: str):
     """
-    当你需要回答关于实时事件、地点、活动或任何需要最新信息的问题时，使用此工具进行网络搜索。
-    它会返回一个包含搜索结果的字符串。
+    返回 (已缓存的 {地点: 逐日记录}, 需要实际查询的地点列表)。
+
+    覆盖范围更长的预报（如已缓存的 month）同样可以满足较短的请求。
     """
-    api_key = os.environ.get("SERP_API_KEY")
-    if not api_key:
-        return "错误: SerpAPI Key 未设置。"
+    frames = [f for f, _ in FORECAST_FRAMES]
+    usable = frames[frames.index(time_frame):]
+    found, missing = {}, []
+    for location in locations:
+        for frame in usable:
+            cached = tool_cache.get("search_weather", _weather_cache_key(location, frame, units))
+            if cached is not None:
+                found[location] = cached
+                break
+        else:
+            missing.append(location)
+    return found, missing
+
+
+def _store_weather(grouped: Dict[str, List[dict]], time_frame: str, units: str) -> Dict[str, List[dict]]:
+    for location, records in grouped.items():
+        # 没有取到数据的地点不缓存，下次重新查询
+        if records:
+            tool_cache.set(
+                "search_weather",
+                _weather_cache_key(location, time_frame, units),
+                records,
+                TOOL_TTLS["search_weather"],
+            )
+    return grouped
+
+
+class WeatherRequest(NamedTuple):
+    locations: List[str]
+    start: datetime
+    end: datetime
+    frame: Optional[Tuple[str, int]]
+
+
+def _weather_request(locations: List[str], start_date: str, num_days: int) -> WeatherRequest:
+    locations = list(dict.fromkeys(filter(None, (canonical_location(loc) for loc in locations))))
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    today = datetime.combine(datetime.today().date(), datetime.min.time())
+    end = start + timedelta(days=max(int(num_days), 1) - 1)
+    return WeatherRequest(locations, start, end, _forecast_frame(start, int(num_days), today))
+
+
+def _weather_columns(units: str, with_location: bool):
+    metric = units == "metric"
+    return ((Column("地点", field("location")),) if with_location else ()) + (
+        Column("日期", field("date")),
+        Column(f"温度(°{'C' if metric else 'F'})", field("temperature")),
+        Column("天气", field("condition")),
+        Column("湿度(%)", field("humidity"), NORMAL),
+        Column(f"风速({'km/h' if metric else 'mph'})", field("windSpeed"), NORMAL),
+        Column("降水概率(%)", field("precipitation")),
+    )
+
+
+def _format_weather(request: WeatherRequest, grouped: Dict[str, List[dict]], units: str, verbosity: str = NORMAL) -> str:
+    """只输出与行程日期重叠的天数；多个地点合成一张表"""
+    first, last = request.start.strftime("%Y-%m-%d"), request.end.strftime("%Y-%m-%d")
+    rows, not_found = [], []
+    for location in request.locations:
+        days = [r for r in grouped.get(location, []) if first <= r["date"] <= last]
+        if days:
+            rows.extend({"location": location, **r} for r in days)
+        else:
+            not_found.append(location)
+
+    parts = []
+    if rows:
+        multi = len(request.locations) > 1
+        title = None if multi else f"地点: {request.locations[0]}"
+        parts.append(format_table(_weather_columns(units, multi), rows, verbosity, title=title))
+    if not_found:
+        parts.append(f"未找到 {'、'.join(not_found)} 在 {first} 至 {last} 的天气数据。")
+    return "\n".join(parts)
+
+
+def _weather_out_of_range(request: WeatherRequest) -> str:
+    return (
+        f"{request.start:%Y-%m-%d} 起的行程超出天气预报范围（最多 {FORECAST_FRAMES[-1][1]} 天），"
+        "请根据目的地往年同期气候给出建议。"
+    )
+
+
+class FlightSegment(NamedTuple):
+    carrier: str
+    flight_number: str
+    departure: str
+    arrival: str
+
+
+class FlightOffer(NamedTuple):
+    """一个完整的航班方案（往返或多程），票价为所有报价中的最低价"""
+    price: Optional[float]
+    legs: Tuple[Tuple[FlightSegment, ...], ...]
+
+
+FlightLeg = Tuple[str, str, str]  # (出发地, 目的地, 日期)
+
+
+def _flight_legs(origin: str, target: str, depart: str, return_date: Optional[str] = None) -> List[FlightLeg]:
+    legs = [(origin, target, depart)]
+    if return_date:
+        legs.append((target, origin, return_date))
+    return legs
+
+
+def _flight_run_input(legs: List[FlightLeg], market: str, currency: str) -> dict:
+    """多个航段编号为 origin.N / target.N / depart.N，在一次 Actor 运行中查询"""
+    run_input = {"market": market, "currency": currency}
+    for i, (origin, target, depart) in enumerate(legs):
+        run_input[f"origin.{i}"] = origin
+        run_input[f"target.{i}"] = target
+        run_input[f"depart.{i}"] = depart
+    return run_input
+
+
+def _parse_flight_item(item: dict) -> FlightOffer:
+    """一次遍历把一条航班结果解析为 FlightOffer"""
+    carriers = item.get("_carriers", {})
+    segments = item.get("_segments", {})
+
+    amounts = [
+        p["price"]["amount"]
+        for p in item.get("pricing_options", [])
+        if "amount" in p.get("price", {})
+    ]
+    price = min(amounts) if amounts else None
 
+    legs = []
+    for leg in item.get("legs", []):
+        leg_segments = []
+        for seg_id in leg.get("segment_ids", []):
+            seg = segments.get(seg_id, {})
+            carrier = carriers.get(str(seg.get("marketing_carrier_id")), {})
+            leg_segments.append(FlightSegment(
+                carrier.get("name", "未知"),
+                seg.get("marketing_flight_number", "未知"),
+                seg.get("departure", "未知"),
+                seg.get("arrival", "未知"),
+            ))
+        legs.append(tuple(leg_segments))
+    return FlightOffer(price, tuple(legs))
+
+
+def _load_offers(value) -> List[FlightOffer]:
+    """从缓存值（NamedTuple 经 JSON 往返后为嵌套列表）还原 FlightOffer"""
+    return [
+        FlightOffer(price, tuple(tuple(FlightSegment(*seg) for seg in leg) for leg in legs))
+        for price, legs in value
+    ]
+
+
+def _cheapest_offers(offers: Iterable[FlightOffer], max_results: int) -> List[FlightOffer]:
+    """按票价取最便宜的 max_results 个方案，没有票价的排在最后"""
+    return heapq.nsmallest(max_results, offers, key=lambda o: (o.price is None, o.price or 0))
+
+
+def _leg_names(legs: List[FlightLeg]) -> List[str]:
+    if len(legs) == 1:
+        return ["航程"]
+    if len(legs) == 2 and legs[1][:2] == legs[0][1::-1]:
+        return ["去程", "返程"]
+    return [f"第{i + 1}程" for i in range(len(legs))]
+
+
+def _short_time(value: str) -> str:
+    """2026-11-01T10:40:00 → 2026-11-01 10:40"""
+    if len(value) >= 16 and value[10] == "T":
+        return f"{value[:10]} {value[11:16]}"
+    return value
+
+
+FLIGHT_COLUMNS = (
+    Column("方案", field("plan")),
+    Column("票价", field("price")),
+    Column("航程", field("leg")),
+    Column("航空公司", field("carrier"), NORMAL),
+    Column("航班号", field("flight_number")),
+    Column("出发", field("departure")),
+    Column("到达", field("arrival"), NORMAL),
+)
+
+
+def _format_flight_offers(offers: List[FlightOffer], legs: List[FlightLeg], currency: str, verbosity: str = NORMAL) -> str:
+    """每个航段一行；同一方案的票价只写在第一行"""
+    names = _leg_names(legs)
+    rows = []
+    for n, offer in enumerate(offers, 1):
+        price = offer.price
+        for name, segments in zip(names, offer.legs):
+            for seg in segments:
+                rows.append({
+                    "plan": n,
+                    "price": price,
+                    "leg": name,
+                    "carrier": seg.carrier,
+                    "flight_number": seg.flight_number,
+                    "departure": _short_time(seg.departure),
+                    "arrival": _short_time(seg.arrival),
+                })
+                price = None
+    route = "；".join(f"{name} {origin}→{target} {depart}" for name, (origin, target, depart) in zip(names, legs))
+    return format_table(FLIGHT_COLUMNS, rows, verbosity, title=f"{route}（票价单位 {currency}，按票价从低到高）")
+
+
+def _flights_text(offers: List[FlightOffer], legs: List[FlightLeg], currency: str, verbosity: str = NORMAL) -> str:
+    if offers:
+        return _format_flight_offers(offers, legs, currency, verbosity)
+    route = "、".join(f"{origin} 到 {target}" for origin, target, _ in legs)
+    return f"未找到从 {route} 的航班信息。"
+
+# ==================== 取数函数 ====================
+# 真正调用外部服务的函数，出错时抛出异常；返回解析后的记录并经 tool_cache 缓存，
+# 同一地点/航线的重复查询（包括换一个 verbosity 再查）直接命中缓存。
+# Actor 调用传 logger=None：默认会转发运行日志，退出时固定等待约 6 秒。
+# 所有外部调用都经过 upstreams 的截止时间、重试和熔断；Actor 先启动再等待结束，
+# 超时、出错或被取消时先中止运行再抛出，重试不会与上一次运行重叠。Actor 使用的 Key 从 apify_pool 借用，各工具共享所有 Key。
+
+# Actor 运行仍未结束的状态
+ACTOR_PENDING = ("READY", "RUNNING")
+# 中止 Actor 运行的超时时间（秒）
+ACTOR_ABORT_TIMEOUT = 10.0
+
+
+def _actor_result(run: Optional[dict], actor_id: str, timeout: float) -> dict:
+    """检查 Actor 运行状态：未结束视为超时，失败时抛出异常"""
+    status = (run or {}).get("status")
+    if status in ACTOR_PENDING or status in ("TIMING-OUT", "TIMED-OUT"):
+        raise TimeoutError(f"Actor {actor_id} 在 {timeout:.0f} 秒内未完成")
+    if status != "SUCCEEDED":
+        raise RuntimeError(f"Actor {actor_id} 运行失败（{status}）")
+    return run
+
+
+def _run_actor(actor_id: str, run_input: dict, timeout: float, limit: Optional[int] = None) -> List[dict]:
+    """从 Key 池借一个 Key 运行 Actor 并读取结果；超过 timeout 仍未结束或等待出错时中止运行"""
+    pool, deadline = get_apify_pool(), time.monotonic() + timeout
+    with pool.lease(timeout) as key:
+        timeout = max(deadline - time.monotonic(), 1.0)
+        client = get_apify_client(key.token)
+        started = client.actor(actor_id).start(run_input=run_input, timeout_secs=int(timeout))
+        run = None
+        try:
+            run = client.run(started["id"]).wait_for_finish(wait_secs=int(timeout))
+        finally:
+            # 重试前必须中止仍在运行的 Actor，否则会同时跑两份付费运行
+            if (run or started).get("status") in ACTOR_PENDING:
+                try:
+                    client.run(started["id"]).abort()
+                except Exception as e:
+                    logger.warning("中止 Actor %s 运行 %s 失败: %r", actor_id, started["id"], e)
+        pool.record_run(key, run)
+        run = _actor_result(run, actor_id, timeout)
+        return list(client.dataset(run["defaultDatasetId"]).iterate_items(limit=limit))
+
+
+async def _arun_actor(actor_id: str, run_input: dict, timeout: float, limit: Optional[int] = None) -> List[dict]:
+    pool, deadline = get_apify_pool(), time.monotonic() + timeout
+    async with pool.alease(timeout) as key:
+        timeout = max(deadline - time.monotonic(), 1.0)
+        client = get_apify_client_async(key.token)
+        started = await client.actor(actor_id).start(run_input=run_input, timeout_secs=int(timeout))
+        run = None
+        try:
+            run = await client.run(started["id"]).wait_for_finish(wait_secs=int(timeout))
+        finally:
+            # 等待超时、出错或被取消（upstreams 的尝试超时）时都先中止运行再抛出
+            if (run or started).get("status") in ACTOR_PENDING:
+                try:
+                    await asyncio.wait_for(client.run(started["id"]).abort(), timeout=ACTOR_ABORT_TIMEOUT)
+                except Exception as e:
+                    logger.warning("中止 Actor %s 运行 %s 失败: %r", actor_id, started["id"], e)
+        pool.record_run(key, run)
+        run = _actor_result(run, actor_id, timeout)
+        return [item async for item in client.dataset(run["defaultDatasetId"]).iterate_items(limit=limit)]
+
+
+@cached_tool("search_web", ignore=("api_key",))
+def _fetch_web(query: str, api_key: str) -> List[dict]:
     params = {
         "q": query,
         "api_key": api_key,
         "engine": "google",
     }
-    url = "https://serpapi.com/search"
-    
-    try:
-        response = requests.get(url, params=params)
+
+    def request(timeout: float) -> dict:
+        response = get_http_session().get(SERPAPI_URL, params=params, timeout=min(timeout, HTTP_TIMEOUT))
         response.raise_for_status()
-        results = response.json()
-        
-        snippets = []
-        if "organic_results" in results:
-            for result in results.get("organic_results", [])[:5]:
-                snippet = result.get("snippet", "No snippet available.")
-                title = result.get("title", "No title")
-                link = result.get("link", "#")
-                snippets.append(f"标题: {title}\n链接: {link}\n摘要: {snippet}\n---")
-        
-        if not snippets:
-            return "未找到相关信息。"
-            
-        return "\n".join(snippets)
+        return response.json()
 
+    return _web_records(get_upstream("serpapi").call(request))
+
+
+@cached_tool("search_google_maps")
+def _fetch_places(query: str, location: Optional[str], max_results: int) -> List[dict]:
+    run_input = _maps_run_input([query], location, max_results)
+    items = get_upstream("apify_maps").call(
+        lambda timeout: _run_actor(GOOGLE_MAPS_ACTOR, run_input, timeout, limit=max_results)
+    )
+    return [_place_record(item) for item in items]
+
+
+def _fetch_places_batch(queries: List[str], location: Optional[str], max_results: int) -> Dict[str, List[dict]]:
+    """一次 Actor 运行查询多个地点关键词，已缓存的关键词不再查询"""
+    found, missing = _split_cached_places(queries, location, max_results)
+    if missing:
+        run_input = _maps_run_input(missing, location, max_results)
+        items = get_upstream("apify_maps").call(
+            lambda timeout: _run_actor(GOOGLE_MAPS_ACTOR, run_input, timeout)
+        )
+        found.update(_store_places(_group_places(items, missing, max_results), location, max_results))
+    return found
+
+
+def _fetch_weather(request: WeatherRequest, units: str) -> Dict[str, List[dict]]:
+    """一次 Actor 运行查询所有未缓存的地点"""
+    time_frame, days = request.frame
+    found, missing = _split_cached_weather(request.locations, time_frame, units)
+    if missing:
+        run_input = _weather_run_input(missing, time_frame, days, units)
+        items = get_upstream("apify_weather").call(
+            lambda timeout: _run_actor(WEATHER_ACTOR, run_input, timeout)
+        )
+        today = datetime.combine(datetime.today().date(), datetime.min.time())
+        found.update(_store_weather(_group_weather(items, missing, today), time_frame, units))
+    return found
+
+
+@cached_tool("search_flights")
+def _fetch_flights(
+    origin: str, target: str, depart: str, return_date: Optional[str], market: str, currency: str, max_results: int
+) -> List[FlightOffer]:
+    run_input = _flight_run_input(_flight_legs(origin, target, depart, return_date), market, currency)
+    items = get_upstream("apify_flights").call(
+        lambda timeout: _run_actor(FLIGHT_ACTOR, run_input, timeout)
+    )
+    return _cheapest_offers(map(_parse_flight_item, items), max_results)
+
+# ---------- 异步版本 ----------
+# HTTP 请求复用共享的 keep-alive 连接池，Apify Actor 用异步客户端等待，
+# 不会阻塞事件循环上的其他会话。
+
+@cached_tool("search_web", ignore=("api_key",))
+async def _afetch_web(query: str, api_key: str) -> List[dict]:
+    params = {
+        "q": query,
+        "api_key": api_key,
+        "engine": "google",
+    }
+
+    async def request(timeout: float) -> dict:
+        response = await get_async_http_client().get(SERPAPI_URL, params=params, timeout=min(timeout, HTTP_TIMEOUT))
+        response.raise_for_status()
+        return response.json()
+
+    return _web_records(await get_upstream("serpapi").acall(request))
+
+
+@cached_tool("search_google_maps")
+async def _afetch_places(query: str, location: Optional[str], max_results: int) -> List[dict]:
+    run_input = _maps_run_input([query], location, max_results)
+    items = await get_upstream("apify_maps").acall(
+        lambda timeout: _arun_actor(GOOGLE_MAPS_ACTOR, run_input, timeout, limit=max_results)
+    )
+    return [_place_record(item) for item in items]
+
+
+async def _afetch_places_batch(queries: List[str], location: Optional[str], max_results: int) -> Dict[str, List[dict]]:
+    found, missing = _split_cached_places(queries, location, max_results)
+    if missing:
+        run_input = _maps_run_input(missing, location, max_results)
+        items = await get_upstream("apify_maps").acall(
+            lambda timeout: _arun_actor(GOOGLE_MAPS_ACTOR, run_input, timeout)
+        )
+        found.update(_store_places(_group_places(items, missing, max_results), location, max_results))
+    return found
+
+
+async def _afetch_weather(request: WeatherRequest, units: str) -> Dict[str, List[dict]]:
+    time_frame, days = request.frame
+    found, missing = _split_cached_weather(request.locations, time_frame, units)
+    if missing:
+        run_input = _weather_run_input(missing, time_frame, days, units)
+        items = await get_upstream("apify_weather").acall(
+            lambda timeout: _arun_actor(WEATHER_ACTOR, run_input, timeout)
+        )
+        today = datetime.combine(datetime.today().date(), datetime.min.time())
+        found.update(_store_weather(_group_weather(items, missing, today), time_frame, units))
+    return found
+
+
+@cached_tool("search_flights")
+async def _afetch_flights(
+    origin: str, target: str, depart: str, return_date: Optional[str], market: str, currency: str, max_results: int
+) -> List[FlightOffer]:
+    run_input = _flight_run_input(_flight_legs(origin, target, depart, return_date), market, currency)
+    items = await get_upstream("apify_flights").acall(
+        lambda timeout: _arun_actor(FLIGHT_ACTOR, run_input, timeout)
+    )
+    return _cheapest_offers(map(_parse_flight_item, items), max_results)
+
+
+# ==================== 搜索工具 ====================
+@tool
+def search_web(query: str, verbosity: str = "normal") -> str:
+    """
+    当你需要回答关于实时事件、地点、活动或任何需要最新信息的问题时，使用此工具进行网络搜索。
+    它会返回一个包含搜索结果的表格（标题|链接|摘要）。
+
+    Args:
+        query: 搜索关键词
+        verbosity: 输出详细程度：brief（只含关键列）/ normal（默认，全部字段）/ full（长文本不截断）
+    """
+    return _search_web(query, verbosity)
+
+
+def _search_web(query: str, verbosity: str = "normal", api_key: Optional[str] = None) -> str:
+    if api_key is None:
+        api_key = os.environ.get("SERP_API_KEY")
+    if not api_key:
+        return "错误: SerpAPI Key 未设置。"
+
+    try:
+        return _format_web_results(_fetch_web(query, api_key), verbosity)
     except requests.exceptions.RequestException as e:
         return f"搜索请求失败: {e}"
     except Exception as e:
         return f"处理搜索结果时出错: {e}"
 
 @tool
-def search_google_maps(query: str, location: str = None, max_results: int = 5) -> str:
+def search_google_maps(query: str, location: str = None, max_results: int = 5, verbosity: str = "normal") -> str:
     """
     使用 Apify Google Maps Scraper 搜索特定地点附近的场所，如餐厅、酒店、景点等,搜索次数不要超过15次，搜索到足够信息就停止。
     
@@ -102,131 +681,58 @@ def search_google_maps(query: str, location: str = None, max_results: int = 5) -
         query: 搜索查询，如 "restaurant", "hotel", "tourist attraction"
         location: 位置描述，如 "Tokyo, Japan"
         max_results: 返回的最大结果数量
+        verbosity: 输出详细程度：brief（只含关键列）/ normal（默认，全部字段）/ full（长文本不截断）
     """
     # 检查 ApifyClient 是否可用
     if ApifyClient is None:
         return "错误: 未安装 apify-client 库。请运行: pip install apify-client"
-    
-    # 获取 Apify API token
+
     try:
-        # 初始化 ApifyClient
-        client = ApifyClient(apify_api_1)
-        
-        # 准备 Actor 输入
-        run_input = {
-            "searchStringsArray": [query],
-            "maxCrawledPlacesPerSearch": max_results,
-            "language": "zh-CN",
-            "searchMatching": "all",
-            "website": "allPlaces",
-            "skipClosedPlaces": False,
-            "scrapePlaceDetailPage": False,
-            "includeWebResults": False,
-            "maxReviews": 0,
-        }
-        
-        # 添加位置参数（如果提供）
-        if location:
-            run_input["locationQuery"] = location
-        
-        # 运行 Actor 并等待完成
-        run = client.actor("nwua9Gu5YrADL7ZDj").call(run_input=run_input)
-        
-        # 获取结果
-        results = []
-        for item in client.dataset(run["defaultDatasetId"]).iterate_items():
-            # 格式化每个地点的信息
-            place_info = f"名称: {item.get('title', 'N/A')}\n"
-            
-            if item.get("address"):
-                place_info += f"地址: {item['address']}\n"
-            
-            if item.get("rating"):
-                place_info += f"评分: {item['rating']}"
-                if item.get("reviewsCount"):
-                    place_info += f" ({item['reviewsCount']}条评价)\n"
-                else:
-                    place_info += "\n"
-            
-            if item.get("category"):
-                place_info += f"类别: {item['category']}\n"
-            
-            if item.get("phone"):
-                place_info += f"电话: {item['phone']}\n"
-            
-            if item.get("website"):
-                place_info += f"网站: {item['website']}\n"
-            
-            results.append(place_info)
-            
-            # 如果达到最大结果数，停止迭代
-            if len(results) >= max_results:
-                break
-        
-        if results:
-            return "\n\n".join(results)
-        else:
-            return f"未找到与 '{query}' 相关的地点。"
-            
+        return _format_places(query, _fetch_places(query, location, max_results), verbosity)
     except Exception as e:
         return f"使用 Apify Google Maps 搜索时出错: {e}"
 @tool
-def search_weather(location: str, time_frame: str = "today", units: str = "metric") -> str:
+def search_google_maps_batch(
+    queries: List[str], location: str = None, max_results: int = 5, verbosity: str = "normal"
+) -> str:
     """
-    使用 Apify Weather Scraper 查询指定地点的天气信息。
-    
+    在同一个城市一次性搜索多类场所（如酒店、餐厅、景点），只运行一次 Google Maps 抓取，
+    比多次调用 search_google_maps 快得多。同一城市的地点搜索优先使用此工具。
+
     Args:
-        location: 地点描述，如 "Tokyo, Japan"
-        time_frame: 时间范围，可选 ["today", "tomorrow", "ten_day", "weekend", "month"]
+        queries: 搜索查询列表，如 ["hotel", "ramen restaurant", "tourist attraction"]
+        location: 位置描述，如 "Tokyo, Japan"
+        max_results: 每个查询返回的最大结果数量
+        verbosity: 输出详细程度：brief（只含关键列）/ normal（默认，全部字段）/ full（长文本不截断）
+    """
+    try:
+        return _format_places_batch(queries, _fetch_places_batch(queries, location, max_results), verbosity)
+    except Exception as e:
+        return f"使用 Apify Google Maps 批量搜索时出错: {e}"
+@tool
+def search_weather(
+    locations: List[str], start_date: str, num_days: int = 1, units: str = "metric", verbosity: str = "normal"
+) -> str:
+    """
+    使用 Apify Weather Scraper 查询一个或多个地点在行程期间的逐日天气，只返回行程日期内的天数。
+    多城市行程请一次传入所有城市，只运行一次查询。
+
+    Args:
+        locations: 地点列表，最好是 "City, Country" 形式，如 ["Tokyo, Japan", "Osaka, Japan"]
+        start_date: 行程开始日期，格式 YYYY-MM-DD
+        num_days: 行程天数
         units: 单位，可选 ["metric", "imperial"]
+        verbosity: 输出详细程度：brief（只含关键列）/ normal（默认，全部字段）/ full（长文本不截断）
     """
     # 检查 ApifyClient 是否可用
     if ApifyClient is None:
         return "错误: 未安装 apify-client 库。请运行: pip install apify-client"
-    
-    try:
-        # 初始化 ApifyClient
-        client = ApifyClient(apify_api_2)
-
-        # 准备 Actor 输入
-        run_input = {
-            "locations": [location],
-            "timeFrame": time_frame,
-            "units": units,
-            "maxItems": 5,
-            "proxyConfiguration": {"useApifyProxy": True},
-        }
-
-        # 运行 Weather Actor
-        run = client.actor("utztKy0FeZBtJyhx8").call(run_input=run_input)
-
-        # 获取结果
-        results = []
-        for item in client.dataset(run["defaultDatasetId"]).iterate_items():
-            weather_info = f"地点: {location}\n"
-            
-            if "temperature" in item:
-                weather_info += f"温度: {item['temperature']}°{'C' if units=='metric' else 'F'}\n"
-            
-            if "condition" in item:
-                weather_info += f"天气: {item['condition']}\n"
-            
-            if "humidity" in item:
-                weather_info += f"湿度: {item['humidity']}%\n"
-            
-            if "windSpeed" in item:
-                weather_info += f"风速: {item['windSpeed']} {'km/h' if units=='metric' else 'mph'}\n"
-            
-            if "precipitation" in item:
-                weather_info += f"降水概率: {item['precipitation']}%\n"
-            
-            results.append(weather_info)
-
-        if results:
-            return "\n\n".join(results)
-        else:
-            return f"未找到 {location} 的天气数据。"
 
+    try:
+        request = _weather_request(locations, start_date, num_days)
+        if request.frame is None:
+            return _weather_out_of_range(request)
+        return _format_weather(request, _fetch_weather(request, units), units, verbosity)
     except Exception as e:
         return f"使用 Apify Weather Scraper 搜索时出错: {e}"
 @tool
@@ -234,74 +740,117 @@ def search_flights(
     origin: str,
     target: str,
     depart: str,
+    return_date: Optional[str] = None,
     market: str = "CN",
     currency: str = "CNY",
-    max_results: int = 6
+    max_results: int = 6,
+    verbosity: str = "normal",
 ) -> str:
     """
-    使用 Apify Flight Search 查询单程航班信息。
+    使用 Apify Flight Search 查询单程或往返航班信息，结果按票价从低到高排列。
+
+    Args:
+        origin: 出发城市或机场
+        target: 目的城市或机场
+        depart: 出发日期，格式 YYYY-MM-DD
+        return_date: 返程日期，格式 YYYY-MM-DD；给出时在一次查询中同时返回去程和返程
+        market: 市场，如 "CN"
+        currency: 货币，如 "CNY"
+        max_results: 最多返回的方案数量
+        verbosity: 输出详细程度：brief（只含关键列）/ normal（默认，全部字段）/ full（长文本不截断）
     """
 
     try:
-        client = ApifyClient(apify_api_3)
-
-        run_input = {
-            "market": market,
-            "currency": currency,
-            "origin.0": origin,
-            "target.0": target,
-            "depart.0": depart,
-        }
+        offers = _load_offers(_fetch_flights(origin, target, depart, return_date, market, currency, max_results))
+        return _flights_text(offers, _flight_legs(origin, target, depart, return_date), currency, verbosity)
+    except Exception as e:
+        return f"使用 Apify Flight Search 搜索时出错: {e}"
 
-        run = client.actor("tiveIS4hgXOMtu3Hf").call(run_input=run_input)
-
-        results = []
-        for item in client.dataset(run["defaultDatasetId"]).iterate_items():
-            legs = item.get("legs", [])
-            carriers = item.get("_carriers", {})
-            segments = item.get("_segments", {})
-            prices = item.get("pricing_options", [])
-
-            for leg in legs:
-                seg_ids = leg.get("segment_ids", [])
-                for seg_id in seg_ids:
-                    seg = segments.get(seg_id, {})
-                    carrier_id = str(seg.get("marketing_carrier_id"))
-                    carrier_name = carriers.get(carrier_id, {}).get("name", "未知")
-                    flight_number = seg.get("marketing_flight_number", "未知")
-                    depart_time = seg.get("departure", "未知")
-                    arrival_time = seg.get("arrival", "未知")
-
-                    # 取最低票价
-                    price = None
-                    if prices:
-                        amounts = [p["price"].get("amount") for p in prices if "price" in p and "amount" in p["price"]]
-                        if amounts:
-                            price = min(amounts)
-
-                    flight_info = (
-                        f"航空公司: {carrier_name}\n"
-                        f"航班号: {flight_number}\n"
-                        f"出发时间: {depart_time}\n"
-                        f"到达时间: {arrival_time}\n"
-                        f"票价: {price} {currency if price else ''}\n"
-                    )
-                    results.append(flight_info)
-
-                    if len(results) >= max_results:
-                        break
-
-            if len(results) >= max_results:
-                break
+# ==================== 异步工具实现 ====================
+# Agent 通过 ainvoke 调用工具时走这些协程，错误处理与同步版本一致
+
+async def _asearch_web(query: str, verbosity: str = "normal", api_key: Optional[str] = None) -> str:
+    if api_key is None:
+        api_key = os.environ.get("SERP_API_KEY")
+    if not api_key:
+        return "错误: SerpAPI Key 未设置。"
+
+    try:
+        return _format_web_results(await _afetch_web(query, api_key), verbosity)
+    except httpx.HTTPError as e:
+        return f"搜索请求失败: {e}"
+    except Exception as e:
+        return f"处理搜索结果时出错: {e}"
+
+
+async def _asearch_google_maps(query: str, location: str = None, max_results: int = 5, verbosity: str = "normal") -> str:
+    try:
+        return _format_places(query, await _afetch_places(query, location, max_results), verbosity)
+    except Exception as e:
+        return f"使用 Apify Google Maps 搜索时出错: {e}"
+
+
+async def _asearch_google_maps_batch(
+    queries: List[str], location: str = None, max_results: int = 5, verbosity: str = "normal"
+) -> str:
+    try:
+        return _format_places_batch(queries, await _afetch_places_batch(queries, location, max_results), verbosity)
+    except Exception as e:
+        return f"使用 Apify Google Maps 批量搜索时出错: {e}"
 
-        if results:
-            return "\n\n".join(results)
-        else:
-            return f"未找到从 {origin} 到 {target} 的航班信息。"
 
+async def _asearch_weather(
+    locations: List[str], start_date: str, num_days: int = 1, units: str = "metric", verbosity: str = "normal"
+) -> str:
+    try:
+        request = _weather_request(locations, start_date, num_days)
+        if request.frame is None:
+            return _weather_out_of_range(request)
+        return _format_weather(request, await _afetch_weather(request, units), units, verbosity)
+    except Exception as e:
+        return f"使用 Apify Weather Scraper 搜索时出错: {e}"
+
+
+async def _asearch_flights(
+    origin: str,
+    target: str,
+    depart: str,
+    return_date: Optional[str] = None,
+    market: str = "CN",
+    currency: str = "CNY",
+    max_results: int = 6,
+    verbosity: str = "normal",
+) -> str:
+    try:
+        offers = _load_offers(await _afetch_flights(origin, target, depart, return_date, market, currency, max_results))
+        return _flights_text(offers, _flight_legs(origin, target, depart, return_date), currency, verbosity)
     except Exception as e:
         return f"使用 Apify Flight Search 搜索时出错: {e}"
 
+
+# 为同名工具挂上协程实现：invoke 走同步版本，ainvoke 走异步版本
+search_web.coroutine = _asearch_web
+search_google_maps.coroutine = _asearch_google_maps
+search_google_maps_batch.coroutine = _asearch_google_maps_batch
+search_weather.coroutine = _asearch_weather
+search_flights.coroutine = _asearch_flights
+
+
+def web_search_tool(serp_api_key: str) -> BaseTool:
+    """
+    绑定了 SerpAPI Key 的 search_web。
+
+    模块级的 search_web 在调用时读取环境变量 SERP_API_KEY；执行器池中的每个 Agent
+    用这个函数创建自己的工具，使用创建时传入的 Key，不同用户的 Key 不会互相覆盖。
+    """
+    return StructuredTool(
+        name=search_web.name,
+        description=search_web.description,
+        args_schema=search_web.args_schema,
+        func=functools.partial(_search_web, api_key=serp_api_key),
+        coroutine=functools.partial(_asearch_web, api_key=serp_api_key),
+    )
+
 @tool
 def echo_tool(x: str) -> str:
     """一个占位工具，不会被调用"""
@@ -0,0 +1,225 @@
+"""
+Agent 流水线的耗时与 token 追踪。
+
+`TraceRecorder` 是一个 LangChain 回调处理器，作为 `callbacks` 传给
+AgentExecutor / 工具调用后，为每次 LLM 调用和工具调用记录一个 span：
+耗时、输入输出 token、负载字节数和缓存命中情况。不经过回调的阶段
+（预查询、本地渲染等）用 `recorder.stage(name)` 记录。
+
+每个 span 以一行 JSON 写入 `logs/trace.jsonl`（按大小轮转），
+`waterfall_rows` 把一次规划的 span 整理成瀑布图数据供界面展示。
+"""
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import Token
+from dataclasses import asdict, dataclass, field
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from tool_cache import cache_events
+
+LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
+TRACE_LOG_PATH = os.path.join(LOG_DIR, "trace.jsonl")
+
+_trace_logger = logging.getLogger("travel_agent.trace")
+
+
+def _get_trace_logger() -> logging.Logger:
+    if not _trace_logger.handlers:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        handler = RotatingFileHandler(TRACE_LOG_PATH, maxBytes=10 * 1024 * 1024, backupCount=5, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _trace_logger.addHandler(handler)
+        _trace_logger.setLevel(logging.INFO)
+        _trace_logger.propagate = False
+    return _trace_logger
+
+
+def _size(value: Any) -> int:
+    text = value if isinstance(value, str) else str(value)
+    return len(text.encode("utf-8"))
+
+
+@dataclass
+class Span:
+    trace_id: str
+    span_id: str
+    kind: str  # "llm" | "tool" | "stage"
+    name: str
+    start: float
+    parent_id: Optional[str] = None
+    end: Optional[float] = None
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    payload_bytes: int = 0
+    cache: Optional[str] = None  # "hit" | "miss" | None
+    error: Optional[str] = None
+    _cache_events: Optional[list] = field(default=None, repr=False)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.time()) - self.start) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data.pop("_cache_events")
+        data["duration_ms"] = round(self.duration_ms, 1)
+        return data
+
+
+class TraceRecorder(BaseCallbackHandler):
+    """记录一次规划（一个 trace）中的所有 LLM / 工具 span"""
+
+    run_inline = True
+
+    def __init__(self, trace_id: Optional[str] = None, export: bool = True):
+        self.trace_id = trace_id or uuid.uuid4().hex[:12]
+        self.export = export
+        self.spans: List[Span] = []
+        self._open: Dict[UUID, Span] = {}
+        # 工具 span 设置 cache_events 时返回的 token，工具结束时用来恢复
+        self._cache_tokens: Dict[UUID, Token] = {}
+
+    # ---------- span 管理 ----------
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], kind: str, name: str, payload: Any) -> Span:
+        span = Span(
+            trace_id=self.trace_id,
+            span_id=str(run_id),
+            parent_id=str(parent_run_id) if parent_run_id else None,
+            kind=kind,
+            name=name,
+            start=time.time(),
+            payload_bytes=_size(payload),
+        )
+        self._open[run_id] = span
+        self.spans.append(span)
+        return span
+
+    def _finish(self, span: Span):
+        span.end = time.time()
+        if span._cache_events:
+            span.cache = "miss" if "misses" in span._cache_events else "hit"
+        if self.export:
+            _get_trace_logger().info(json.dumps(span.to_dict(), ensure_ascii=False))
+
+    @contextmanager
+    def stage(self, name: str):
+        """记录一个不经过 LangChain 回调的阶段"""
+        span = Span(self.trace_id, uuid.uuid4().hex, "stage", name, time.time())
+        self.spans.append(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = repr(e)
+            raise
+        finally:
+            self._finish(span)
+
+    # ---------- LLM ----------
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        name = (kwargs.get("metadata") or {}).get("ls_model_name") or (serialized or {}).get("name", "llm")
+        self._start(run_id, parent_run_id, "llm", name, messages)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        name = (kwargs.get("metadata") or {}).get("ls_model_name") or (serialized or {}).get("name", "llm")
+        self._start(run_id, parent_run_id, "llm", name, prompts)
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs):
+        span = self._open.pop(run_id, None)
+        if span is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        input_tokens = usage.get("prompt_tokens")
+        output_tokens = usage.get("completion_tokens")
+        output_bytes = 0
+        for generations in response.generations:
+            for gen in generations:
+                output_bytes += _size(gen.text)
+                metadata = getattr(getattr(gen, "message", None), "usage_metadata", None)
+                if metadata and input_tokens is None:
+                    input_tokens = metadata.get("input_tokens")
+                    output_tokens = metadata.get("output_tokens")
+        span.input_tokens, span.output_tokens = input_tokens, output_tokens
+        span.payload_bytes += output_bytes
+        self._finish(span)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        span = self._open.pop(run_id, None)
+        if span is not None:
+            span.error = repr(error)
+            self._finish(span)
+
+    # ---------- 工具 ----------
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        span = self._start(run_id, parent_run_id, "tool", (serialized or {}).get("name", "tool"), input_str)
+        # 工具内部的缓存层会把命中情况记到这个列表里
+        span._cache_events = []
+        self._cache_tokens[run_id] = cache_events.set(span._cache_events)
+
+    def _release_cache_events(self, run_id: UUID):
+        """恢复工具开始前的 cache_events，之后在同一上下文中的调用不再记到这个工具上"""
+        token = self._cache_tokens.pop(run_id, None)
+        if token is None:
+            return
+        try:
+            cache_events.reset(token)
+        except ValueError:
+            # 回调与 on_tool_start 不在同一个上下文中执行，token 无法在这里恢复
+            pass
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._release_cache_events(run_id)
+        span = self._open.pop(run_id, None)
+        if span is not None:
+            span.payload_bytes += _size(getattr(output, "content", output))
+            self._finish(span)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._release_cache_events(run_id)
+        span = self._open.pop(run_id, None)
+        if span is not None:
+            span.error = repr(error)
+            self._finish(span)
+
+    # ---------- 汇总 ----------
+    def summary(self) -> Dict[str, Any]:
+        spans = [s for s in self.spans if s.end]
+        return {
+            "trace_id": self.trace_id,
+            "wall_ms": round((max(s.end for s in spans) - min(s.start for s in spans)) * 1000, 1) if spans else 0,
+            "llm_calls": sum(1 for s in spans if s.kind == "llm"),
+            "tool_calls": sum(1 for s in spans if s.kind == "tool"),
+            "input_tokens": sum(s.input_tokens or 0 for s in spans),
+            "output_tokens": sum(s.output_tokens or 0 for s in spans),
+            "cache_hits": sum(1 for s in spans if s.cache == "hit"),
+        }
+
+
+def waterfall_rows(spans: List[Span]) -> List[Dict[str, Any]]:
+    """把 span 列表转换成瀑布图数据：相对起点的开始/结束毫秒数"""
+    finished = [s for s in spans if s.end]
+    if not finished:
+        return []
+    origin = min(s.start for s in finished)
+    rows = []
+    for i, s in enumerate(sorted(finished, key=lambda s: s.start)):
+        rows.append({
+            "step": f"{i + 1:02d} {s.kind}:{s.name}",
+            "kind": s.kind,
+            "start_ms": round((s.start - origin) * 1000, 1),
+            "end_ms": round((s.end - origin) * 1000, 1),
+            "duration_ms": round(s.duration_ms, 1),
+            "tokens": (s.input_tokens or 0) + (s.output_tokens or 0),
+            "bytes": s.payload_bytes,
+            "cache": s.cache or "",
+            "error": s.error or "",
+        })
+    return rows
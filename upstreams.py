@@ -0,0 +1,324 @@
+"""
+外部服务（SerpAPI、Apify Actor）调用的容错层。
+
+一个挂起的上游原先可以把整次规划拖上好几分钟：Apify 的 `.call()` 无限期等待
+Actor 结束，失败后 LLM 还要面对一串报错文本反复重试。这里为每个上游统一提供：
+
+- 截止时间：每次尝试有超时，整次调用（含重试）有总截止时间；
+- 重试：只对超时、连接错误、429 / 5xx 这类暂时性错误重试，退避时间带随机抖动；
+- 对冲请求：慢尾调用超过阈值仍未返回时再发一个相同请求，先返回者胜出
+  （默认只对便宜的 SerpAPI 开启，Actor 重复运行会产生费用）；
+- 熔断：连续失败达到阈值后在冷却时间内直接失败，冷却结束后放行一次试探请求；
+- 指标：调用、成功、失败、超时、重试、对冲、熔断次数和平均耗时。
+
+上游按名称注册为进程级单例，所有会话共享熔断状态和指标。
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, TypeVar
+
+import httpx
+import requests
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 熔断：连续失败次数阈值和冷却时间（秒）
+BREAKER_FAILURES = int(os.environ.get("UPSTREAM_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.environ.get("UPSTREAM_BREAKER_COOLDOWN", "30"))
+# 重试退避的基准时间和上限（秒）
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_MAX = 5.0
+
+
+class UpstreamPolicy(NamedTuple):
+    """
+    一个上游的调用策略。
+
+    Args:
+        attempt_timeout: 单次尝试的超时时间（秒）
+        deadline: 整次调用（含重试和对冲）的总截止时间（秒）
+        retries: 暂时性错误的最多重试次数
+        hedge_after: 超过该时间（秒）仍未返回时发出对冲请求，None 表示不对冲
+        grace: 异步尝试在单次超时之后额外等待的时间（秒），留给被调用函数在上游的
+            等待时间到期后自行收尾（如中止仍在运行的 Actor），避免重试与上一次运行重叠
+    """
+    attempt_timeout: float
+    deadline: float
+    retries: int = 1
+    hedge_after: Optional[float] = None
+    grace: float = 0.0
+
+
+def _env_hedge(name: str, default: Optional[str]) -> Optional[float]:
+    value = os.environ.get(name, default)
+    return float(value) if value else None
+
+
+# Actor 的 wait_secs 到期后中止运行、读取结果所需的时间（秒）
+ACTOR_GRACE = 15.0
+
+UPSTREAM_POLICIES: Dict[str, UpstreamPolicy] = {
+    "serpapi": UpstreamPolicy(15.0, 40.0, retries=2, hedge_after=_env_hedge("SERPAPI_HEDGE_AFTER", "4")),
+    "apify_maps": UpstreamPolicy(120.0, 200.0, retries=1, grace=ACTOR_GRACE),
+    "apify_weather": UpstreamPolicy(90.0, 150.0, retries=1, grace=ACTOR_GRACE),
+    "apify_flights": UpstreamPolicy(150.0, 240.0, retries=1, grace=ACTOR_GRACE),
+}
+DEFAULT_POLICY = UpstreamPolicy(30.0, 60.0, retries=1)
+
+
+class UpstreamUnavailable(Exception):
+    """熔断期间直接拒绝调用"""
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None) or getattr(exc, "status_code", None)
+
+
+def is_transient(exc: BaseException) -> bool:
+    """超时、连接错误和 429 / 5xx 视为暂时性错误，可以重试并计入熔断"""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    status = _status_code(exc)
+    return status is not None and (status == 429 or status >= 500)
+
+
+# ==================== 熔断器 ====================
+class CircuitBreaker:
+    """
+    连续失败计数的熔断器，线程安全。
+
+    closed：正常放行；open：冷却时间内直接拒绝；
+    冷却结束后进入 half-open，只放行一个试探请求，成功则恢复，失败则重新打开。
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._consecutive = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def release(self):
+        """试探请求被取消时归还试探名额"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive, self._opened_at, self._probing = 0, None, False
+
+    def record_failure(self) -> bool:
+        """记录一次失败，返回本次是否触发熔断"""
+        with self._lock:
+            self._consecutive += 1
+            reopened = self._probing
+            self._probing = False
+            if reopened or (self._opened_at is None and self._consecutive >= self.failures):
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+
+# ==================== 上游 ====================
+class Upstream:
+    """
+    一个外部服务的容错调用入口。
+
+    被调用的函数接收本次尝试的超时时间（秒），应把它传给底层的 HTTP / Actor 调用，
+    让上游在超时后主动停止（例如 Actor 的 timeout_secs）；异步尝试在此之外还有
+    `policy.grace` 秒收尾，超过后才被取消。
+
+    Args:
+        name: 上游名称，用于日志、报错和指标
+        policy: 调用策略
+        breaker: 熔断器
+    """
+
+    def __init__(self, name: str, policy: UpstreamPolicy = DEFAULT_POLICY, breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.policy = policy
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics: Counter = Counter()
+        self._latency_total = 0.0
+        self._lock = threading.Lock()
+
+    # ---------- 指标 ----------
+    def _count(self, metric: str, n: int = 1):
+        with self._lock:
+            self.metrics[metric] += n
+
+    def _finish(self, started: float, error: Optional[BaseException]):
+        with self._lock:
+            self._latency_total += time.monotonic() - started
+            self.metrics["success" if error is None else "failure"] += 1
+        # 非暂时性错误（如 4xx 参数错误）说明上游本身可用，不计入熔断
+        if error is None or not is_transient(error):
+            self.breaker.record_success()
+        elif self.breaker.record_failure():
+            self._count("breaker_opened")
+            logger.warning("%s 连续失败，熔断 %.0f 秒", self.name, self.breaker.cooldown)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            done = self.metrics["success"] + self.metrics["failure"]
+            return {
+                **dict(self.metrics),
+                "avg_ms": round(self._latency_total / done * 1000, 1) if done else 0.0,
+                "breaker": self.breaker.state,
+            }
+
+    # ---------- 调用 ----------
+    def _admit(self):
+        self._count("calls")
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise UpstreamUnavailable(
+                f"{self.name} 暂时不可用（连续失败已熔断，{self.breaker.cooldown:.0f} 秒后重试）"
+            )
+
+    def _backoff(self, attempt: int) -> float:
+        # 全抖动退避：在 [0, base * 2^attempt] 内随机等待，避免多个会话同时重试
+        return random.uniform(0, min(RETRY_BACKOFF * 2 ** attempt, RETRY_BACKOFF_MAX))
+
+    def _should_retry(self, exc: BaseException, attempt: int, deadline: float) -> Optional[float]:
+        """需要重试时返回等待时间"""
+        if attempt >= self.policy.retries or not is_transient(exc):
+            return None
+        delay = self._backoff(attempt)
+        if time.monotonic() + delay >= deadline:
+            return None
+        self._count("retries")
+        return delay
+
+    def _give_up(self, exc: Exception):
+        """不再重试时抛出错误；没有说明的超时补上上游名称，便于 Agent 理解"""
+        if isinstance(exc, TimeoutError) and not str(exc):
+            raise TimeoutError(f"{self.name} 请求超时") from exc
+        raise exc
+
+    def call(self, fn: Callable[[float], T]) -> T:
+        """同步调用：截止时间 + 重试 + 熔断（同步路径不做对冲）"""
+        self._admit()
+        started = time.monotonic()
+        deadline = started + self.policy.deadline
+        attempt = 0
+        while True:
+            timeout = max(min(self.policy.attempt_timeout, deadline - time.monotonic()), 1.0)
+            try:
+                result = fn(timeout)
+            except Exception as e:
+                if is_transient(e):
+                    self._count("timeouts" if isinstance(e, (TimeoutError, requests.Timeout)) else "transient_errors")
+                delay = self._should_retry(e, attempt, deadline)
+                if delay is None:
+                    self._finish(started, e)
+                    self._give_up(e)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._finish(started, None)
+            return result
+
+    async def acall(self, fn: Callable[[float], Awaitable[T]]) -> T:
+        """异步调用：截止时间 + 重试 + 对冲 + 熔断"""
+        self._admit()
+        try:
+            return await self._acall(fn)
+        except asyncio.CancelledError:
+            # 调用方取消（如规划预算用完）不代表上游故障，归还试探名额
+            self.breaker.release()
+            raise
+
+    async def _acall(self, fn: Callable[[float], Awaitable[T]]) -> T:
+        started = time.monotonic()
+        deadline = started + self.policy.deadline
+        attempt = 0
+        while True:
+            timeout = max(min(self.policy.attempt_timeout, deadline - time.monotonic()), 1.0)
+            try:
+                result = await asyncio.wait_for(self._hedged(fn, timeout), timeout=timeout + self.policy.grace)
+            except Exception as e:
+                if is_transient(e):
+                    self._count("timeouts" if isinstance(e, asyncio.TimeoutError) else "transient_errors")
+                delay = self._should_retry(e, attempt, deadline)
+                if delay is None:
+                    self._finish(started, e)
+                    self._give_up(e)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self._finish(started, None)
+            return result
+
+    async def _hedged(self, fn: Callable[[float], Awaitable[T]], timeout: float) -> T:
+        hedge_after = self.policy.hedge_after
+        if hedge_after is None or hedge_after >= timeout:
+            return await fn(timeout)
+
+        primary = asyncio.ensure_future(fn(timeout))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                self._count("hedges")
+                tasks.append(asyncio.ensure_future(fn(timeout - hedge_after)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._count("hedge_wins")
+                        return task.result()
+            # 两个请求都失败时抛出主请求的错误
+            return primary.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+# ==================== 进程级注册表 ====================
+_upstreams: Dict[str, Upstream] = {}
+_upstreams_lock = threading.Lock()
+
+
+def get_upstream(name: str) -> Upstream:
+    """返回名称对应的上游，所有会话共享同一个熔断器和指标"""
+    with _upstreams_lock:
+        if name not in _upstreams:
+            _upstreams[name] = Upstream(name, UPSTREAM_POLICIES.get(name, DEFAULT_POLICY))
+        return _upstreams[name]
+
+
+def upstream_stats() -> Dict[str, Dict[str, Any]]:
+    with _upstreams_lock:
+        upstreams = list(_upstreams.values())
+    return {u.name: u.stats() for u in upstreams}